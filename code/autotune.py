@@ -0,0 +1,113 @@
+import argparse
+import json
+import numpy as np
+import os
+import time
+
+from config import BATCH_PROFILE_FILE, BATCH_SIZES, GRAPH_CACHE_DIR, IMG_SIZE
+from model import close_model_rcnn, detect_boxes, load_model_rcnn
+
+REPEATS = 3
+
+
+def load_profile(path=BATCH_PROFILE_FILE):
+    """
+        Seconds per batch of each batch size, measured by autotune
+
+    Args:
+        path (str, optional): path of the profile, None to not use one
+
+    Returns:
+        dict: batch size to seconds per batch, None if there is no profile
+    """
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as profile_file:
+        profile = json.load(profile_file)
+    return {
+        int(batch_size): seconds
+        for batch_size, seconds in profile['seconds_per_batch'].items()
+    }
+
+
+def measure(batch_size, repeats=REPEATS, graph_dir=GRAPH_CACHE_DIR):
+    """
+        Best time to detect one batch of random images
+
+    Args:
+        batch_size (int): number of images per batch
+        repeats (int, optional): number of timed runs after a warm up run
+        graph_dir (str, optional): folder of exported graphs
+
+    Returns:
+        float: seconds per batch
+    """
+    model = load_model_rcnn(batch_size, graph_dir)
+    random = np.random.RandomState(0)
+    images = list(
+        random.randint(0, 256, (batch_size, IMG_SIZE, IMG_SIZE, 3), np.uint8)
+    )
+    detect_boxes(model, images)
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        detect_boxes(model, images)
+        best = min(best, time.perf_counter() - start)
+    close_model_rcnn(model)
+    return best
+
+
+def autotune(
+    batch_sizes=BATCH_SIZES,
+    output=BATCH_PROFILE_FILE,
+    repeats=REPEATS,
+    graph_dir=GRAPH_CACHE_DIR
+):
+    """
+        Measure the throughput of every batch size on this machine and save
+        the profile used to choose batch sizes per scene
+
+    Args:
+        batch_sizes (list, optional): batch sizes to measure
+        output (str, optional): path of the profile
+        repeats (int, optional): number of timed runs per batch size
+        graph_dir (str, optional): folder of exported graphs
+
+    Returns:
+        dict: the saved profile
+    """
+    seconds_per_batch = dict()
+    for batch_size in batch_sizes:
+        seconds = measure(batch_size, repeats, graph_dir)
+        seconds_per_batch[str(batch_size)] = seconds
+        print(
+            f"batch size {batch_size}: {seconds:.3f}s per batch, "
+            f"{batch_size / seconds:.2f} images/s"
+        )
+    best = max(
+        batch_sizes, key=lambda size: size / seconds_per_batch[str(size)]
+    )
+    profile = {
+        'seconds_per_batch': seconds_per_batch,
+        'best': best,
+        'cpu_count': os.cpu_count()
+    }
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    print(f"best batch size: {best}, profile saved to {output}")
+    return profile
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Measure Mask R-CNN throughput per batch size'
+    )
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=BATCH_SIZES
+    )
+    parser.add_argument('--output', default=BATCH_PROFILE_FILE)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    args = parser.parse_args()
+
+    autotune(args.batch_sizes, args.output, args.repeats)
@@ -0,0 +1,91 @@
+import numpy as np
+
+from config import IMG_SIZE
+
+# shared by every filler slot, read only so it can't be modified in place
+FILLER_IMAGE = np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8)
+FILLER_IMAGE.setflags(write=False)
+
+
+class TileBatch:
+
+    def __init__(self):
+        """
+            Initializer. Holds the real tiles of a model batch, filler slots
+            are only added when the model inputs are built.
+        """
+        self.images = list()
+        self.bounding_boxes = list()
+        self.tiles = list()
+
+    def __len__(self):
+        return len(self.images)
+
+    def add(self, image, bounding_box, tile):
+        """
+            Add a real tile to the batch
+
+        Args:
+            image (numpy.ndarray): decoded tile image
+            bounding_box (list): [west, south, east, north] of the tile
+            tile (tuple): x, y index of the tile
+        """
+        self.images.append(image)
+        self.bounding_boxes.append(bounding_box)
+        self.tiles.append(tile)
+
+    def inputs(self, batch_size):
+        """
+            Images to be passed to the model, padded with blank filler up to
+            the batch size the model was built for
+
+        Args:
+            batch_size (int): batch size of the model
+
+        Returns:
+            list: list of images, real tiles first
+        """
+        return self.images + [FILLER_IMAGE] * (batch_size - len(self.images))
+
+
+class TileReport:
+
+    def __init__(self, requested):
+        """
+            Initializer. Accounts for every tile requested for a scene.
+
+        Args:
+            requested (int): number of tiles requested
+        """
+        self.requested = requested
+        self.fetched = 0
+        self.missing = list()
+        self.empty = list()
+
+    def add_missing(self, x_index, y_index, status_code):
+        """
+            Record a tile which could not be downloaded
+
+        Args:
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+            status_code (int): status code returned for the tile
+        """
+        self.missing.append((x_index, y_index, status_code))
+
+    def add_empty(self, x_index, y_index, bounding_box):
+        """
+            Record a downloaded tile rejected for having too few valid pixels
+
+        Args:
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+            bounding_box (list): [west, south, east, north] of the tile
+        """
+        self.empty.append((x_index, y_index, bounding_box))
+
+    def __str__(self):
+        return (
+            f"requested: {self.requested}, fetched: {self.fetched}, "
+            f"missing: {len(self.missing)}, empty: {len(self.empty)}"
+        )
@@ -0,0 +1,675 @@
+import argparse
+import datetime
+import json
+import numpy as np
+import os
+import subprocess
+import threading
+import time
+import tracemalloc
+
+from batching import TileBatch
+from config import (
+    GRAPH_CACHE_DIR,
+    IMG_SIZE,
+    MIN_VALID_FRACTION,
+    MOSAIC_OVERLAP,
+    TILE_SIZE
+)
+from functools import partial
+from georeference import box_iou, feature_boxes
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from infer import Infer
+from io import BytesIO
+from inference_pool import InferencePool
+from model import detect_boxes, load_model_rcnn, make_model_rcnn, merge_masks
+from PIL import Image
+from tile_fetcher import TileFetcher
+
+BATCH_SIZE = 32
+EXPORT_BATCH_SIZE = 8
+INSTANCES = 10
+PARITY_IOU = 0.3
+POOL_BATCHES = 16
+POOL_BATCH_SIZE = 8
+POOL_WORKERS = [1, 2, 4]
+REPEATS = 5
+STAGE_BATCH_SIZE = 2
+STAGE_OUTPUT = 'stage_benchmark.json'
+STAGE_TILES = 32
+
+
+def merge_masks_loop(masks):
+    """
+        Label merging as predict_rcnn used to do it, kept as the baseline
+
+    Args:
+        masks (numpy.ndarray): (height, width, instances) instance masks
+
+    Returns:
+        numpy.ndarray: (height, width) label image
+    """
+    zero_masks = np.zeros((*masks.shape[:2], 1))
+    if masks.shape[2] == 0:
+        masks = zero_masks
+    masks = np.moveaxis(masks, -1, 0)
+    local_final_preds = zero_masks[:, :, 0]
+    for index, mask in enumerate(masks, 1):
+        local_final_preds = np.add(local_final_preds, mask * index)
+    return local_final_preds
+
+
+def synthetic_masks(batch_size, instances, size=IMG_SIZE, seed=0):
+    """
+        Random rectangular ship masks, shaped like model.detect output
+
+    Args:
+        batch_size (int): number of images
+        instances (int): number of instances per image
+        size (int, optional): height and width of the masks
+        seed (int, optional): random seed
+
+    Returns:
+        list: list of (size, size, instances) boolean masks
+    """
+    random = np.random.RandomState(seed)
+    batch = list()
+    for _ in range(batch_size):
+        masks = np.zeros((size, size, instances), dtype=bool)
+        for index in range(instances):
+            row, col = random.randint(0, size - 40, 2)
+            height, width = random.randint(5, 40, 2)
+            masks[row:row + height, col:col + width, index] = True
+        batch.append(masks)
+    return batch
+
+
+def time_call(function, repeats):
+    """
+        Best wall time of a function over a number of runs
+
+    Args:
+        function (callable): function without arguments
+        repeats (int): number of runs
+
+    Returns:
+        float: best time in seconds
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_merge(batch_size=BATCH_SIZE, instances=INSTANCES, repeats=REPEATS):
+    """
+        Compare the vectorized label merge against the per instance loop
+
+    Args:
+        batch_size (int, optional): number of images per batch
+        instances (int, optional): number of instances per image
+        repeats (int, optional): number of runs, the best one is reported
+
+    Returns:
+        dict: seconds per batch for both implementations
+    """
+    batch = synthetic_masks(batch_size, instances)
+    loop_time = time_call(
+        lambda: [merge_masks_loop(masks) for masks in batch], repeats
+    )
+    vectorized_time = time_call(
+        lambda: np.stack([merge_masks(masks) for masks in batch]), repeats
+    )
+    results = {
+        'batch_size': batch_size,
+        'instances': instances,
+        'loop': loop_time,
+        'vectorized': vectorized_time,
+        'speedup': loop_time / vectorized_time
+    }
+    print(
+        f"merge {batch_size}x{instances}: loop {loop_time:.4f}s, "
+        f"vectorized {vectorized_time:.4f}s, "
+        f"speedup {results['speedup']:.1f}x"
+    )
+    return results
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_tiles(fixture_dir):
+    """
+        Serve fixture tiles over http on a random local port, laid out as
+        <fixture_dir>/<scene_id>/<x>/<y>.png
+
+    Args:
+        fixture_dir (str): folder of fixture tiles
+
+    Returns:
+        tuple: server, tile url template for TileFetcher
+    """
+    server = ThreadingHTTPServer(
+        ('127.0.0.1', 0), partial(QuietHandler, directory=fixture_dir)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/{{}}/{{}}/{{}}.png?api_key={{}}"
+    return server, url
+
+
+def fixture_indices(fixture_dir, scene_id):
+    """
+        x, y indices of the fixture tiles of a scene
+
+    Args:
+        fixture_dir (str): folder of fixture tiles
+        scene_id (str): scene id, sub folder of fixture_dir
+
+    Returns:
+        list: sorted list of x, y indices
+    """
+    indices = list()
+    scene_dir = os.path.join(fixture_dir, scene_id)
+    for x_index in os.listdir(scene_dir):
+        for filename in os.listdir(os.path.join(scene_dir, x_index)):
+            y_index, extension = os.path.splitext(filename)
+            if extension == '.png':
+                indices.append((int(x_index), int(y_index)))
+    return sorted(indices)
+
+
+def detection_parity(reference, candidate, iou=PARITY_IOU):
+    """
+        Match detections of two runs by the overlap of their boxes
+
+    Args:
+        reference (list): geojson features of the reference run
+        candidate (list): geojson features of the compared run
+        iou (float, optional): minimum intersection over union of a match
+
+    Returns:
+        dict: fraction of reference detections found by the candidate, and of
+        candidate detections found by the reference
+    """
+    return box_parity(feature_boxes(reference), feature_boxes(candidate), iou)
+
+
+def box_parity(reference_boxes, candidate_boxes, iou=PARITY_IOU):
+    """
+        Match two sets of boxes by their overlap
+
+    Args:
+        reference_boxes (numpy.ndarray): (N, 4) boxes of the reference run
+        candidate_boxes (numpy.ndarray): (M, 4) boxes of the compared run, in
+            the same corner order
+
+    Returns:
+        dict: fraction of reference boxes found by the candidate, and of
+        candidate boxes found by the reference
+    """
+    matched = np.zeros((len(reference_boxes), len(candidate_boxes)), dtype=bool)
+    for index, box in enumerate(reference_boxes):
+        matched[index] = box_iou(box, candidate_boxes) >= iou
+    return {
+        'recall': float(matched.any(axis=1).mean())
+        if len(reference_boxes) else 1.0,
+        'precision': float(matched.any(axis=0).mean())
+        if len(candidate_boxes) else 1.0
+    }
+
+
+def benchmark_mosaic(fixture_dir, scene_id, overlap=MOSAIC_OVERLAP):
+    """
+        Compare the mosaic input mode against upsampling every tile, served
+        from a local tile server
+
+    Args:
+        fixture_dir (str): folder of fixture tiles
+        scene_id (str): scene id, sub folder of fixture_dir
+        overlap (int, optional): overlap of mosaic canvases in pixels
+
+    Returns:
+        dict: tiles per second and detections of each mode, and the parity
+        of mosaic detections against the upsampled ones
+    """
+    server, url = serve_tiles(fixture_dir)
+    infer = Infer(
+        tile_cache_dir=None, water_index_file=None, mosaic_overlap=overlap
+    )
+    infer.tile_fetcher = TileFetcher(None, url=url)
+    indices = fixture_indices(fixture_dir, scene_id)
+    results = dict()
+    features = dict()
+    for mode in ('upsample', 'mosaic'):
+        infer.input_mode = mode
+        start = time.perf_counter()
+        features[mode] = [
+            geojson
+            for _, geojsons in infer.detect_scene(scene_id, indices)
+            for geojson in geojsons
+        ]
+        elapsed = time.perf_counter() - start
+        results[mode] = {
+            'seconds': elapsed,
+            'tiles_per_second': len(indices) / elapsed,
+            'detections': len(features[mode])
+        }
+        print(
+            f"{mode}: {len(indices)} tiles, "
+            f"{results[mode]['tiles_per_second']:.2f} tiles/s, "
+            f"{results[mode]['detections']} detections"
+        )
+    results['parity'] = detection_parity(features['upsample'], features['mosaic'])
+    print(f"mosaic parity: {results['parity']}")
+    server.shutdown()
+    return results
+
+
+def synthetic_batches(batches, batch_size, seed=0):
+    """
+        Batches of random tiles
+
+    Args:
+        batches (int): number of batches
+        batch_size (int): tiles per batch
+        seed (int, optional): random seed
+
+    Returns:
+        list: list of TileBatch
+    """
+    random = np.random.RandomState(seed)
+    synthetic = list()
+    for _ in range(batches):
+        batch = TileBatch()
+        for image in random.randint(
+            0, 256, (batch_size, IMG_SIZE, IMG_SIZE, 3), np.uint8
+        ):
+            batch.add(image, None, None)
+        synthetic.append(batch)
+    return synthetic
+
+
+def benchmark_pool(
+    workers=POOL_WORKERS, batches=POOL_BATCHES, batch_size=POOL_BATCH_SIZE
+):
+    """
+        Throughput of the inference pool on synthetic tiles for a number of
+        worker counts
+
+    Args:
+        workers (list, optional): worker counts to measure
+        batches (int, optional): number of batches per run
+        batch_size (int, optional): tiles per batch
+
+    Returns:
+        dict: tiles per second and speedup over one worker, per worker count
+    """
+    synthetic = synthetic_batches(batches, batch_size)
+    results = dict()
+    for count in workers:
+        pool = InferencePool(count)
+        # models are loaded by the first batches a worker gets
+        for _ in pool.detect(synthetic[:2 * count], batch_size):
+            pass
+        start = time.perf_counter()
+        for _ in pool.detect(synthetic, batch_size):
+            pass
+        elapsed = time.perf_counter() - start
+        pool.close()
+        tiles_per_second = batches * batch_size / elapsed
+        results[count] = {
+            'tiles_per_second': tiles_per_second,
+            'speedup': tiles_per_second / results[workers[0]]['tiles_per_second']
+            if results else 1.0
+        }
+        print(
+            f"{count} workers: {tiles_per_second:.2f} tiles/s, "
+            f"speedup {results[count]['speedup']:.2f}x"
+        )
+    return results
+
+
+def fixture_images(fixture_dir, size=IMG_SIZE):
+    """
+        png tiles of a folder, resized for the model
+
+    Args:
+        fixture_dir (str): folder of png tiles
+        size (int, optional): height and width of the images
+
+    Returns:
+        list: list of (size, size, 3) images
+    """
+    images = list()
+    for filename in sorted(os.listdir(fixture_dir)):
+        if not filename.endswith('.png'):
+            continue
+        image = Image.open(os.path.join(fixture_dir, filename)).convert('RGB')
+        if image.size != (size, size):
+            image = image.resize((size, size))
+        images.append(np.asarray(image))
+    return images
+
+
+def run_detections(model, images, batch_size):
+    """
+        Detect boxes on images, one padded batch at a time
+
+    Args:
+        model (mrcnn.model.MaskRCNN): model of the batch size
+        images (list): list of images
+        batch_size (int): batch size of the model
+
+    Returns:
+        tuple: list of predictions per image, seconds spent detecting
+    """
+    predictions = list()
+    elapsed = 0.0
+    for start in range(0, len(images), batch_size):
+        batch = TileBatch()
+        for image in images[start:start + batch_size]:
+            batch.add(image, None, None)
+        detect_start = time.perf_counter()
+        preds = detect_boxes(model, batch.inputs(batch_size))
+        elapsed += time.perf_counter() - detect_start
+        predictions.extend(preds[:len(batch)])
+    return predictions, elapsed
+
+
+def benchmark_export(
+    fixture_dir,
+    optimization='optimize',
+    batch_size=EXPORT_BATCH_SIZE,
+    graph_dir=GRAPH_CACHE_DIR
+):
+    """
+        Compare an optimized graph against the keras model built from the
+        original weights, on a folder of png tiles
+
+    Args:
+        fixture_dir (str): folder of png tiles
+        optimization (str, optional): 'optimize' or 'quantize'
+        batch_size (int, optional): batch size of both models
+        graph_dir (str, optional): folder of exported graphs
+
+    Returns:
+        dict: images per second of both models, and parity of the optimized
+        detections against the original ones
+    """
+    images = fixture_images(fixture_dir)
+    models = {
+        'original': load_model_rcnn(batch_size, None),
+        optimization: load_model_rcnn(batch_size, graph_dir, None, optimization)
+    }
+    predictions = dict()
+    results = dict()
+    for name, model in models.items():
+        # first run includes graph warm up
+        run_detections(model, images[:batch_size], batch_size)
+        predictions[name], elapsed = run_detections(model, images, batch_size)
+        results[name] = {
+            'seconds': elapsed,
+            'images_per_second': len(images) / elapsed if elapsed else 0.0,
+            'detections': sum(len(pred['rois']) for pred in predictions[name])
+        }
+        print(
+            f"{name}: {results[name]['images_per_second']:.2f} images/s, "
+            f"{results[name]['detections']} detections"
+        )
+    reference_boxes = list()
+    candidate_boxes = list()
+    for reference, candidate in zip(
+        predictions['original'], predictions[optimization]
+    ):
+        parity = box_parity(reference['rois'], candidate['rois'])
+        reference_boxes.append(parity['recall'] * len(reference['rois']))
+        candidate_boxes.append(parity['precision'] * len(candidate['rois']))
+    reference_count = results['original']['detections']
+    candidate_count = results[optimization]['detections']
+    results['parity'] = {
+        'recall': sum(reference_boxes) / reference_count
+        if reference_count else 1.0,
+        'precision': sum(candidate_boxes) / candidate_count
+        if candidate_count else 1.0
+    }
+    results['speedup'] = (
+        results[optimization]['images_per_second'] /
+        max(results['original']['images_per_second'], 1e-9)
+    )
+    print(f"{optimization} parity: {results['parity']}")
+    print(f"{optimization} speedup: {results['speedup']:.2f}x")
+    return results
+
+
+def synthetic_pngs(count, size=TILE_SIZE, seed=0):
+    """
+        Random opaque png tiles, encoded like the tiles served by Planet
+
+    Args:
+        count (int): number of tiles
+        size (int, optional): height and width of the tiles
+        seed (int, optional): random seed
+
+    Returns:
+        list: list of png bytes
+    """
+    random = np.random.RandomState(seed)
+    tiles = list()
+    for _ in range(count):
+        pixels = random.randint(0, 256, (size, size, 4), np.uint8)
+        pixels[..., 3] = 255
+        content = BytesIO()
+        Image.fromarray(pixels, 'RGBA').save(content, format='PNG')
+        tiles.append(content.getvalue())
+    return tiles
+
+
+def measure_stage(name, function, tiles, repeats=REPEATS):
+    """
+        Time a stage, and measure the peak python memory of one more run
+
+    Args:
+        name (str): name of the stage
+        function (callable): function without arguments running the stage
+        tiles (int): number of tiles the stage processes per run
+        repeats (int, optional): number of timed runs
+
+    Returns:
+        dict: best seconds per run, tiles per second and peak memory in bytes
+    """
+    seconds = time_call(function, repeats)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results = {
+        'seconds': seconds,
+        'tiles_per_second': tiles / seconds if seconds else float('inf'),
+        'peak_memory': peak
+    }
+    print(
+        f"{name}: {results['tiles_per_second']:.1f} tiles/s, "
+        f"peak memory {peak / 1024 ** 2:.1f} MiB"
+    )
+    return results
+
+
+def git_commit():
+    """
+        Commit of the working copy, to compare saved results across commits
+
+    Returns:
+        str: commit hash, None outside of a git checkout
+    """
+    try:
+        output = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.decode().strip()
+
+
+def benchmark_stages(
+    tiles=STAGE_TILES,
+    batch_size=STAGE_BATCH_SIZE,
+    output=STAGE_OUTPUT,
+    repeats=REPEATS,
+    detect=True
+):
+    """
+        Time every stage of the pipeline on its own, offline, with synthetic
+        tiles and a Mask R-CNN with random weights
+
+    Args:
+        tiles (int, optional): number of synthetic tiles
+        batch_size (int, optional): batch size of the model
+        output (str, optional): path of the json results, None to not save
+        repeats (int, optional): number of timed runs per stage
+        detect (bool, optional): False skips building the model and the
+            detect stage
+
+    Returns:
+        dict: results of every stage, with the commit they were measured on
+    """
+    pngs = synthetic_pngs(tiles)
+    # decode_tile and xy_to_latlon don't need the model, nor the network
+    infer = Infer.__new__(Infer)
+    infer.min_valid_fraction = MIN_VALID_FRACTION
+    images = [infer.decode_tile(content) for content in pngs]
+    bounding_box = [-122.4, 37.7, -122.39, 37.71]
+
+    def assemble():
+        batches = list()
+        for start in range(0, tiles, batch_size):
+            batch = TileBatch()
+            for image in images[start:start + batch_size]:
+                batch.add(image, bounding_box, None)
+            batches.append(batch.inputs(batch_size))
+        return batches
+
+    masks = synthetic_masks(tiles, INSTANCES)
+    labels = [merge_masks(instance_masks) for instance_masks in masks]
+    features = [
+        feature
+        for label in labels
+        for feature in infer.xy_to_latlon(label, bounding_box)
+    ]
+    stages = {
+        'decode': measure_stage(
+            'decode', lambda: [infer.decode_tile(content) for content in pngs],
+            tiles, repeats
+        ),
+        'batch': measure_stage('batch', assemble, tiles, repeats)
+    }
+    if detect:
+        model = make_model_rcnn(batch_size, weights=None)
+        batches = assemble()
+        # first run builds the predict function
+        model.detect(batches[0])
+        stages['detect'] = measure_stage(
+            'detect', lambda: [model.detect(batch) for batch in batches],
+            len(batches) * batch_size, repeats
+        )
+    stages['merge'] = measure_stage(
+        'merge',
+        lambda: [merge_masks(instance_masks) for instance_masks in masks],
+        tiles, repeats
+    )
+    stages['georeference'] = measure_stage(
+        'georeference',
+        lambda: [infer.xy_to_latlon(label, bounding_box) for label in labels],
+        tiles, repeats
+    )
+    stages['serialize'] = measure_stage(
+        'serialize',
+        lambda: json.dumps({'type': 'FeatureCollection', 'features': features}),
+        tiles, repeats
+    )
+    results = {
+        'commit': git_commit(),
+        'date': datetime.datetime.utcnow().isoformat(),
+        'tiles': tiles,
+        'batch_size': batch_size,
+        'stages': stages
+    }
+    if output:
+        with open(output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"results saved to {output}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inference micro-benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    merge_parser = subparsers.add_parser('merge', help='mask to label merging')
+    merge_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    merge_parser.add_argument('--instances', type=int, default=INSTANCES)
+    merge_parser.add_argument('--repeats', type=int, default=REPEATS)
+    mosaic_parser = subparsers.add_parser(
+        'mosaic', help='mosaic input mode against upsampling'
+    )
+    mosaic_parser.add_argument(
+        'fixture_dir', help='tiles laid out as <scene_id>/<x>/<y>.png'
+    )
+    mosaic_parser.add_argument('scene_id')
+    mosaic_parser.add_argument('--overlap', type=int, default=MOSAIC_OVERLAP)
+    pool_parser = subparsers.add_parser(
+        'pool', help='inference pool throughput on synthetic tiles'
+    )
+    pool_parser.add_argument(
+        '--workers', type=int, nargs='+', default=POOL_WORKERS
+    )
+    pool_parser.add_argument('--batches', type=int, default=POOL_BATCHES)
+    pool_parser.add_argument('--batch-size', type=int, default=POOL_BATCH_SIZE)
+    export_parser = subparsers.add_parser(
+        'export', help='optimized graph against the original weights'
+    )
+    export_parser.add_argument('fixture_dir', help='folder of png tiles')
+    export_parser.add_argument(
+        '--optimization', choices=['optimize', 'quantize'], default='optimize'
+    )
+    export_parser.add_argument(
+        '--batch-size', type=int, default=EXPORT_BATCH_SIZE
+    )
+    stages_parser = subparsers.add_parser(
+        'stages', help='every pipeline stage on synthetic tiles, offline'
+    )
+    stages_parser.add_argument('--tiles', type=int, default=STAGE_TILES)
+    stages_parser.add_argument(
+        '--batch-size', type=int, default=STAGE_BATCH_SIZE
+    )
+    stages_parser.add_argument('--output', default=STAGE_OUTPUT)
+    stages_parser.add_argument('--repeats', type=int, default=REPEATS)
+    stages_parser.add_argument(
+        '--skip-detect', action='store_true', help='no model, no detect stage'
+    )
+    args = parser.parse_args()
+
+    if args.benchmark == 'merge':
+        benchmark_merge(args.batch_size, args.instances, args.repeats)
+    elif args.benchmark == 'mosaic':
+        benchmark_mosaic(args.fixture_dir, args.scene_id, args.overlap)
+    elif args.benchmark == 'pool':
+        benchmark_pool(args.workers, args.batches, args.batch_size)
+    elif args.benchmark == 'export':
+        benchmark_export(args.fixture_dir, args.optimization, args.batch_size)
+    elif args.benchmark == 'stages':
+        benchmark_stages(
+            args.tiles,
+            args.batch_size,
+            args.output,
+            args.repeats,
+            not args.skip_detect
+        )
+    else:
+        parser.print_help()
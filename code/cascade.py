@@ -0,0 +1,174 @@
+import argparse
+import numpy as np
+import os
+import time
+
+from batching import TileBatch
+from config import SCREEN_BATCH_SIZE, SCREEN_INPUT_SCALE, THRESHOLD
+
+
+class Cascade:
+
+    def __init__(
+        self,
+        screen_model,
+        batch_size,
+        threshold=THRESHOLD,
+        screen_batch_size=SCREEN_BATCH_SIZE
+    ):
+        """
+            Initializer. Screens tiles with the U-Net so only tiles likely to
+            contain ships go through Mask R-CNN.
+
+        Args:
+            screen_model (keras.models.Model): U-Net from load_from_path
+            batch_size (int): batch size of the Mask R-CNN model
+            threshold (float, optional): tiles whose max ship probability is
+                above it are passed on
+            screen_batch_size (int, optional): batch size of the U-Net
+        """
+        self.screen_model = screen_model
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.screen_batch_size = screen_batch_size
+        self.screened = 0
+        self.passed = 0
+        self.screen_batches = 0
+        self.detect_batches = 0
+        self.screen_time = 0.0
+
+    def scores(self, images):
+        """
+            Max ship probability of every image according to the U-Net
+
+        Args:
+            images (list): list of (IMG_SIZE, IMG_SIZE, 3) images
+
+        Returns:
+            numpy.ndarray: (N,) max probability per image
+        """
+        start = time.time()
+        probabilities = self.screen_model.predict(
+            np.stack(images).astype(np.float32) * SCREEN_INPUT_SCALE,
+            batch_size=self.screen_batch_size
+        )
+        self.screen_time += time.time() - start
+        return probabilities.reshape(len(images), -1).max(axis=1)
+
+    def screen(self, batches, batch_size=None):
+        """
+            Screen batches of tiles and repack the tiles which passed into
+            full batches for Mask R-CNN
+
+        Args:
+            batches (iterable): TileBatch objects, eg: from prepare_dataset
+            batch_size (int, optional): size of the repacked batches,
+                self.batch_size by default
+
+        Yields:
+            TileBatch: batches of at most batch_size tiles which passed the
+            screen, the last one may be partial
+        """
+        batch_size = batch_size or self.batch_size
+        passed = TileBatch()
+        for batch in batches:
+            if not len(batch):
+                continue
+            self.screen_batches += 1
+            self.screened += len(batch)
+            scores = self.scores(batch.images)
+            for index in np.flatnonzero(scores > self.threshold):
+                passed.add(
+                    batch.images[index],
+                    batch.bounding_boxes[index],
+                    batch.tiles[index]
+                )
+                self.passed += 1
+                if len(passed) == batch_size:
+                    self.detect_batches += 1
+                    yield passed
+                    passed = TileBatch()
+        if len(passed):
+            self.detect_batches += 1
+            yield passed
+
+    def stats(self):
+        """
+            Per stage counters
+
+        Returns:
+            dict: tiles screened and passed, batches run by each stage and
+            time spent screening
+        """
+        return {
+            'screened': self.screened,
+            'passed': self.passed,
+            'screen_batches': self.screen_batches,
+            'detect_batches': self.detect_batches,
+            'screen_time': round(self.screen_time, 3)
+        }
+
+
+def recall_check(infer, fixture_dir):
+    """
+        Compare the cascade with a Mask R-CNN only run on a folder of png
+        tiles. Recall is the fraction of tiles, and of detections, found by
+        Mask R-CNN alone which the cascade keeps.
+
+    Args:
+        infer (Infer): Infer instance with the cascade enabled
+        fixture_dir (str): folder of png tiles
+
+    Returns:
+        dict: tile and detection recall, and screening counters
+    """
+    images = list()
+    for filename in sorted(os.listdir(fixture_dir)):
+        if not filename.endswith('.png'):
+            continue
+        with open(os.path.join(fixture_dir, filename), 'rb') as tile_file:
+            image = infer.decode_tile(tile_file.read())
+        if image is not None:
+            images.append(image)
+
+    batch_size = infer.cascade.batch_size
+    detections = list()
+    for start in range(0, len(images), batch_size):
+        batch = TileBatch()
+        for image in images[start:start + batch_size]:
+            batch.add(image, None, None)
+        preds = infer.predict(batch.inputs(batch_size))[:len(batch)]
+        detections.extend(infer.count_detections(preds))
+
+    scores = np.concatenate([
+        infer.cascade.scores(images[start:start + batch_size])
+        for start in range(0, len(images), batch_size)
+    ]) if images else np.zeros(0)
+    passed = scores > infer.cascade.threshold
+    detections = np.asarray(detections, dtype=int)
+    detected = detections > 0
+    results = {
+        'tiles': len(images),
+        'tiles_with_ships': int(detected.sum()),
+        'passed': int(passed.sum()),
+        'tile_recall': float(
+            (detected & passed).sum() / max(detected.sum(), 1)
+        ),
+        'detection_recall': float(
+            detections[passed].sum() / max(detections.sum(), 1)
+        )
+    }
+    print(f"cascade recall: {results}")
+    return results
+
+
+if __name__ == '__main__':
+    from infer import Infer
+
+    parser = argparse.ArgumentParser(
+        description='Recall of the U-Net cascade against Mask R-CNN only'
+    )
+    parser.add_argument('fixture_dir', help='folder of png tiles')
+    args = parser.parse_args()
+
+    recall_check(Infer(cascade=True), args.fixture_dir)
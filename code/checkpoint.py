@@ -0,0 +1,237 @@
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    run TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    features TEXT NOT NULL,
+    PRIMARY KEY (run, scene_id, x, y)
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    run TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    PRIMARY KEY (run, scene_id)
+);
+CREATE TABLE IF NOT EXISTS uploads (
+    run TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    location TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (run, scene_id, location)
+);
+CREATE TABLE IF NOT EXISTS detections (
+    run TEXT NOT NULL,
+    scene_id TEXT NOT NULL,
+    location TEXT NOT NULL,
+    features TEXT NOT NULL,
+    PRIMARY KEY (run, scene_id, location)
+);
+CREATE TABLE IF NOT EXISTS forwarded (
+    run TEXT NOT NULL PRIMARY KEY
+);
+"""
+
+
+class Checkpoint:
+
+    def __init__(self, path, run):
+        """
+            Initializer. Records the progress of a run, eg: one SQS message,
+            so a redelivered message resumes where the last attempt stopped.
+
+        Args:
+            path (str): path of the sqlite database, shared by all runs, ''
+                for a temporary one removed once closed
+            run (str): key of the run, eg: '<message id>/<date>'
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.run = run
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def save_tiles(self, scene_id, detections):
+        """
+            Record tiles of a scene as detected, in one transaction
+
+        Args:
+            scene_id (str): planetscope scene id
+            detections (dict): x, y index of every tile to list of geojsons
+                detected on it, empty if none
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?)',
+                [
+                    (self.run, scene_id, x_index, y_index, json.dumps(features))
+                    for (x_index, y_index), features in detections.items()
+                ]
+            )
+
+    def tiles(self, scene_id):
+        """
+            Tiles of a scene detected by earlier attempts
+
+        Args:
+            scene_id (str): planetscope scene id
+
+        Returns:
+            dict: x, y index to list of geojsons detected on the tile
+        """
+        rows = self.connection.execute(
+            'SELECT x, y, features FROM tiles WHERE run = ? AND scene_id = ?',
+            (self.run, scene_id)
+        )
+        return {(x_index, y_index): json.loads(features)
+                for x_index, y_index, features in rows}
+
+    def complete_scene(self, scene_id):
+        """
+            Record every tile of a scene as detected
+
+        Args:
+            scene_id (str): planetscope scene id
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO scenes VALUES (?, ?)',
+                (self.run, scene_id)
+            )
+
+    def scene_complete(self, scene_id):
+        """
+            Whether every tile of a scene was detected
+
+        Args:
+            scene_id (str): planetscope scene id
+
+        Returns:
+            bool: True if complete_scene was called for it
+        """
+        return self.connection.execute(
+            'SELECT 1 FROM scenes WHERE run = ? AND scene_id = ?',
+            (self.run, scene_id)
+        ).fetchone() is not None
+
+    def save_upload(self, scene_id, location, count):
+        """
+            Record the detections of a location on a scene as uploaded
+
+        Args:
+            scene_id (str): planetscope scene id
+            location (str): label of the extent
+            count (int): number of shapes uploaded
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)',
+                (self.run, scene_id, location, count)
+            )
+
+    def uploaded(self, scene_id, location):
+        """
+            Whether the detections of a location on a scene were uploaded
+
+        Args:
+            scene_id (str): planetscope scene id
+            location (str): label of the extent
+
+        Returns:
+            bool: True if save_upload was called for them
+        """
+        return self.connection.execute(
+            'SELECT 1 FROM uploads '
+            'WHERE run = ? AND scene_id = ? AND location = ?',
+            (self.run, scene_id, location)
+        ).fetchone() is not None
+
+    def upload_counts(self):
+        """
+            Number of shapes uploaded per location by earlier attempts
+
+        Returns:
+            dict: location to number of shapes
+        """
+        rows = self.connection.execute(
+            'SELECT location, SUM(count) FROM uploads WHERE run = ? '
+            'GROUP BY location',
+            (self.run,)
+        )
+        return dict(rows.fetchall())
+
+    def save_detections(self, scene_id, location, features):
+        """
+            Spool the detections of a location on a scene, until the
+            detections of the whole run are sent downstream
+
+        Args:
+            scene_id (str): planetscope scene id
+            location (str): label of the extent
+            features (list): list of geojson features
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO detections VALUES (?, ?, ?, ?)',
+                (self.run, scene_id, location, json.dumps(features))
+            )
+
+    def detections(self, location):
+        """
+            Detections of a location spooled by save_detections, scene after
+            scene in the order they were saved
+
+        Args:
+            location (str): label of the extent
+
+        Returns:
+            list: list of geojson features
+        """
+        rows = self.connection.execute(
+            'SELECT features FROM detections WHERE run = ? AND location = ? '
+            'ORDER BY rowid',
+            (self.run, location)
+        )
+        return [feature for features, in rows
+                for feature in json.loads(features)]
+
+    def save_forwarded(self):
+        """
+            Record the detections of the run as sent downstream
+        """
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO forwarded VALUES (?)', (self.run,)
+            )
+
+    def forwarded(self):
+        """
+            Whether the detections of the run were sent downstream
+
+        Returns:
+            bool: True if save_forwarded was called
+        """
+        return self.connection.execute(
+            'SELECT 1 FROM forwarded WHERE run = ?', (self.run,)
+        ).fetchone() is not None
+
+    def clear(self):
+        """
+            Forget the run, once its message is done
+        """
+        with self.connection:
+            for table in (
+                'tiles', 'scenes', 'uploads', 'detections', 'forwarded'
+            ):
+                self.connection.execute(
+                    f'DELETE FROM {table} WHERE run = ?', (self.run,)
+                )
+
+    def close(self):
+        self.connection.close()
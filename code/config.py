@@ -1,4 +1,12 @@
 ACCOUNT_NUMBER = '853558080719'
+
+# seconds per batch of each batch size, measured by autotune.py
+BATCH_PROFILE_FILE = '../weights/batch_profile.json'
+
+# Mask R-CNN batch sizes, the fastest one for the number of tiles is used
+# for each scene
+BATCH_SIZES = [4, 8, 16, 32]
+
 CACHE_SITES = [
     {
         'label': 'Los Angeles',
@@ -38,12 +46,31 @@ CACHE_SITES = [
     }
 ]
 
+# screen tiles with the U-Net before running Mask R-CNN
+CASCADE = False
+
+# progress of every message, so a redelivered one resumes where the last
+# attempt stopped, None disables checkpoints
+CHECKPOINT_FILE = '../data/checkpoints.sqlite'
+
 EDGE_CROP = 16
 EXTENTS = {
     'san_fran': [-123.43, 37.71, -123.30, 37.85]
 }
+
+# number of concurrent tile requests, also the size of the http pool
+FETCH_WORKERS = 16
+
 GAUSSIAN_NOISE = 0.1
 
+# exported Mask R-CNN graphs, loaded instead of rebuilding the keras model,
+# None always rebuilds it
+GRAPH_CACHE_DIR = '../weights/graphs'
+
+# None runs the exported graph as is, 'optimize' folds constants and batch
+# norms, 'quantize' also stores the weights in eight bits
+GRAPH_OPTIMIZATION = None
+
 GEOJSON_TEMPLATE = {
     "type": "Feature",
     "properties": {},
@@ -56,12 +83,80 @@ GEOJSON_TEMPLATE = {
 # downsampling in preprocessing
 IMG_SIZE = 768
 
+# Mask R-CNN worker processes for CPU nodes, 0 runs inference in the main
+# process
+INFERENCE_WORKERS = 0
+
+# 'upsample' resizes every tile to IMG_SIZE, 'mosaic' stitches native
+# resolution tiles into IMG_SIZE canvases
+INPUT_MODE = 'upsample'
+
+# merge detections split across tile seams or reported by several scenes
+MERGE_DETECTIONS = True
+# overlapping detections with at least this intersection over union are merged
+MERGE_IOU = 0.3
+
+# metrics printed after each message, 'json' or 'prometheus'
+METRICS_FORMAT = 'json'
+# local port serving the metrics over http, None disables it
+METRICS_PORT = None
+METRICS_PREFIX = 'ship_detection_'
+
+# tiles with fewer valid, not transparent, pixels than this are not processed
+MIN_VALID_FRACTION = 0.05
+
+# tiles with less water than this are skipped before being fetched
+MIN_WATER_FRACTION = 0.01
+
+# overlap of neighbouring mosaic canvases in pixels
+MOSAIC_OVERLAP = 64
+
 # downsampling inside the network
 NET_SCALING = None
 
+# 'masks' builds detections from the instance masks, 'boxes' from the model
+# rois, faster and adds the confidence of every detection
+POSTPROCESS_MODE = 'masks'
+
+# number of batches prepared ahead of inference, 0 runs fetching and
+# inference one after the other
+PREFETCH_DEPTH = 2
+
+# None detects every scene covering a tile, 'cloud_cover' or 'latest' keeps
+# only the preferred scene of each tile
+SCENE_PREFERENCE = None
+
+# batch size of the U-Net screening stage
+SCREEN_BATCH_SIZE = 8
+
+# the U-Net takes pixels scaled to 0-1, Mask R-CNN takes them as they are
+# and subtracts its MEAN_PIXEL itself
+SCREEN_INPUT_SCALE = 1 / 255.0
+
+# seconds planet search results are reused for the same extent, date window
+# and filters, None disables the cache
+SEARCH_CACHE_TTL = 3600
+
+# messages received per poll, seconds a poll waits for messages and seconds
+# received messages stay hidden, extended while they are being handled
+SQS_MAX_MESSAGES = 10
+SQS_VISIBILITY_TIMEOUT = 300
+SQS_WAIT_SECONDS = 20
+
 THRESHOLD = 0.5
+
+# on-disk cache of downloaded tiles, shared by all workers on the host
+TILE_CACHE_DIR = '../data/tile_cache'
+# seconds tiles answered with 404 or 204 are not requested again
+TILE_CACHE_MISSING_TTL = 7 * 24 * 3600
+TILE_CACHE_SIZE = 5 * 1024 ** 3  # bytes
+
 TILE_SIZE = 256
 UPSAMPLE_MODE = 'SIMPLE'
+
+# per tile water fraction index, built with water_mask.py
+WATER_INDEX_FILE = '../weights/water_index.npz'
+
 WEIGHT_FILE = '../weights/iou_model.hdf5'
 ZOOM_LEVEL = 14  # 16 is in pixel resolution == 2.4m
 
@@ -0,0 +1,243 @@
+import numpy as np
+
+from config import IMG_SIZE, ZOOM_LEVEL
+
+
+def mercator_bounds(left, top, right, bottom, zoom=ZOOM_LEVEL):
+    """
+        Bounds of areas given in fractional web mercator tile coordinates
+
+    Args:
+        left (numpy.ndarray): x of the left edges, in tiles
+        top (numpy.ndarray): y of the top edges, in tiles
+        right (numpy.ndarray): x of the right edges, in tiles
+        bottom (numpy.ndarray): y of the bottom edges, in tiles
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        numpy.ndarray: (N, 4) [west, south, east, north] in degrees
+    """
+    count = 2.0 ** zoom
+    west = np.asarray(left, dtype=np.float64) / count * 360.0 - 180.0
+    east = np.asarray(right, dtype=np.float64) / count * 360.0 - 180.0
+    north = np.degrees(
+        np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(top) / count)))
+    )
+    south = np.degrees(
+        np.arctan(np.sinh(np.pi * (1 - 2 * np.asarray(bottom) / count)))
+    )
+    return np.stack([west, south, east, north], axis=1)
+
+
+def tile_bounds(tiles, zoom=ZOOM_LEVEL):
+    """
+        Bounds of web mercator tiles, same as mercantile.bounds for a whole
+        array of tiles at once
+
+    Args:
+        tiles (list): (N, 2) x, y indices of the tiles
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        numpy.ndarray: (N, 4) [west, south, east, north] in degrees
+    """
+    tiles = np.asarray(tiles, dtype=np.float64).reshape(-1, 2)
+    xs = tiles[:, 0]
+    ys = tiles[:, 1]
+    return mercator_bounds(xs, ys, xs + 1, ys + 1, zoom)
+
+
+def lonlat_to_tile_coordinates(lons, lats, zoom=ZOOM_LEVEL):
+    """
+        Fractional web mercator tile coordinates of points, the integer part
+        is the tile and the fraction the position inside it
+
+    Args:
+        lons (numpy.ndarray): longitudes in degrees
+        lats (numpy.ndarray): latitudes in degrees
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        numpy.ndarray: (N, 2) x, y in tiles
+    """
+    count = 2.0 ** zoom
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    xs = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * count
+    ys = (1.0 - np.log(np.tan(lats) + 1.0 / np.cos(lats)) / np.pi) / 2.0 * count
+    return np.stack([xs, ys], axis=1)
+
+
+def lonlat_to_tiles(lons, lats, zoom=ZOOM_LEVEL):
+    """
+        Tiles containing points, same as mercantile.tile for whole arrays
+
+    Args:
+        lons (numpy.ndarray): longitudes in degrees
+        lats (numpy.ndarray): latitudes in degrees
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        numpy.ndarray: (N, 2) x, y indices of the tiles
+    """
+    return np.floor(lonlat_to_tile_coordinates(lons, lats, zoom)).astype(
+        np.int64
+    )
+
+
+def feature_boxes(features):
+    """
+        Bounding boxes of polygon features
+
+    Args:
+        features (list): list of geojson features
+
+    Returns:
+        numpy.ndarray: (N, 4) [west, south, east, north] in degrees
+    """
+    boxes = np.zeros((len(features), 4))
+    for index, feature in enumerate(features):
+        ring = np.asarray(feature['geometry']['coordinates'][0])
+        boxes[index] = [
+            ring[:, 0].min(), ring[:, 1].min(), ring[:, 0].max(), ring[:, 1].max()
+        ]
+    return boxes
+
+
+def box_iou(box, boxes):
+    """
+        Intersection over union of a box with other boxes
+
+    Args:
+        box (numpy.ndarray): [west, south, east, north]
+        boxes (numpy.ndarray): (N, 4) [west, south, east, north]
+
+    Returns:
+        numpy.ndarray: (N,) intersection over union
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    width = np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+    height = np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    return np.where(union > 0, intersection / np.where(union > 0, union, 1), 0.0)
+
+
+def polygon_intersects_boxes(ring, boxes):
+    """
+        Whether a polygon overlaps boxes, eg: a scene footprint and tiles
+
+    Args:
+        ring (list): exterior ring of the polygon, [lon, lat] points
+        boxes (numpy.ndarray): (N, 4) [west, south, east, north]
+
+    Returns:
+        numpy.ndarray: (N,) True where the polygon and the box overlap
+    """
+    ring = np.asarray(ring, dtype=np.float64).reshape(-1, 2)
+    if not np.array_equal(ring[0], ring[-1]):
+        ring = np.concatenate([ring, ring[:1]])
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    starts, ends = ring[:-1], ring[1:]
+    steps = ends - starts
+    # every edge clipped to every box, (N, M) entry and exit along the edge
+    enter = np.zeros((len(boxes), len(starts)))
+    leave = np.ones((len(boxes), len(starts)))
+    for axis in (0, 1):
+        low = boxes[:, axis:axis + 1]
+        high = boxes[:, axis + 2:axis + 3]
+        start = starts[None, :, axis]
+        step = steps[None, :, axis]
+        moving = step != 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            near = (low - start) / np.where(moving, step, 1)
+            far = (high - start) / np.where(moving, step, 1)
+        enter = np.maximum(
+            enter, np.where(moving, np.minimum(near, far), -np.inf)
+        )
+        leave = np.minimum(
+            leave, np.where(moving, np.maximum(near, far), np.inf)
+        )
+        # edges parallel to the axis and outside of the box never reach it
+        leave = np.where(
+            ~moving & ((start < low) | (start > high)), -np.inf, leave
+        )
+    crossed = (enter <= leave).any(axis=1)
+    # boxes inside the polygon, a corner tested by ray casting
+    x, y = boxes[:, 0:1], boxes[:, 1:2]
+    straddles = (starts[None, :, 1] > y) != (ends[None, :, 1] > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = starts[None, :, 0] + (y - starts[None, :, 1]) * (
+            steps[None, :, 0] / steps[None, :, 1]
+        )
+    inside = np.count_nonzero(straddles & (x < x_cross), axis=1) % 2 == 1
+    return crossed | inside
+
+
+def boxes_to_lonlat(boxes, bounds, size=IMG_SIZE):
+    """
+        Convert pixel boxes to lon, lat. Same as rasterio.transform.xy on the
+        transform of rasterio.transform.from_bounds, which uses pixel centers.
+
+    Args:
+        boxes (numpy.ndarray): (N, 4) [min_row, min_col, max_row, max_col]
+        bounds (numpy.ndarray): (N, 4) [west, south, east, north] of the image
+            each box was detected in
+        size (int, optional): height and width of the images in pixels
+
+    Returns:
+        numpy.ndarray: (N, 4) lon of min_col, lat of min_row, lon of max_col,
+        lat of max_row
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+    x_resolution = (bounds[:, 2] - bounds[:, 0]) / size
+    y_resolution = (bounds[:, 3] - bounds[:, 1]) / size
+    lons = bounds[:, 0:1] + (boxes[:, [1, 3]] + 0.5) * x_resolution[:, None]
+    lats = bounds[:, 3:4] - (boxes[:, [0, 2]] + 0.5) * y_resolution[:, None]
+    return np.stack([lons[:, 0], lats[:, 0], lons[:, 1], lats[:, 1]], axis=1)
+
+
+def boxes_to_features(boxes, bounds, scores=None, size=IMG_SIZE):
+    """
+        Convert pixel boxes into geojson features
+
+    Args:
+        boxes (numpy.ndarray): (N, 4) [min_row, min_col, max_row, max_col]
+        bounds (numpy.ndarray): (N, 4) [west, south, east, north] of the image
+            each box was detected in
+        scores (numpy.ndarray, optional): (N,) detection scores, added to the
+            properties as confidence
+        size (int, optional): height and width of the images in pixels
+
+    Returns:
+        list: list of geojson features
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    corners = boxes_to_lonlat(boxes, bounds, size).tolist()
+    areas = (
+        np.abs(boxes[:, 2] - boxes[:, 0]) * np.abs(boxes[:, 3] - boxes[:, 1])
+    ).astype(int).tolist()
+    if scores is not None:
+        scores = np.asarray(scores, dtype=np.float64).tolist()
+    features = list()
+    for index, (left, down, right, up) in enumerate(corners):
+        properties = {'area': areas[index]}
+        if scores is not None:
+            properties['confidence'] = scores[index]
+        features.append({
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[
+                    [left, down],
+                    [right, down],
+                    [right, up],
+                    [left, up],
+                    [left, down]
+                ]]
+            }
+        })
+    return features
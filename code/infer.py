@@ -1,62 +1,179 @@
-import math
-import mercantile
+import datetime
 import json
 import requests
+import itertools
 import numpy as np
-import rasterio
 import tensorflow as tf
+import time
 
 from config import (
+    BATCH_PROFILE_FILE,
+    BATCH_SIZES,
     CACHE_SITES,
+    CASCADE,
     EXTENTS,
+    FETCH_WORKERS,
+    GRAPH_CACHE_DIR,
+    GRAPH_OPTIMIZATION,
     IMG_SIZE,
+    INFERENCE_WORKERS,
+    INPUT_MODE,
+    MERGE_DETECTIONS,
+    MIN_VALID_FRACTION,
+    MIN_WATER_FRACTION,
+    MOSAIC_OVERLAP,
+    POSTPROCESS_MODE,
+    PREFETCH_DEPTH,
+    SCENE_PREFERENCE,
     THRESHOLD,
+    TILE_CACHE_DIR,
+    TILE_CACHE_SIZE,
     TILE_SIZE,
-    ZOOM_LEVEL
+    WATER_INDEX_FILE
 )
 
-from copy import deepcopy
+from autotune import load_profile
+from batching import TileBatch, TileReport
+from cascade import Cascade
+from georeference import boxes_to_features, feature_boxes, tile_bounds
+from inference_pool import InferencePool
 from io import BytesIO
-from model import load_from_path, make_model_rcnn, predict_rcnn
+from merge import DetectionMerger
+from metrics import METRICS
+from model import (
+    close_model_rcnn,
+    detect_boxes,
+    load_from_path,
+    load_model_rcnn,
+    predict_rcnn
+)
 
 from PIL import (
     Image,
     ImageDraw
 )
 
+from mosaic import (
+    build_canvas,
+    canvas_bounds,
+    canvas_tiles,
+    detection_tiles,
+    plan_canvases
+)
 from planet_downloader import PlanetDownloader
+from prefetcher import Prefetcher
+from scheduler import TileScheduler, choose_batch_size
 from skimage.measure import regionprops
-
-GEOJSON_TEMPLATE = {
-    "type": "Feature",
-    "properties": {},
-    "geometry": {
-        "type": "Polygon",
-        "coordinates": []
-    }
-}
-
-IMGS_PER_GPU = 32
+from tile_cache import TileCache
+from tile_fetcher import TileFetcher
+from water_mask import WaterIndex
 
 SITE_URL = 'https://8ib71h0627.execute-api.us-east-1.amazonaws.com/v1/sites'
 
 # had to do this because of how we are running the script
 WEIGHT_FILE = '../weights/iou_model.hdf5'
-WMTS_URL = f"https://tiles1.planet.com/data/v1/PSScene3Band/{{}}/{ZOOM_LEVEL}/{{}}/{{}}.png?api_key={{}}"
 
 class Infer:
 
-    def __init__(self, weight_path=WEIGHT_FILE, credential=None):
+    def __init__(
+        self,
+        weight_path=WEIGHT_FILE,
+        credential=None,
+        fetch_workers=FETCH_WORKERS,
+        tile_cache_dir=TILE_CACHE_DIR,
+        prefetch_depth=PREFETCH_DEPTH,
+        postprocess=POSTPROCESS_MODE,
+        scene_preference=SCENE_PREFERENCE,
+        water_index_file=WATER_INDEX_FILE,
+        min_water_fraction=MIN_WATER_FRACTION,
+        min_valid_fraction=MIN_VALID_FRACTION,
+        cascade=CASCADE,
+        input_mode=INPUT_MODE,
+        mosaic_overlap=MOSAIC_OVERLAP,
+        merge_detections=MERGE_DETECTIONS,
+        graph_cache_dir=GRAPH_CACHE_DIR,
+        batch_sizes=BATCH_SIZES,
+        batch_profile_file=BATCH_PROFILE_FILE,
+        inference_workers=INFERENCE_WORKERS,
+        graph_optimization=GRAPH_OPTIMIZATION
+    ):
         """Initializer
 
         Args:
             weight_path (string, optional): Location of model weight file
             credential (None, optional): API credential to Planet
+            fetch_workers (int, optional): number of tiles downloaded concurrently
+            tile_cache_dir (str, optional): folder of the on-disk tile cache,
+                None disables caching
+            prefetch_depth (int, optional): number of batches fetched ahead of
+                inference, 0 disables prefetching
+            postprocess (str, optional): 'masks' to build detections from the
+                instance masks, 'boxes' to build them from the model rois
+            scene_preference (str, optional): None to detect every scene
+                covering a tile, 'cloud_cover' or 'latest' to detect only the
+                preferred scene of each tile
+            water_index_file (str, optional): per tile water fraction index,
+                None disables the land filter
+            min_water_fraction (float, optional): tiles with less water are
+                not processed
+            min_valid_fraction (float, optional): tiles with fewer valid,
+                not transparent, pixels are not processed
+            cascade (bool, optional): screen tiles with the U-Net loaded from
+                weight_path, only tiles likely to contain ships go through
+                Mask R-CNN
+            input_mode (str, optional): 'upsample' to resize every tile to
+                IMG_SIZE, 'mosaic' to stitch native resolution tiles into
+                IMG_SIZE canvases
+            mosaic_overlap (int, optional): overlap of mosaic canvases in pixels
+            merge_detections (bool, optional): merge detections of ships split
+                across tile seams, or reported by several scenes
+            graph_cache_dir (str, optional): folder of exported Mask R-CNN
+                graphs, None always rebuilds the keras model
+            batch_sizes (list, optional): Mask R-CNN batch sizes, one model
+                is kept loaded and replaced when another size is used
+            batch_profile_file (str, optional): seconds per batch of each
+                batch size, from autotune.py, used to choose batch sizes
+            inference_workers (int, optional): number of processes running
+                Mask R-CNN, 0 runs it in this process
+            graph_optimization (str, optional): None runs the exported graph
+                as is, 'optimize' or 'quantize' an optimized copy of it
         """
         self.weight_path = weight_path
-        self.model = make_model_rcnn(IMGS_PER_GPU)
+        self.graph_cache_dir = graph_cache_dir
+        self.graph_optimization = graph_optimization
+        self.batch_sizes = sorted(batch_sizes)
+        self.batch_profile = load_profile(batch_profile_file)
+        self.model = None
+        self.model_batch_size = None
+        self.inference_pool = None
+        if inference_workers:
+            self.inference_pool = InferencePool(
+                inference_workers,
+                postprocess,
+                graph_cache_dir,
+                graph_optimization=graph_optimization
+            )
+        else:
+            self.model_for(self.batch_sizes[-1])
         self.credential = credential
         self.planet_downloader = PlanetDownloader(credential)
+        self.tile_cache = None
+        if tile_cache_dir:
+            self.tile_cache = TileCache(tile_cache_dir, TILE_CACHE_SIZE)
+        self.tile_fetcher = TileFetcher(
+            credential, workers=fetch_workers, cache=self.tile_cache
+        )
+        self.prefetch_depth = prefetch_depth
+        self.postprocess = postprocess
+        self.scene_preference = scene_preference
+        self.water_index = WaterIndex(water_index_file, min_water_fraction)
+        self.min_valid_fraction = min_valid_fraction
+        self.cascade = None
+        if cascade:
+            self.cascade = Cascade(self.prepare_model(), self.batch_sizes[-1])
+        self.input_mode = input_mode
+        self.mosaic_overlap = mosaic_overlap
+        self.merge_detections = merge_detections
         self._extents = None
         print('gpu available:', tf.test.is_gpu_available())
 
@@ -83,6 +200,42 @@ class Infer:
         """
         return load_from_path(self.weight_path)
 
+    def model_for(self, batch_size):
+        """
+            Mask R-CNN model of a batch size. Only one model is kept in
+            memory, it is released before the model of another batch size is
+            loaded.
+
+        Args:
+            batch_size (int): number of images per batch
+
+        Returns:
+            mrcnn.model.MaskRCNN: model for the batch size
+        """
+        if self.model_batch_size != batch_size:
+            if self.model is not None:
+                close_model_rcnn(self.model)
+                self.model = None
+            self.model = load_model_rcnn(
+                batch_size,
+                self.graph_cache_dir,
+                optimization=self.graph_optimization
+            )
+            self.model_batch_size = batch_size
+        return self.model
+
+    def batch_size_for(self, count):
+        """
+            Batch size detecting a number of images fastest
+
+        Args:
+            count (int): number of images to detect
+
+        Returns:
+            int: one of the batch sizes
+        """
+        return choose_batch_size(count, self.batch_sizes, self.batch_profile)
+
 
     def extents(self):
         """
@@ -128,90 +281,490 @@ class Infer:
             Calculate the geojson based on the bounding box, and x, y coordinates
 
         Args:
-            predictions (list): List of predictions (masks of ships)
+            predictions (list): List of predictions, label images of ships in
+                'masks' mode, dicts of rois and scores in 'boxes' mode
             bounding_boxes (list): list of boundingboxes for the tiles on which
             inference was ran
 
         Returns:
             TYPE: List of geojsons
         """
-        geojsons = list()
-        for index, pred in enumerate(predictions):
-            geojsons.extend(
-                self.xy_to_latlon(np.asarray(pred), bounding_boxes[index])
-            )
+        geojsons, _ = self.georeference(predictions, bounding_boxes)
         return geojsons
 
-    def infer(self, date, extents=None):
+    def georeference(self, predictions, bounding_boxes):
+        """
+            Convert the predictions of a batch into geojsons. Boxes of the
+            whole batch are georeferenced in one pass.
+
+        Args:
+            predictions (list): List of predictions, label images of ships in
+                'masks' mode, dicts of rois and scores in 'boxes' mode
+            bounding_boxes (list): list of boundingboxes for the tiles on which
+            inference was ran
+
+        Returns:
+            tuple: list of geojsons, position of the tile of every geojson
+        """
+        boxes = list()
+        scores = list()
+        tile_positions = list()
+        for index, pred in enumerate(predictions):
+            if self.postprocess == 'masks':
+                rois = [ship.bbox for ship in regionprops(np.asarray(pred))]
+            else:
+                rois = pred['rois']
+                scores.extend(pred['scores'])
+            boxes.extend(rois)
+            tile_positions.extend([index] * len(rois))
+        if not boxes:
+            return list(), list()
+        bounds = np.asarray(bounding_boxes, dtype=np.float64)[tile_positions]
+        geojsons = boxes_to_features(
+            np.asarray(boxes), bounds, scores if scores else None
+        )
+        return geojsons, tile_positions
+
+    def prepare_range(self, start_date, end_date):
+        """Add time information to the first and last date of a range.
+
+        Args:
+            start_date (string): 'yyyy-mm-dd' formated first date
+            end_date (string): 'yyyy-mm-dd' formated last date, included
+
+        Returns:
+            list: [start date time, end date time]
+        """
+        return f"{start_date}T00:00:00Z", f"{end_date}T23:59:59Z"
+
+    def schedule(self, date, extents=None):
         """
-            Infer based on the extents provided or on the cached extents
+            Search the scenes of every extent and collect the tiles to be
+            detected. Tiles needed by several extents, or covered by several
+            scenes, are detected once.
 
         Args:
             date (str): date in 'yyyy-mm-dd' format
             extents (None, optional): list of extents in [left, bottom, right, top] format
 
         Returns:
-            dictionary: location wise detections, and total number of detections
+            tuple: TileScheduler with the tiles of every location, scene ids
+            of every location
         """
-        self.start_date_time, self.end_date_time = self.prepare_date(date)
-        location_wise_detections = []
+        return self.schedule_range(date, date, extents)[date]
+
+    def schedule_range(self, start_date, end_date, extents=None):
+        """
+            Search the scenes of every extent over a range of dates, one
+            search per extent, and schedule the scenes of every date
+            separately.
+
+        Args:
+            start_date (str): first date in 'yyyy-mm-dd' format
+            end_date (str): last date in 'yyyy-mm-dd' format, included
+            extents (None, optional): list of extents in [left, bottom, right, top] format
+
+        Returns:
+            dict: every date of the range to the result of self.schedule for
+            it, in date order
+        """
+        self.start_date_time, self.end_date_time = self.prepare_range(
+            start_date, end_date
+        )
         # saving this method call for when we are ready to do other locations
         # currently only running for sanfran, LA, and NY
         extents = extents or CACHE_SITES # extents or self.extents()
-        detection_count = 0
+        first = datetime.date.fromisoformat(start_date)
+        days = (datetime.date.fromisoformat(end_date) - first).days + 1
+        dates = [str(first + datetime.timedelta(days=day)) for day in range(days)]
+        date_items = {
+            date: {extent['label']: list() for extent in extents}
+            for date in dates
+        }
         for extent in extents:
             location = extent['label']
-            detections = list()
-            scene_ids = list()
             items = self.planet_downloader.search_ids(
                 extent['bounding_box'], self.start_date_time, self.end_date_time
             )
             print(f"Total scenes: {len(items)}")
             for item in items:
-                print(f"id: {item['id']}, tile range: {item['tiles']}")
-                scene_ids.append(item['id'])
+                # acquisition times are in UTC, as the search window
+                date = (item['acquired'] or start_date)[:10]
+                if date in date_items:
+                    date_items[date][location].append(item)
+        return {
+            date: self.schedule_items(location_items)
+            for date, location_items in date_items.items()
+        }
+
+    def schedule_items(self, location_items):
+        """
+            Collect the tiles of the scenes found for every location
+
+        Args:
+            location_items (dict): location to the scenes found for it by
+                PlanetDownloader.search_ids
+
+        Returns:
+            tuple: TileScheduler with the tiles of every location, scene ids
+            of every location
+        """
+        scheduler = TileScheduler(self.scene_preference)
+        scene_ids = dict()
+        for location, items in location_items.items():
+            saved_tiles = sum(item['saved_tiles'] for item in items)
+            print(f"tiles outside of {location} skipped: {saved_tiles}")
+            total_tiles = 0
+            land_tiles = 0
+            for item in items:
+                print(
+                    f"id: {item['id']}, tile range: {item['tiles']}, "
+                    f"scene tile range: {item['scene_tiles']}"
+                )
                 indices = self.prepare_indices(item['tiles'])
-                length = len(indices)
-                image_group = self.prepare_dataset(indices, item['id'])
-                print('total length:', length)
-                predictions = list()
-                for index, (imgs, bounding_boxes) in enumerate(image_group):
-                    print(index)
-                    preds = predict_rcnn(self.model, imgs)
-                    predictions.extend(self.calculate_geojson(preds, bounding_boxes))
-                    preds = []
-                # for memory management
-                del(image_group)
-                predictions = predictions[:length]
-                detection_count += len(predictions)
-                detections.extend(predictions)
-
-            location_wise_detections.append({
+                water_indices = self.water_index.filter(indices)
+                total_tiles += len(indices)
+                land_tiles += len(indices) - len(water_indices)
+                scheduler.add(location, item, water_indices)
+            print(
+                f"land tiles of {location} skipped: {land_tiles}/{total_tiles} "
+                f"({land_tiles / max(total_tiles, 1):.1%})"
+            )
+            scene_ids[location] = [item['id'] for item in items]
+        return scheduler, scene_ids
+
+    def infer_stream(self, date, extents=None, schedule=None, checkpoint=None):
+        """
+            Infer scene by scene, yielding the detections of every location
+            as soon as a scene is done. Partial and duplicate detections of a
+            ship on a scene are merged per location, nothing is kept from one
+            scene to the next.
+
+        Args:
+            date (str): date in 'yyyy-mm-dd' format
+            extents (None, optional): list of extents in [left, bottom, right, top] format
+            schedule (tuple, optional): result of self.schedule, searched
+                when not given
+            checkpoint (Checkpoint, optional): progress of earlier attempts,
+                tiles detected by them are not detected again but their
+                stored detections are yielded as before
+
+        Yields:
+            dict: location, scene_id, FeatureCollection of the detections of
+            the location on the scene, scene_ids of the location
+        """
+        scheduler, scene_ids = schedule or self.schedule(date, extents)
+        mergers = {location: DetectionMerger() for location in scene_ids}
+        units = scheduler.plan()
+        print(
+            f"tiles requested: {scheduler.requested}, "
+            f"unique: {scheduler.unique()}"
+        )
+        for scene_id, indices in units:
+            detections = {location: list() for location in scene_ids}
+            if checkpoint is None:
+                detected = self.detect_scene(scene_id, indices)
+            else:
+                detected = self.resume_scene(scene_id, indices, checkpoint)
+            for tile, geojsons in detected:
+                for location in scheduler.locations(scene_id, *tile):
+                    detections[location].extend(geojsons)
+            for location, features in detections.items():
+                if self.merge_detections and features:
+                    merger = mergers[location]
+                    with METRICS.timer('merge_seconds', location=location):
+                        merger.add(features)
+                        merged = merger.flush()
+                    print(
+                        f"merged detections of {location} on {scene_id}: "
+                        f"{len(features)} -> {len(merged)}"
+                    )
+                    features = merged
+                if not features:
+                    continue
+                METRICS.inc('detections', len(features), location=location)
+                yield {
+                    'location': location,
+                    'scene_id': scene_id,
+                    'geojson': {
+                        'type': 'FeatureCollection',
+                        'features': features
+                    },
+                    'scene_ids': scene_ids[location]
+                }
+        if self.tile_cache is not None:
+            print(f"tile cache: {self.tile_cache.stats()}")
+        if self.cascade is not None:
+            print(f"cascade: {self.cascade.stats()}")
+
+    def infer(self, date, extents=None, schedule=None):
+        """
+            Infer based on the extents provided or on the cached extents,
+            collecting everything infer_stream yields.
+
+        Args:
+            date (str): date in 'yyyy-mm-dd' format
+            extents (None, optional): list of extents in [left, bottom, right, top] format
+            schedule (tuple, optional): result of self.schedule, searched
+                when not given
+
+        Returns:
+            dictionary: location wise detections, and total number of detections
+        """
+        schedule = schedule or self.schedule(date, extents)
+        _, scene_ids = schedule
+        detections = {location: list() for location in scene_ids}
+        detection_count = 0
+        for chunk in self.infer_stream(date, extents, schedule):
+            features = chunk['geojson']['features']
+            detections[chunk['location']].extend(features)
+            detection_count += len(features)
+        return self.location_wise(detections, scene_ids), detection_count
+
+    def location_wise(self, detections, scene_ids):
+        """
+            Detections of a date in the shape sent downstream, every location
+            included even without detections
+
+        Args:
+            detections (dict): location to list of geojsons
+            scene_ids (dict): location to scene ids searched for it
+
+        Returns:
+            list: location, FeatureCollection and scene ids of every location
+        """
+        return [
+            {
                 'location': location,
                 'geojson': {
                     'type': 'FeatureCollection',
-                    'features': detections
+                    'features': detections.get(location, [])
                 },
-                'scene_ids': scene_ids
+                'scene_ids': location_scene_ids
+            }
+            for location, location_scene_ids in scene_ids.items()
+        ]
+
+    def infer_range(self, start_date, end_date, extents=None):
+        """
+            Infer every date of a range in one run. Scenes of the whole range
+            are searched at once and detected date after date with the same
+            models, connections and tile cache.
+
+        Args:
+            start_date (str): first date in 'yyyy-mm-dd' format
+            end_date (str): last date in 'yyyy-mm-dd' format, included
+            extents (None, optional): list of extents in [left, bottom, right, top] format
+
+        Returns:
+            dict: every date of the range to the result of self.infer for it
+        """
+        schedules = self.schedule_range(start_date, end_date, extents)
+        return {
+            date: self.infer(date, extents, schedule)
+            for date, schedule in schedules.items()
+        }
+
+    def resume_scene(self, scene_id, indices, checkpoint):
+        """
+            Detect ships on the tiles of a scene not detected by an earlier
+            attempt, recording them in the checkpoint batch by batch
+
+        Args:
+            scene_id (str): planetscope scene id
+            indices (list): list of x, y indices
+            checkpoint (Checkpoint): progress of the run
+
+        Yields:
+            tuple: x, y index of a tile, list of geojsons detected on it,
+            stored ones first
+        """
+        stored = checkpoint.tiles(scene_id)
+        for tile, geojsons in stored.items():
+            if geojsons:
+                yield tile, geojsons
+        if checkpoint.scene_complete(scene_id):
+            print(f"{scene_id} resumed from checkpoint: {len(stored)} tiles")
+            return
+        remaining = [index for index in indices if tuple(index) not in stored]
+        if stored:
+            print(
+                f"{scene_id} resumed from checkpoint: "
+                f"{len(indices) - len(remaining)}/{len(indices)} tiles done"
+            )
+        if remaining:
+            yield from self.detect_scene(scene_id, remaining, checkpoint)
+        checkpoint.complete_scene(scene_id)
+
+    def detect_scene(self, scene_id, indices, checkpoint=None):
+        """
+            Detect ships on the tiles of a scene
+
+        Args:
+            scene_id (str): planetscope scene id
+            indices (list): list of x, y indices
+            checkpoint (Checkpoint, optional): records every tile and its
+                detections once the last batch covering it is detected, in
+                mosaic mode the last canvas overlapping it
+
+        Yields:
+            tuple: x, y index of a tile, list of geojsons detected on it
+        """
+        report = TileReport(len(indices))
+        needed = set(map(tuple, indices))
+        if self.input_mode == 'mosaic':
+            units = [
+                (column_origin, row_origin)
+                for row_origin, column_origins in plan_canvases(
+                    indices, self.mosaic_overlap
+                )
+                for column_origin in column_origins
+            ]
+            batch_size = self.batch_size_for(len(units))
+            image_group = self.prepare_mosaic(
+                indices, scene_id, report, batch_size
+            )
+            # position of the last canvas overlapping every tile
+            last_units = {
+                tile: position
+                for position, origin in enumerate(units)
+                for tile in canvas_tiles(*origin)
+                if tile in needed
+            }
+        else:
+            units = [tuple(index) for index in indices]
+            batch_size = self.batch_size_for(len(indices))
+            image_group = self.prepare_dataset(
+                indices, scene_id, report, batch_size
+            )
+            last_units = {unit: position for position, unit in enumerate(units)}
+        print(f"{scene_id} batch size: {batch_size}")
+        if self.prefetch_depth:
+            # fetch batch N + 1 while batch N is being detected
+            image_group = Prefetcher(image_group, self.prefetch_depth)
+        batches = image_group
+        if self.cascade is not None:
+            batches = self.cascade.screen(image_group, batch_size)
+        detect_time = 0
+        # tiles and canvases are fetched, screened and detected in order, so
+        # every one up to the last of a detected batch is done, including the
+        # missing, empty and screened out ones. A tile is saved once the last
+        # unit covering it is done, with its detections or empty.
+        positions = {unit: position for position, unit in enumerate(units)}
+        save_order = sorted(last_units, key=last_units.get)
+        pending = dict()
+        saved = 0
+        detected = self.detect_batches(batches, batch_size)
+        for batch, preds, seconds in detected:
+            detect_time += seconds
+            METRICS.observe('detect_seconds', seconds)
+            METRICS.inc('detected_images', len(batch))
+            with METRICS.timer('postprocess_seconds'):
+                geojsons, tile_positions = self.georeference(
+                    preds, batch.bounding_boxes
+                )
+                if self.input_mode == 'mosaic':
+                    # canvases span several tiles, a detection belongs to the
+                    # scheduled tile of its canvas nearest to its centre
+                    tiles = detection_tiles(
+                        feature_boxes(geojsons),
+                        [batch.tiles[position] for position in tile_positions],
+                        needed
+                    )
+                else:
+                    tiles = [
+                        batch.tiles[position] for position in tile_positions
+                    ]
+                grouped = [
+                    (tile, [geojson for _, geojson in pairs])
+                    for tile, pairs in itertools.groupby(
+                        sorted(zip(tiles, geojsons), key=lambda pair: pair[0]),
+                        key=lambda pair: pair[0]
+                    )
+                ]
+            METRICS.inc('scene_detections', len(geojsons))
+            if checkpoint is not None:
+                for tile, tile_geojsons in grouped:
+                    pending.setdefault(tile, []).extend(tile_geojsons)
+                done = max(positions[unit] for unit in batch.tiles)
+                end = saved
+                while (end < len(save_order)
+                       and last_units[save_order[end]] <= done):
+                    end += 1
+                checkpoint.save_tiles(scene_id, {
+                    tile: pending.pop(tile, [])
+                    for tile in save_order[saved:end]
+                })
+                saved = end
+            yield from grouped
+        if checkpoint is not None:
+            # tiles after the last detected batch
+            checkpoint.save_tiles(scene_id, {
+                tile: pending.pop(tile, []) for tile in save_order[saved:]
             })
+        print(f"{scene_id} tiles: {report}")
+        print(f"detect time: {detect_time:.3f}")
+        if self.prefetch_depth:
+            print(f"prefetch: {image_group.stats()}")
 
-        return location_wise_detections, detection_count
+    def detect_batches(self, batches, batch_size):
+        """
+            Run the model on batches, in the inference pool if there is one
 
-    def augment_indices(self, indices):
+        Args:
+            batches (iterable): TileBatch objects
+            batch_size (int): batch size of the model to use
+
+        Yields:
+            tuple: batch, predictions of its real images, seconds spent
+            waiting on the model
         """
-            Make sure the list of indices contains total number of elements
-            in factors of IMGS_PER_GPU
+        if self.inference_pool is None:
+            for batch in batches:
+                start = time.time()
+                preds = self.predict(batch.inputs(batch_size))
+                # filler slots at the end of the batch are not post-processed
+                yield batch, preds[:len(batch)], time.time() - start
+            return
+        detected = self.inference_pool.detect(batches, batch_size)
+        while True:
+            # includes preparing the batches submitted meanwhile
+            start = time.time()
+            batch, preds = next(detected, (None, None))
+            if batch is None:
+                return
+            yield batch, preds, time.time() - start
+
+    def predict(self, images):
+        """
+            Run the model on a batch of images
 
         Args:
-            indices (TYPE): list of indices [[x_index, y_index]]
+            images (list): list of images, as many as one of the batch sizes
 
         Returns:
-            list: List of augmented x, y indices.
+            list: label images in 'masks' mode, dicts of rois and scores in
+            'boxes' mode
         """
-        length = len(indices)
-        diff = math.ceil(length / IMGS_PER_GPU) * IMGS_PER_GPU - length
-        indices += indices[0:diff]
-        return indices
+        model = self.model_for(len(images))
+        if self.postprocess == 'masks':
+            return predict_rcnn(model, images)
+        return detect_boxes(model, images)
+
+    def count_detections(self, predictions):
+        """
+            Number of ships in every prediction
+
+        Args:
+            predictions (list): label images in 'masks' mode, dicts of rois
+                and scores in 'boxes' mode
+
+        Returns:
+            list: number of ships per prediction
+        """
+        if self.postprocess == 'masks':
+            return [len(np.unique(pred[pred > 0])) for pred in predictions]
+        return [len(pred['rois']) for pred in predictions]
 
     def prepare_indices(self, tile_range):
         """
@@ -230,67 +783,172 @@ class Infer:
                 indices.append((x_index, y_index))
         return indices
 
-    def prepare_dataset(self, indices, scene_id):
+    def decode_tile(self, content, size=IMG_SIZE):
+        """
+            Decode a tile for inference. Tiles which are mostly nodata, eg:
+            along scene edges, are rejected before being resized.
+
+        Args:
+            content (bytes): png content of the tile
+            size (int, optional): height and width of the decoded image
+
+        Returns:
+            numpy.ndarray: (size, size, 3) image, None if the tile has too few
+            valid pixels
+        """
+        image = Image.open(BytesIO(content))
+        valid_fraction = self.valid_fraction(image)
+        if valid_fraction == 0 or valid_fraction < self.min_valid_fraction:
+            return None
+        if image.size != (size, size):
+            image = image.resize((size, size))
+        return np.asarray(image.convert('RGB'))
+
+    def valid_fraction(self, image):
+        """
+            Fraction of valid pixels in a tile, read from the alpha channel if
+            there is one, otherwise the fraction of pixels which are not black
+
+        Args:
+            image (PIL.Image.Image): decoded tile
+
+        Returns:
+            float: fraction of valid pixels
+        """
+        if image.mode == 'P' and 'transparency' in image.info:
+            image = image.convert('RGBA')
+        if 'A' in image.getbands():
+            valid = np.asarray(image.getchannel('A')) > 0
+        else:
+            valid = np.asarray(image.convert('RGB')).any(axis=-1)
+        return np.count_nonzero(valid) / valid.size
+
+    def prepare_dataset(self, indices, scene_id, report=None, batch_size=None):
         """
             prepare the images to be infered on for a tile.
 
         Args:
             indices (list): list of x, y indices
             scene_id (str): scene_id on which to iterate
+            report (TileReport, optional): updated with the fetched, missing
+                and empty tiles
+            batch_size (int, optional): tiles per batch, the largest batch
+                size by default
 
         Yields:
-            TYPE: Description
-        """
-        indices = self.augment_indices(indices)
-
-        images = list()
-        bounding_boxes = list()
-        for x_index, y_index in indices:
-            tile_url = WMTS_URL.format(
-                scene_id,
-                x_index,
-                y_index,
-                self.credential
+            TileBatch: batches of at most batch_size tiles, the last one
+            may be partial
+        """
+        batch_size = batch_size or self.batch_sizes[-1]
+        batch = TileBatch()
+        bounding_boxes = dict(zip(indices, tile_bounds(indices).tolist()))
+        tiles = self.tile_fetcher.fetch(scene_id, indices)
+        for x_index, y_index, status_code, content in tiles:
+            if status_code != 200:
+                METRICS.inc('tiles', result='missing')
+                if report is not None:
+                    report.add_missing(x_index, y_index, status_code)
+                continue
+            if report is not None:
+                report.fetched += 1
+            with METRICS.timer('decode_seconds'):
+                img = self.decode_tile(content)
+            if img is None:
+                METRICS.inc('tiles', result='empty')
+                if report is not None:
+                    report.add_empty(
+                        x_index, y_index, bounding_boxes[(x_index, y_index)]
+                    )
+                continue
+            METRICS.inc('tiles', result='decoded')
+            batch.add(
+                img,
+                bounding_boxes[(x_index, y_index)],
+                (x_index, y_index)
             )
-            response = requests.get(tile_url)
-            status_code = response.status_code
-            if status_code == 200:
-                img = np.asarray(
-                    Image.open(BytesIO(response.content)).resize(
-                        (IMG_SIZE, IMG_SIZE)
-                    ).convert('RGB')
-                )
-                images.append(img)
-                bounding_box = mercantile.bounds(x_index, y_index, ZOOM_LEVEL)
-                bounding_boxes.append([
-                    bounding_box.west,
-                    bounding_box.south,
-                    bounding_box.east,
-                    bounding_box.north
-                ])
-            length = len(images)
-            if length == IMGS_PER_GPU:
-                yield images, bounding_boxes
-                images = []
-                bounding_boxes = []
+            if len(batch) == batch_size:
+                yield batch
+                batch = TileBatch()
+        if len(batch):
+            yield batch
 
-
-    def prepare_geojson(self, coordinates, area):
+    def prepare_mosaic(self, indices, scene_id, report=None, batch_size=None):
         """
-            Prepare the final geojson for the coordinate and area passed
+            prepare canvases stitched from native resolution tiles, instead of
+            upsampling every tile. Tiles are fetched a row of canvases at a
+            time and released once no later canvas needs them.
 
         Args:
-            coordinates (list): list of coordinate
-            area (int): rounded up area
+            indices (list): list of x, y indices
+            scene_id (str): scene_id on which to iterate
+            report (TileReport, optional): updated with the fetched, missing
+                and empty tiles
+            batch_size (int, optional): canvases per batch, the largest batch
+                size by default
 
-        Returns:
-            dict: dictionary version of the proper geojson for a single detection
+        Yields:
+            TileBatch: batches of at most batch_size canvases, the tile of
+            each canvas is its (column, row) origin in global pixels
         """
-        geojson = deepcopy(GEOJSON_TEMPLATE)
-        geojson['geometry']['coordinates'] = coordinates
-        geojson['properties']['area'] = area
-        return geojson
-
+        batch_size = batch_size or self.batch_sizes[-1]
+        needed = set(indices)
+        fetched = set()
+        images = dict()
+        bounding_boxes = dict(zip(indices, tile_bounds(indices).tolist()))
+        batch = TileBatch()
+        stride = IMG_SIZE - self.mosaic_overlap
+        for row_origin, column_origins in plan_canvases(
+            indices, self.mosaic_overlap
+        ):
+            row_tiles = sorted(
+                {
+                    tile
+                    for column_origin in column_origins
+                    for tile in canvas_tiles(column_origin, row_origin)
+                    if tile in needed and tile not in fetched
+                },
+                key=lambda tile: (tile[1], tile[0])
+            )
+            tiles = self.tile_fetcher.fetch(scene_id, row_tiles)
+            for x_index, y_index, status_code, content in tiles:
+                fetched.add((x_index, y_index))
+                if status_code != 200:
+                    METRICS.inc('tiles', result='missing')
+                    if report is not None:
+                        report.add_missing(x_index, y_index, status_code)
+                    continue
+                if report is not None:
+                    report.fetched += 1
+                with METRICS.timer('decode_seconds'):
+                    img = self.decode_tile(content, TILE_SIZE)
+                if img is None:
+                    METRICS.inc('tiles', result='empty')
+                    if report is not None:
+                        report.add_empty(
+                            x_index, y_index, bounding_boxes[(x_index, y_index)]
+                        )
+                    continue
+                METRICS.inc('tiles', result='decoded')
+                images[(x_index, y_index)] = img
+            for column_origin in column_origins:
+                canvas = build_canvas(column_origin, row_origin, images)
+                if canvas is None:
+                    continue
+                batch.add(
+                    canvas,
+                    canvas_bounds(column_origin, row_origin),
+                    (column_origin, row_origin)
+                )
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = TileBatch()
+            # tiles above the next row of canvases are not needed anymore
+            top = (row_origin + stride) // TILE_SIZE
+            images = {
+                tile: image for tile, image in images.items() if tile[1] >= top
+            }
+        if len(batch):
+            yield batch
 
     def xy_to_latlon(self, prediction, bounding_box):
         """
@@ -303,23 +961,7 @@ class Infer:
         Returns:
             list: list of geojsons for a given list of inferences
         """
-        transform = rasterio.transform.from_bounds(
-            *bounding_box, IMG_SIZE, IMG_SIZE
+        boxes = [ship.bbox for ship in regionprops(np.asarray(prediction))]
+        return boxes_to_features(
+            boxes, np.repeat([bounding_box], len(boxes), axis=0)
         )
-        polygon_coordinates = list()
-
-        for idx, ship in enumerate(regionprops(prediction.astype('uint8'))):
-            bbox = ship.bbox
-            xs = bbox[::2]
-            ys = bbox[1::2]
-            area = abs(xs[0] - xs[1]) * abs(ys[0] - ys[1])
-            lons, lats = rasterio.transform.xy(
-                transform, xs, ys
-            )
-            reformated_bbox = self.planet_downloader.prepare_coordinates(
-                [lons[0], lats[0], lons[1], lats[1]]
-            )
-            polygon_coordinates.append(
-                self.prepare_geojson(reformated_bbox, area)
-            )
-        return polygon_coordinates
@@ -1,10 +1,11 @@
-import boto3
 import json
 import os
-import time
 
-from config import ACCOUNT_NUMBER
+from checkpoint import Checkpoint
+from config import CHECKPOINT_FILE, METRICS_FORMAT, METRICS_PORT
 from infer import Infer
+from metrics import METRICS
+from sqs_consumer import QUEUE_URL, AssumedRoleSession, SQSConsumer
 from uploader import Uploader
 
 API_KEY = os.environ['API_KEY']
@@ -15,73 +16,134 @@ IL_USER_NAME = os.environ['IL_USER_NAME']
 IL_PASSWORD = os.environ['IL_PASSWORD']
 
 PLANET_ORDER_QUEUE = 'planet_order_place_sqs'
-QUEUE_URL = f"https://queue.amazonaws.com/{ACCOUNT_NUMBER}/{{}}"
-
-ROLE_NAME = 'PlanetOrderEc2Role'
-ROLE_ARN = f'arn:aws:iam::{ACCOUNT_NUMBER}:role/{ROLE_NAME}'
 
 SQS_QUEUE = 'ship_detection_sqs'
 
 
-def assumed_role_session():
-    client = boto3.client('sts')
-    creds = client.assume_role(
-        RoleArn=ROLE_ARN, RoleSessionName=ROLE_NAME
-    )['Credentials']
-    return boto3.session.Session(
-        aws_access_key_id=creds['AccessKeyId'],
-        aws_secret_access_key=creds['SecretAccessKey'],
-        aws_session_token=creds['SessionToken'],
-        region_name='us-east-1'
-    )
-
-infer = Infer(credential=API_KEY)
-uploader = Uploader(IL_USER_NAME, IL_PASSWORD)
-while True:
-    # Get the queue
-    session = assumed_role_session()
-    sqs_connector = session.client('sqs')
-    detection_queue_url = QUEUE_URL.format(SQS_QUEUE)
+def infer_date(infer, uploader, consumer, message_id, date, extents, schedule):
+    """
+        Detect the ships of a date, uploading every scene as soon as it is
+        detected. Detections are spooled to the checkpoint database rather
+        than kept in memory, and the detections of every location are
+        forwarded together from there once the date is done. Resumes the
+        progress of earlier attempts at the same message.
+
+    Args:
+        infer (Infer): inference runner
+        uploader (Uploader): imagelabeler uploader
+        consumer (SQSConsumer): consumer of the message, its client forwards
+            the detections
+        message_id (str): id of the sqs message, kept on redelivery
+        date (str): date in 'yyyy-mm-dd' format
+        extents (list): extents of the message, None for the default ones
+        schedule (tuple): result of infer.schedule for the date
+
+    Returns:
+        tuple: number of detections, checkpoint of the date to clear once the
+        message is deleted, None if checkpoints are disabled
+    """
     planet_order_queue_url = QUEUE_URL.format(PLANET_ORDER_QUEUE)
-    detection_messages = sqs_connector.receive_message(
-        QueueUrl=detection_queue_url, MessageAttributeNames=['date']
-    )
-    messages = detection_messages.get('Messages', [])
-    # extract date information for message
-    for msg in messages:
-        message_body = msg['Body'] or '{}'
-        message = json.loads(message_body)
-        date = message.get('date')
-        extents = message.get('extents')
-        if date:
-            location_wise_detections, detection_count = infer.infer(
-                date,
-                extents=extents
-            )
-            print(f"{date}: number of detections: {detection_count}")
-            detections = {
-                'date': date,
-                'detections': location_wise_detections
-            }
-            uploader.upload_detections(detections)
-            sqs_connector.send_message(
-                QueueUrl=planet_order_queue_url,
-                MessageBody=json.dumps(detections)
-            )
-            # Segregating this for now.
-            # sqs_connector.send_message(
-            #     QueueUrl=detected_queue_url,
-            #     MessageBody=json.dumps(detections)
-            # )
-        else:
-            print('Please specify date')
-        # delete message from queue
-        session = assumed_role_session()
-        sqs_connector = session.client('sqs')
-        sqs_connector.delete_message(
-            QueueUrl=detection_queue_url,
-            ReceiptHandle=msg['ReceiptHandle']
+    checkpoint = None
+    if CHECKPOINT_FILE is not None:
+        checkpoint = Checkpoint(CHECKPOINT_FILE, f"{message_id}/{date}")
+        for location, count in checkpoint.upload_counts().items():
+            uploader.resume(location, date, count)
+    # without checkpoints, detections are spooled to a temporary database
+    spool = checkpoint or Checkpoint('', f"{message_id}/{date}")
+    _, scene_ids = schedule
+    detection_count = 0
+    for chunk in infer.infer_stream(
+        date, extents=extents, schedule=schedule, checkpoint=checkpoint
+    ):
+        features = chunk['geojson']['features']
+        detection_count += len(features)
+        spool.save_detections(chunk['scene_id'], chunk['location'], features)
+        if spool.uploaded(chunk['scene_id'], chunk['location']):
+            continue
+        uploader.upload_detections({'date': date, 'detections': [chunk]})
+        spool.save_upload(chunk['scene_id'], chunk['location'], len(features))
+    if not spool.forwarded():
+        # one message per date with every location and its scene ids, the
+        # shape the order consumer expects
+        location_detections = {
+            location: spool.detections(location) for location in scene_ids
+        }
+        detections = {
+            'date': date,
+            'detections': infer.location_wise(location_detections, scene_ids)
+        }
+        consumer.sqs().send_message(
+            QueueUrl=planet_order_queue_url,
+            MessageBody=json.dumps(detections)
+        )
+        spool.save_forwarded()
+        # Segregating this for now.
+        # sqs_connector.send_message(
+        #     QueueUrl=detected_queue_url,
+        #     MessageBody=json.dumps(detections)
+        # )
+    if checkpoint is None:
+        spool.close()
+    return detection_count, checkpoint
+
+
+def handle_message(infer, uploader, consumer, msg):
+    """
+        Detect the ships of the date, or range of dates, of a message
+
+    Args:
+        infer (Infer): inference runner
+        uploader (Uploader): imagelabeler uploader
+        consumer (SQSConsumer): consumer of the message
+        msg (dict): sqs message
+
+    Returns:
+        list: checkpoints of the message, to clear once it is deleted
+    """
+    # metrics of this message only, the registry keeps the whole process
+    start = METRICS.snapshot()
+    message_body = msg['Body'] or '{}'
+    message = json.loads(message_body)
+    # a single date, or a range of dates searched at once
+    start_date = message.get('start_date') or message.get('date')
+    end_date = message.get('end_date') or start_date
+    extents = message.get('extents')
+    checkpoints = list()
+    if not start_date:
+        print('Please specify date')
+        return checkpoints
+    schedules = infer.schedule_range(start_date, end_date, extents)
+    for date, schedule in schedules.items():
+        detection_count, checkpoint = infer_date(
+            infer, uploader, consumer, msg['MessageId'], date, extents,
+            schedule
         )
-    print('Poll completed')
-    # sleep for 10 second before trying to check new messages
-    time.sleep(10)
+        if checkpoint is not None:
+            checkpoints.append(checkpoint)
+        print(f"{date}: number of detections: {detection_count}")
+    print(f"metrics: {METRICS.since(start).dump(METRICS_FORMAT)}")
+    return checkpoints
+
+
+# inference pool workers are spawned and import this module
+if __name__ == '__main__':
+    if METRICS_PORT is not None:
+        METRICS.serve(METRICS_PORT)
+    infer = Infer(credential=API_KEY)
+    uploader = Uploader(IL_USER_NAME, IL_PASSWORD)
+    # a message can take hours, waiting ones are left to other workers
+    consumer = SQSConsumer(SQS_QUEUE, AssumedRoleSession(), max_messages=1)
+    # checkpoints of handled messages, cleared once they are deleted
+    message_checkpoints = dict()
+
+    def handle(msg):
+        message_checkpoints[msg['MessageId']] = handle_message(
+            infer, uploader, consumer, msg
+        )
+
+    def deleted(msg):
+        for checkpoint in message_checkpoints.pop(msg['MessageId'], []):
+            checkpoint.clear()
+            checkpoint.close()
+
+    consumer.run(handle, deleted)
@@ -0,0 +1,174 @@
+import keras.backend as keras_backend
+import multiprocessing
+import os
+import tensorflow as tf
+
+from batching import FILLER_IMAGE
+from config import (
+    GRAPH_CACHE_DIR,
+    GRAPH_OPTIMIZATION,
+    INFERENCE_WORKERS,
+    POSTPROCESS_MODE
+)
+from model import (
+    close_model_rcnn,
+    detect_boxes,
+    load_model_rcnn,
+    predict_rcnn
+)
+
+# state of a worker process, set up by init_worker
+worker = dict()
+
+
+def session_config(intra_op_threads, inter_op_threads):
+    """
+        Tensorflow session configuration with explicit thread counts
+
+    Args:
+        intra_op_threads (int): threads used inside an op
+        inter_op_threads (int): ops run in parallel
+
+    Returns:
+        tf.ConfigProto: session configuration
+    """
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=intra_op_threads,
+        inter_op_parallelism_threads=inter_op_threads
+    )
+
+
+def init_worker(
+    graph_dir, postprocess, intra_op_threads, inter_op_threads, optimization
+):
+    """
+        Set up a worker process, the model is loaded on first use
+
+    Args:
+        graph_dir (str): folder of exported graphs
+        postprocess (str): 'boxes' or 'masks'
+        intra_op_threads (int): threads used inside an op
+        inter_op_threads (int): ops run in parallel
+        optimization (str): graph optimization, see load_model_rcnn
+    """
+    config = session_config(intra_op_threads, inter_op_threads)
+    keras_backend.set_session(tf.Session(config=config))
+    worker['config'] = config
+    worker['graph_dir'] = graph_dir
+    worker['postprocess'] = postprocess
+    worker['optimization'] = optimization
+    worker['model'] = None
+    worker['batch_size'] = None
+
+
+def detect_batch(images, batch_size):
+    """
+        Detect ships on a batch in a worker process
+
+    Args:
+        images (list): real images of the batch
+        batch_size (int): batch size of the model to use
+
+    Returns:
+        list: predictions of the real images only
+    """
+    # one model per worker, replaced when another batch size is used
+    if worker['batch_size'] != batch_size:
+        if worker['model'] is not None:
+            close_model_rcnn(worker['model'])
+            worker['model'] = None
+        worker['model'] = load_model_rcnn(
+            batch_size,
+            worker['graph_dir'],
+            worker['config'],
+            worker['optimization']
+        )
+        worker['batch_size'] = batch_size
+    inputs = list(images) + [FILLER_IMAGE] * (batch_size - len(images))
+    if worker['postprocess'] == 'masks':
+        predictions = predict_rcnn(worker['model'], inputs)
+    else:
+        predictions = detect_boxes(worker['model'], inputs)
+    return predictions[:len(images)]
+
+
+class InferencePool:
+
+    def __init__(
+        self,
+        workers=INFERENCE_WORKERS,
+        postprocess=POSTPROCESS_MODE,
+        graph_dir=GRAPH_CACHE_DIR,
+        intra_op_threads=None,
+        inter_op_threads=1,
+        graph_optimization=GRAPH_OPTIMIZATION
+    ):
+        """
+            Initializer. Runs Mask R-CNN in worker processes, each with its
+            own model and tensorflow session.
+
+        Args:
+            workers (int, optional): number of worker processes
+            postprocess (str, optional): 'boxes' or 'masks'
+            graph_dir (str, optional): folder of exported graphs
+            intra_op_threads (int, optional): threads used inside an op by
+                each worker, the cores are split between workers by default
+            inter_op_threads (int, optional): ops run in parallel by each
+                worker
+            graph_optimization (str, optional): graph optimization, see
+                load_model_rcnn
+        """
+        self.workers = workers
+        if intra_op_threads is None:
+            intra_op_threads = max(os.cpu_count() // workers, 1)
+        # workers need their own tensorflow runtime, it can't be forked
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(
+            workers,
+            initializer=init_worker,
+            initargs=(
+                graph_dir,
+                postprocess,
+                intra_op_threads,
+                inter_op_threads,
+                graph_optimization
+            )
+        )
+        print(
+            f"inference pool: {workers} workers, {intra_op_threads} intra op "
+            f"and {inter_op_threads} inter op threads each"
+        )
+
+    def detect(self, batches, batch_size):
+        """
+            Detect batches on the workers, with at most two batches per worker
+            in flight
+
+        Args:
+            batches (iterable): TileBatch objects
+            batch_size (int): batch size of the model to use
+
+        Yields:
+            tuple: batch, predictions of its real images, in input order
+        """
+        pending = list()
+        batches = iter(batches)
+        while True:
+            while len(pending) < 2 * self.workers:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.append((batch, self.pool.apply_async(
+                    detect_batch, (batch.images, batch_size)
+                )))
+            if not pending:
+                return
+            batch, result = pending.pop(0)
+            yield batch, result.get()
+
+    def close(self):
+        """
+            Stop the workers
+        """
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,297 @@
+import math
+import numpy as np
+
+from config import IMG_SIZE, MERGE_IOU, ZOOM_LEVEL
+from georeference import feature_boxes, lonlat_to_tiles, tile_bounds
+
+# width of a tile in degrees
+TILE_DEGREES = 360.0 / 2 ** ZOOM_LEVEL
+
+# boxes this close across a tile seam are parts of the same ship
+SEAM_TOLERANCE = 2 * TILE_DEGREES / IMG_SIZE
+
+# size of the cells of the spatial hash, a quarter of a tile
+CELL_SIZE = TILE_DEGREES / 4
+
+
+class DetectionMerger:
+
+    def __init__(
+        self,
+        iou_threshold=MERGE_IOU,
+        seam_tolerance=SEAM_TOLERANCE,
+        cell_size=CELL_SIZE
+    ):
+        """
+            Initializer. Merges detections of ships split across tile seams,
+            or reported by several overlapping scenes. Detections are kept in
+            a grid hash so each one is only compared with its neighbours.
+
+        Args:
+            iou_threshold (float, optional): overlapping boxes with at least
+                this intersection over union are the same ship
+            seam_tolerance (float, optional): boxes in neighbouring tiles closer
+                than this, in degrees, are parts of the same ship
+            cell_size (float, optional): size of the grid cells in degrees
+        """
+        self.iou_threshold = iou_threshold
+        self.seam_tolerance = seam_tolerance
+        self.cell_size = cell_size
+        self.clear()
+
+    def __len__(self):
+        return len(self.features)
+
+    def cells(self, box):
+        """
+            Grid cells touched by a box, grown by the seam tolerance
+
+        Args:
+            box (list): [west, south, east, north]
+
+        Returns:
+            list: list of cell keys
+        """
+        west, south, east, north = box
+        tolerance = self.seam_tolerance
+        return [
+            (column, row)
+            for column in range(
+                math.floor((west - tolerance) / self.cell_size),
+                math.floor((east + tolerance) / self.cell_size) + 1
+            )
+            for row in range(
+                math.floor((south - tolerance) / self.cell_size),
+                math.floor((north + tolerance) / self.cell_size) + 1
+            )
+        ]
+
+    def add(self, features):
+        """
+            Add detections, merging them with the ones already added
+
+        Args:
+            features (list): list of geojson features
+        """
+        if not features:
+            return
+        boxes = feature_boxes(features)
+        tiles = lonlat_to_tiles(
+            (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2
+        )
+        bounds = tile_bounds(tiles).tolist()
+        for feature, box, tile, tile_box in zip(
+            features, boxes.tolist(), tiles.tolist(), bounds
+        ):
+            index = len(self.features)
+            self.features.append(feature)
+            self.boxes.append(box)
+            self.tiles.append(tuple(tile))
+            self.tile_bounds.append(tile_box)
+            self.parents.append(index)
+            cells = self.cells(box)
+            candidates = set()
+            for cell in cells:
+                candidates.update(self.grid.get(cell, ()))
+            for candidate in candidates:
+                if self.same_ship(index, candidate):
+                    self.union(index, candidate)
+            for cell in cells:
+                self.grid.setdefault(cell, []).append(index)
+
+    def same_ship(self, first, second):
+        """
+            Whether two detections are the same ship, either overlapping or
+            touching across a tile seam
+
+        Args:
+            first (int): index of a detection
+            second (int): index of another detection
+
+        Returns:
+            bool: True if they should be merged
+        """
+        first_west, first_south, first_east, first_north = self.boxes[first]
+        second_west, second_south, second_east, second_north = self.boxes[second]
+        width = min(first_east, second_east) - max(first_west, second_west)
+        height = min(first_north, second_north) - max(first_south, second_south)
+        tolerance = self.seam_tolerance
+        if width < -tolerance or height < -tolerance:
+            return False
+        if width > 0 and height > 0:
+            intersection = width * height
+            union = (
+                (first_east - first_west) * (first_north - first_south) +
+                (second_east - second_west) * (second_north - second_south) -
+                intersection
+            )
+            if intersection >= self.iou_threshold * union:
+                return True
+        # boxes close to each other but in different tiles are parts of a
+        # ship cut by the seam between the tiles
+        return self.across_seam(first, second)
+
+    def across_seam(self, first, second):
+        """
+            Whether two detections in neighbouring tiles both reach the seam
+            between their tiles, ships stacked across a seam without touching
+            it are kept apart
+
+        Args:
+            first (int): index of a detection
+            second (int): index of another detection
+
+        Returns:
+            bool: True if both boxes end within the tolerance of the seam
+        """
+        (first_x, first_y), (second_x, second_y) = (
+            self.tiles[first], self.tiles[second]
+        )
+        if (first_x, first_y) == (second_x, second_y) or \
+                abs(first_x - second_x) > 1 or abs(first_y - second_y) > 1:
+            return False
+        if second_x < first_x or (second_x == first_x and second_y < first_y):
+            first, second = second, first
+            first_x, first_y, second_x, second_y = (
+                second_x, second_y, first_x, first_y
+            )
+        first_west, first_south, first_east, first_north = self.boxes[first]
+        second_west, second_south, second_east, second_north = self.boxes[second]
+        tolerance = self.seam_tolerance
+        if first_x != second_x:
+            # first is west of second, the seam is the east edge of its tile
+            seam = self.tile_bounds[first][2]
+            if abs(first_east - seam) > tolerance or \
+                    abs(second_west - seam) > tolerance:
+                return False
+        if first_y != second_y:
+            # tile rows grow southwards, the seam is the south or north edge
+            # of the first tile
+            if second_y > first_y:
+                seam = self.tile_bounds[first][1]
+                near = (first_south, second_north)
+            else:
+                seam = self.tile_bounds[first][3]
+                near = (first_north, second_south)
+            if any(abs(edge - seam) > tolerance for edge in near):
+                return False
+        return True
+
+    def find(self, index):
+        """
+            Root of the group of a detection
+
+        Args:
+            index (int): index of a detection
+
+        Returns:
+            int: index of the root detection
+        """
+        root = index
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[index] != root:
+            self.parents[index], index = root, self.parents[index]
+        return root
+
+    def union(self, first, second):
+        """
+            Put two detections in the same group
+
+        Args:
+            first (int): index of a detection
+            second (int): index of another detection
+        """
+        first_root = self.find(first)
+        second_root = self.find(second)
+        if first_root != second_root:
+            root = min(first_root, second_root)
+            self.parents[max(first_root, second_root)] = root
+
+    def groups(self):
+        """
+            Detections grouped by ship, in the order they were added
+
+        Returns:
+            list: list of lists of detection indices
+        """
+        groups = dict()
+        for index in range(len(self.features)):
+            groups.setdefault(self.find(index), []).append(index)
+        return list(groups.values())
+
+    def merged(self):
+        """
+            One feature per ship. Single detections are returned as they
+            are, groups are replaced by a feature covering all their boxes.
+
+        Returns:
+            list: list of geojson features
+        """
+        return [self.merge_group(group) for group in self.groups()]
+
+    def flush(self):
+        """
+            One feature per ship detected since the last flush, for streaming.
+            The detections are released, so memory doesn't grow with the
+            number of flushes, and later detections aren't merged with them.
+
+        Returns:
+            list: list of geojson features
+        """
+        features = self.merged()
+        self.clear()
+        return features
+
+    def clear(self):
+        """
+            Forget every detection added
+        """
+        self.features = list()
+        self.boxes = list()
+        self.tiles = list()
+        self.tile_bounds = list()
+        self.parents = list()
+        self.grid = dict()
+
+    def merge_group(self, group):
+        """
+            Merge a group of detections into one feature. Parts in different
+            tiles add up their areas, duplicates in the same tile don't.
+
+        Args:
+            group (list): list of detection indices
+
+        Returns:
+            dict: geojson feature
+        """
+        if len(group) == 1:
+            return self.features[group[0]]
+        boxes = np.asarray([self.boxes[index] for index in group])
+        west, south = boxes[:, :2].min(axis=0).tolist()
+        east, north = boxes[:, 2:].max(axis=0).tolist()
+        tile_areas = dict()
+        confidences = list()
+        for index in group:
+            properties = self.features[index]['properties']
+            tile = self.tiles[index]
+            tile_areas[tile] = max(tile_areas.get(tile, 0), properties['area'])
+            if 'confidence' in properties:
+                confidences.append(properties['confidence'])
+        properties = {'area': sum(tile_areas.values())}
+        if confidences:
+            properties['confidence'] = max(confidences)
+        return {
+            'type': 'Feature',
+            'properties': properties,
+            'geometry': {
+                'type': 'Polygon',
+                'coordinates': [[
+                    [west, north],
+                    [east, north],
+                    [east, south],
+                    [west, south],
+                    [west, north]
+                ]]
+            }
+        }
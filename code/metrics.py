@@ -0,0 +1,297 @@
+import json
+import threading
+import time
+
+from config import METRICS_PREFIX
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60
+)
+
+
+def label_key(labels):
+    """
+        Hashable, ordered form of a set of labels
+
+    Args:
+        labels (dict): label names to values
+
+    Returns:
+        tuple: sorted (name, value) pairs, values as strings
+    """
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=None):
+    """
+        Labels in the prometheus text format
+
+    Args:
+        key (tuple): sorted (name, value) pairs
+        extra (tuple, optional): pair added at the end, eg: the bucket bound
+
+    Returns:
+        str: {name="value",...}, empty without labels
+    """
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Metrics:
+
+    def __init__(self, prefix=METRICS_PREFIX, buckets=LATENCY_BUCKETS):
+        """
+            Initializer. Counters and latency histograms tagged with labels,
+            eg: location, safe to update from several threads. Labels should
+            take few values, every combination is kept for the life of the
+            process.
+
+        Args:
+            prefix (str, optional): prefix of the metric names when exported
+            buckets (tuple, optional): upper bounds of the histogram buckets
+        """
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.histograms = dict()
+
+    def inc(self, name, value=1, **labels):
+        """
+            Increment a counter
+
+        Args:
+            name (str): name of the counter
+            value (int, optional): amount added
+            **labels: labels of the counter, eg: location='...'
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """
+            Record a latency in a histogram
+
+        Args:
+            name (str): name of the histogram
+            seconds (float): observed latency
+            **labels: labels of the histogram
+        """
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = {
+                    'buckets': [0] * len(self.buckets),
+                    'sum': 0.0,
+                    'count': 0
+                }
+                self.histograms[key] = histogram
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+            Record the time spent in a with block in a histogram
+
+        Args:
+            name (str): name of the histogram
+            **labels: labels of the histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """
+            Copy of the current values, to report what is recorded after it
+
+        Returns:
+            dict: counters and histograms, by name and labels
+        """
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {
+                    key: {
+                        'buckets': list(histogram['buckets']),
+                        'sum': histogram['sum'],
+                        'count': histogram['count']
+                    }
+                    for key, histogram in self.histograms.items()
+                }
+            }
+
+    def since(self, snapshot):
+        """
+            Metrics recorded after a snapshot, eg: while handling one message
+
+        Args:
+            snapshot (dict): result of self.snapshot
+
+        Returns:
+            Metrics: differences with the snapshot, unchanged ones left out
+        """
+        delta = Metrics(self.prefix, self.buckets)
+        current = self.snapshot()
+        for key, value in current['counters'].items():
+            value -= snapshot['counters'].get(key, 0)
+            if value:
+                delta.counters[key] = value
+        for key, histogram in current['histograms'].items():
+            before = snapshot['histograms'].get(key)
+            if before is not None:
+                if histogram['count'] == before['count']:
+                    continue
+                histogram = {
+                    'buckets': [
+                        count - earlier for count, earlier in zip(
+                            histogram['buckets'], before['buckets']
+                        )
+                    ],
+                    'sum': histogram['sum'] - before['sum'],
+                    'count': histogram['count'] - before['count']
+                }
+            delta.histograms[key] = histogram
+        return delta
+
+    def to_json(self):
+        """
+            All the metrics as a json serializable dict
+
+        Returns:
+            dict: counters and histograms, each a list of labels and values
+        """
+        with self.lock:
+            return {
+                'counters': [
+                    {'name': name, 'labels': dict(key), 'value': value}
+                    for (name, key), value in sorted(self.counters.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(key),
+                        'buckets': dict(zip(
+                            map(str, self.buckets), histogram['buckets']
+                        )),
+                        'sum': histogram['sum'],
+                        'count': histogram['count']
+                    }
+                    for (name, key), histogram in sorted(
+                        self.histograms.items()
+                    )
+                ]
+            }
+
+    def to_prometheus(self):
+        """
+            All the metrics in the prometheus text exposition format
+
+        Returns:
+            str: one sample per line
+        """
+        lines = list()
+        with self.lock:
+            typed = set()
+            for (name, key), value in sorted(self.counters.items()):
+                metric = f"{self.prefix}{name}_total"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{metric}{format_labels(key)} {value}")
+            for (name, key), histogram in sorted(self.histograms.items()):
+                metric = f"{self.prefix}{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} histogram")
+                    typed.add(metric)
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    lines.append(
+                        f"{metric}_bucket{format_labels(key, ('le', str(bound)))} "
+                        f"{count}"
+                    )
+                lines.append(
+                    f"{metric}_bucket{format_labels(key, ('le', '+Inf'))} "
+                    f"{histogram['count']}"
+                )
+                lines.append(
+                    f"{metric}_sum{format_labels(key)} {histogram['sum']}"
+                )
+                lines.append(
+                    f"{metric}_count{format_labels(key)} {histogram['count']}"
+                )
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, output_format='json'):
+        """
+            All the metrics as text
+
+        Args:
+            output_format (str, optional): 'json' or 'prometheus'
+
+        Returns:
+            str: serialized metrics
+        """
+        if output_format == 'prometheus':
+            return self.to_prometheus()
+        return json.dumps(self.to_json())
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+            Serve the metrics over http, /metrics in the prometheus format and
+            /metrics.json as json
+
+        Args:
+            port (int): port to listen on, 0 picks a free one
+            host (str, optional): address to listen on
+
+        Returns:
+            http.server.ThreadingHTTPServer: running server
+        """
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.to_prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = metrics.dump('json').encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"metrics served on http://{host}:{server.server_port}/metrics")
+        return server
+
+
+# metrics of the process, shared by every module
+METRICS = Metrics()
@@ -1,11 +1,18 @@
+import hashlib
+import json
+import keras.backend as keras_backend
 import mrcnn.model as modellib
 import numpy as np
 import os
+import tempfile
 import tensorflow as tf
+import time
 
 from config import (
     EDGE_CROP,
     GAUSSIAN_NOISE,
+    GRAPH_CACHE_DIR,
+    GRAPH_OPTIMIZATION,
     IMG_SIZE,
     NET_SCALING,
     UPSAMPLE_MODE
@@ -16,12 +23,36 @@ from mrcnn import visualize
 from mrcnn.config import Config
 from mrcnn.model import log
 from tensorflow.keras import models, layers
+from tensorflow.tools.graph_transforms import TransformGraph
 
 MODEL_PATH = os.path.join(
     os.path.dirname(__file__),
     '../weights/mask_rcnn_airbus_0022.h5'
 )
 
+# graph transforms run on the frozen graph for each optimization
+GRAPH_TRANSFORMS = {
+    'optimize': [
+        'strip_unused_nodes',
+        'fold_constants(ignore_errors=true)',
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+        'sort_by_execution_order'
+    ],
+    # weights are stored in eight bits, computation stays in float
+    'quantize': [
+        'strip_unused_nodes',
+        'fold_constants(ignore_errors=true)',
+        'fold_batch_norms',
+        'fold_old_batch_norms',
+        'quantize_weights',
+        'sort_by_execution_order'
+    ]
+}
+
+# digests of weight files, keyed by path, size and modification time
+WEIGHT_HASHES = dict()
+
 # Build U-Net model
 def upsample_conv(filters, kernel_size, strides, padding):
     return layers.Conv2DTranspose(
@@ -106,8 +137,16 @@ def load_from_path(weight_file_path):
     return seg_model
 
 
-def make_model_rcnn(total_num_images):
+def make_inference_config(total_num_images):
+    """
+        Mask R-CNN inference configuration
+
+    Args:
+        total_num_images (int): number of images per batch
 
+    Returns:
+        mrcnn.config.Config: inference configuration
+    """
     class DetectorConfig(Config):
         # Give the configuration a recognizable name
         NAME = 'airbus'
@@ -144,29 +183,397 @@ def make_model_rcnn(total_num_images):
         GPU_COUNT = 1
         IMAGES_PER_GPU = total_num_images
 
-    inference_config = InferenceConfig()
+    return InferenceConfig()
+
+
+def make_model_rcnn(total_num_images, weights=MODEL_PATH):
+    inference_config = make_inference_config(total_num_images)
 
     # Recreate the model in inference mode
     model = modellib.MaskRCNN(mode='inference',
                               config=inference_config,
                               model_dir='../data/')
-    model.load_weights(MODEL_PATH, by_name=True)
+    # None keeps the random initial weights, eg: for benchmarks
+    if weights:
+        model.load_weights(weights, by_name=True)
+
+    return model
 
+
+def weights_hash(weight_file_path):
+    """
+        sha1 of a weight file, used to key exported graphs. Computed once
+        per process unless the file changes.
+
+    Args:
+        weight_file_path (str): path of the weight file
+
+    Returns:
+        str: hex digest
+    """
+    stat = os.stat(weight_file_path)
+    key = (os.path.abspath(weight_file_path), stat.st_size, stat.st_mtime_ns)
+    if key not in WEIGHT_HASHES:
+        digest = hashlib.sha1()
+        with open(weight_file_path, 'rb') as weight_file:
+            for chunk in iter(lambda: weight_file.read(1024 ** 2), b''):
+                digest.update(chunk)
+        WEIGHT_HASHES[key] = digest.hexdigest()
+    return WEIGHT_HASHES[key]
+
+
+def graph_paths(
+    graph_dir, total_num_images, optimization=None, weight_file_path=MODEL_PATH
+):
+    """
+        Paths of the frozen graph of a batch size and its tensor names
+
+    Args:
+        graph_dir (str): folder of exported graphs
+        total_num_images (int): number of images per batch
+        optimization (str, optional): key of GRAPH_TRANSFORMS the graph was
+            optimized with, None for the graph as exported
+        weight_file_path (str, optional): weights the graph is built from
+
+    Returns:
+        tuple: path of the graph, path of the json of its tensor names
+    """
+    name = f"mask_rcnn_{weights_hash(weight_file_path)[:16]}_{total_num_images}"
+    if optimization:
+        name = f"{name}_{optimization}"
+    return (
+        os.path.join(graph_dir, f"{name}.pb"),
+        os.path.join(graph_dir, f"{name}.json")
+    )
+
+
+def write_atomic(path, content):
+    """
+        Write a file so readers never see it partially written
+
+    Args:
+        path (str): path of the file
+        content (bytes): content of the file
+    """
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def export_frozen_graph(model, graph_path, names_path):
+    """
+        Freeze the inference graph of a Mask R-CNN model, with the weights
+        folded in as constants
+
+    Args:
+        model (mrcnn.model.MaskRCNN): model built by make_model_rcnn
+        graph_path (str): path of the serialized graph
+        names_path (str): path of the json of the input and output tensor names
+    """
+    session = keras_backend.get_session()
+    inputs = [tensor.name for tensor in model.keras_model.inputs]
+    outputs = [tensor.name for tensor in model.keras_model.outputs]
+    graph_def = tf.graph_util.convert_variables_to_constants(
+        session,
+        session.graph.as_graph_def(),
+        [name.split(':')[0] for name in outputs]
+    )
+    os.makedirs(os.path.dirname(graph_path) or '.', exist_ok=True)
+    write_atomic(graph_path, graph_def.SerializeToString())
+    # written last, an export is complete once its names are there
+    write_atomic(names_path, json.dumps({
+        'inputs': inputs,
+        'outputs': outputs,
+        'batch_size': model.config.BATCH_SIZE
+    }).encode())
+
+
+def optimize_graph(graph_path, names_path, output_path, output_names_path,
+                   optimization):
+    """
+        Optimize a frozen graph for inference with tensorflow graph transforms.
+        Only Mask R-CNN is exported, mrcnn molds its images before they are
+        fed to the graph, so the graph makes no assumption on pixel scaling.
+
+    Args:
+        graph_path (str): path of the frozen graph
+        names_path (str): path of the json of its tensor names
+        output_path (str): path of the optimized graph
+        output_names_path (str): path of the json of the optimized graph
+            tensor names
+        optimization (str): key of GRAPH_TRANSFORMS
+    """
+    if optimization not in GRAPH_TRANSFORMS:
+        raise ValueError(f"unknown graph optimization: {optimization}")
+    with open(names_path) as names_file:
+        names = json.load(names_file)
+    graph_def = tf.GraphDef()
+    with open(graph_path, 'rb') as graph_file:
+        graph_def.ParseFromString(graph_file.read())
+    optimized = TransformGraph(
+        graph_def,
+        [name.split(':')[0] for name in names['inputs']],
+        [name.split(':')[0] for name in names['outputs']],
+        GRAPH_TRANSFORMS[optimization]
+    )
+    write_atomic(output_path, optimized.SerializeToString())
+    write_atomic(output_names_path, json.dumps(
+        dict(names, optimization=optimization)
+    ).encode())
+
+
+class GraphModel:
+
+    def __init__(self, graph_path, names_path, session_config=None):
+        """
+            Initializer. Runs a frozen graph with the same predict interface
+            as the keras model it was exported from.
+
+        Args:
+            graph_path (str): path of the serialized graph
+            names_path (str): path of the json of the input and output tensor
+                names
+            session_config (tf.ConfigProto, optional): session configuration
+        """
+        with open(names_path) as names_file:
+            names = json.load(names_file)
+        graph_def = tf.GraphDef()
+        with open(graph_path, 'rb') as graph_file:
+            graph_def.ParseFromString(graph_file.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.inputs = [
+            self.graph.get_tensor_by_name(name) for name in names['inputs']
+        ]
+        self.outputs = [
+            self.graph.get_tensor_by_name(name) for name in names['outputs']
+        ]
+        self.session = tf.Session(graph=self.graph, config=session_config)
+
+    def predict(self, inputs, verbose=0):
+        """
+            Run the graph
+
+        Args:
+            inputs (list): arrays fed to the inputs, in order
+            verbose (int, optional): unused, kept for keras compatibility
+
+        Returns:
+            list: arrays of all the outputs
+        """
+        return self.session.run(self.outputs, dict(zip(self.inputs, inputs)))
+
+    def close(self):
+        """
+            Release the session and the graph
+        """
+        self.session.close()
+
+
+class FrozenMaskRCNN(modellib.MaskRCNN):
+
+    def __init__(self, config, keras_model):
+        """
+            Initializer. Mask R-CNN running an exported graph, the keras
+            graph is not built and no weights are loaded.
+
+        Args:
+            config (mrcnn.config.Config): inference configuration
+            keras_model (GraphModel): exported graph
+        """
+        self.mode = 'inference'
+        self.config = config
+        self.model_dir = '../data/'
+        self.keras_model = keras_model
+
+
+def load_model_rcnn(
+    total_num_images,
+    graph_dir=GRAPH_CACHE_DIR,
+    session_config=None,
+    optimization=GRAPH_OPTIMIZATION
+):
+    """
+        Mask R-CNN for inference, loaded from its exported graph when there
+        is one for these weights and batch size. Otherwise the keras model is
+        built, and exported for the next start. Optimized graphs are made
+        from the exported graph the first time they are needed.
+
+    Args:
+        total_num_images (int): number of images per batch
+        graph_dir (str, optional): folder of exported graphs, None always
+            builds the keras model
+        session_config (tf.ConfigProto, optional): configuration of the
+            session of an exported graph, keras models run in the keras
+            session
+        optimization (str, optional): key of GRAPH_TRANSFORMS, None runs the
+            graph as exported
+
+    Returns:
+        mrcnn.model.MaskRCNN: model for detect, detect_boxes or predict_rcnn
+    """
+    start = time.time()
+    if not graph_dir:
+        model = make_model_rcnn(total_num_images)
+        print(f"model startup (keras): {time.time() - start:.1f}s")
+        return model
+    graph_path, names_path = graph_paths(graph_dir, total_num_images)
+    if not os.path.exists(names_path):
+        model = make_model_rcnn(total_num_images)
+        print(f"model startup (keras): {time.time() - start:.1f}s")
+        export_start = time.time()
+        export_frozen_graph(model, graph_path, names_path)
+        print(
+            f"exported {graph_path} in {time.time() - export_start:.1f}s"
+        )
+        if not optimization:
+            return model
+    if optimization:
+        optimized_path, optimized_names_path = graph_paths(
+            graph_dir, total_num_images, optimization
+        )
+        if not os.path.exists(optimized_names_path):
+            optimize_start = time.time()
+            optimize_graph(
+                graph_path,
+                names_path,
+                optimized_path,
+                optimized_names_path,
+                optimization
+            )
+            print(
+                f"optimized {optimized_path} in "
+                f"{time.time() - optimize_start:.1f}s"
+            )
+        graph_path, names_path = optimized_path, optimized_names_path
+    model = FrozenMaskRCNN(
+        make_inference_config(total_num_images),
+        GraphModel(graph_path, names_path, session_config)
+    )
+    print(
+        f"model startup ({optimization or 'frozen'} graph): "
+        f"{time.time() - start:.1f}s"
+    )
     return model
 
 
+def close_model_rcnn(model):
+    """
+        Release a model from load_model_rcnn. Exported graphs run in their
+        own session, which is closed. Keras models share the keras session
+        and are only dereferenced by the caller.
+
+    Args:
+        model (mrcnn.model.MaskRCNN): model to release
+    """
+    if isinstance(model.keras_model, GraphModel):
+        model.keras_model.close()
+
+
+def merge_masks(masks):
+    """
+        Merge instance masks into a single label image. Where masks overlap,
+        the instance detected first (highest score) keeps the pixel.
+
+    Args:
+        masks (numpy.ndarray): (height, width, instances) instance masks
+
+    Returns:
+        numpy.ndarray: (height, width) label image, 0 is background and
+        instance i is labelled i + 1
+    """
+    instances = masks.shape[-1]
+    dtype = np.uint8 if instances < np.iinfo(np.uint8).max else np.uint16
+    if instances == 0:
+        return np.zeros(masks.shape[:2], dtype=dtype)
+    # instances first, so the reduction runs over contiguous planes
+    planes = np.ascontiguousarray(
+        np.moveaxis(masks.astype(bool, copy=False), -1, 0)
+    )
+    # earlier instances get higher weights so they win the max
+    weights = np.arange(instances, 0, -1, dtype=dtype)[:, None, None]
+    labels = (planes * weights).max(axis=0)
+    covered = labels > 0
+    labels[covered] = instances + 1 - labels[covered]
+    return labels
+
+
+def unmold_boxes(detections, original_image_shape, image_shape, window):
+    """
+        Convert the detections of one image to pixel boxes of the original
+        image, as MaskRCNN.unmold_detections does, without the masks
+
+    Args:
+        detections (numpy.ndarray): (N, 6) [y1, x1, y2, x2, class_id, score]
+            in normalized coordinates
+        original_image_shape (tuple): shape of the image before molding
+        image_shape (tuple): shape of the molded image
+        window (numpy.ndarray): [y1, x1, y2, x2] of the image in the molded
+            image
+
+    Returns:
+        dict: 'rois' (N, 4) [y1, x1, y2, x2] pixel boxes and their 'scores'
+    """
+    zero_ix = np.where(detections[:, 4] == 0)[0]
+    count = zero_ix[0] if zero_ix.shape[0] > 0 else detections.shape[0]
+    boxes = detections[:count, :4]
+    scores = detections[:count, 5]
+
+    window = utils.norm_boxes(window, image_shape[:2])
+    wy1, wx1, wy2, wx2 = window
+    shift = np.array([wy1, wx1, wy1, wx1])
+    scale = np.array([wy2 - wy1, wx2 - wx1, wy2 - wy1, wx2 - wx1])
+    boxes = utils.denorm_boxes(
+        np.divide(boxes - shift, scale), original_image_shape[:2]
+    )
+    keep = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) > 0
+    return {'rois': boxes[keep], 'scores': scores[keep]}
+
+
+def detect_boxes(model, images):
+    """
+        Detect ships, keeping only boxes and scores. Instance masks are
+        neither unmolded nor merged.
+
+    Args:
+        model (mrcnn.model.MaskRCNN): model built by make_model_rcnn
+        images (list): list of images, as many as the model batch size
+
+    Returns:
+        list: list of dicts with 'rois' and 'scores' for every image
+    """
+    molded_images, image_metas, windows = model.mold_inputs(images)
+    image_shape = molded_images[0].shape
+    anchors = model.get_anchors(image_shape)
+    anchors = np.broadcast_to(
+        anchors, (model.config.BATCH_SIZE,) + anchors.shape
+    )
+    # first output is the detections, the mask head output is ignored
+    detections = model.keras_model.predict(
+        [molded_images, image_metas, anchors], verbose=0
+    )[0]
+    return [
+        unmold_boxes(detections[index], image.shape, image_shape, windows[index])
+        for index, image in enumerate(images)
+    ]
+
+
 def predict_rcnn(model, images):
-    predictions = model.detect(images)
-    final_preds = list()
-    for pred in (predictions):
-        masks = pred['masks']
-        zero_masks = np.zeros((*masks.shape[:2], 1))
-        if masks.shape[2] == 0:
-            masks = zero_masks
-        masks = np.moveaxis(masks, -1, 0)
-        local_final_preds = zero_masks[:,:,0]
-        for index, mask in enumerate(masks, 1):
-            local_final_preds = np.add(local_final_preds, mask * index)
-        final_preds.append(local_final_preds)
-    return final_preds
+    """
+        Detect ships and merge the instance masks of every image
 
+    Args:
+        model (mrcnn.model.MaskRCNN): model built by make_model_rcnn
+        images (list): list of images, as many as the model batch size
+
+    Returns:
+        numpy.ndarray: (images, height, width) label images
+    """
+    predictions = model.detect(images)
+    return np.stack([merge_masks(pred['masks']) for pred in predictions])
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+
+from config import IMG_SIZE, MOSAIC_OVERLAP, TILE_SIZE, ZOOM_LEVEL
+from georeference import lonlat_to_tile_coordinates, mercator_bounds
+
+
+def plan_canvases(indices, overlap=MOSAIC_OVERLAP, size=IMG_SIZE):
+    """
+        Lay canvases over the tiles to be processed. Canvases are placed on a
+        grid in global pixel coordinates, starting at the top left tile, with
+        a stride of size - overlap pixels.
+
+    Args:
+        indices (list): list of x, y indices
+        overlap (int, optional): overlap of neighbouring canvases in pixels
+        size (int, optional): height and width of the canvases in pixels
+
+    Returns:
+        list: list of (row origin, [column origins]) in pixels, top to bottom,
+        only canvases covering at least one of the tiles are kept
+    """
+    if not len(indices):
+        return list()
+    stride = size - overlap
+    if stride <= 0:
+        raise ValueError(f"overlap has to be smaller than {size} pixels")
+    tiles = np.asarray(indices, dtype=np.int64).reshape(-1, 2)
+    start_x, start_y = tiles.min(axis=0) * TILE_SIZE
+    end_x, end_y = (tiles.max(axis=0) + 1) * TILE_SIZE
+    needed = set(map(tuple, tiles.tolist()))
+    rows = list()
+    for row_origin in range(start_y, end_y, stride):
+        columns = [
+            column_origin
+            for column_origin in range(start_x, end_x, stride)
+            if any(
+                tile in needed
+                for tile in canvas_tiles(column_origin, row_origin, size)
+            )
+        ]
+        if columns:
+            rows.append((row_origin, columns))
+    return rows
+
+
+def canvas_tiles(column_origin, row_origin, size=IMG_SIZE):
+    """
+        Tiles overlapping a canvas
+
+    Args:
+        column_origin (int): left edge of the canvas in global pixels
+        row_origin (int): top edge of the canvas in global pixels
+        size (int, optional): height and width of the canvas in pixels
+
+    Returns:
+        list: list of x, y indices
+    """
+    return [
+        (x_index, y_index)
+        for y_index in range(
+            row_origin // TILE_SIZE, (row_origin + size - 1) // TILE_SIZE + 1
+        )
+        for x_index in range(
+            column_origin // TILE_SIZE, (column_origin + size - 1) // TILE_SIZE + 1
+        )
+    ]
+
+
+def build_canvas(column_origin, row_origin, images, size=IMG_SIZE):
+    """
+        Stitch native resolution tiles into a canvas, tiles which are not
+        available are left black
+
+    Args:
+        column_origin (int): left edge of the canvas in global pixels
+        row_origin (int): top edge of the canvas in global pixels
+        images (dict): x, y index to (TILE_SIZE, TILE_SIZE, 3) image
+        size (int, optional): height and width of the canvas in pixels
+
+    Returns:
+        numpy.ndarray: (size, size, 3) canvas, None if no tile is available
+    """
+    canvas = np.zeros((size, size, 3), dtype=np.uint8)
+    empty = True
+    for x_index, y_index in canvas_tiles(column_origin, row_origin, size):
+        image = images.get((x_index, y_index))
+        if image is None:
+            continue
+        empty = False
+        left = max(column_origin, x_index * TILE_SIZE)
+        right = min(column_origin + size, (x_index + 1) * TILE_SIZE)
+        top = max(row_origin, y_index * TILE_SIZE)
+        bottom = min(row_origin + size, (y_index + 1) * TILE_SIZE)
+        canvas[
+            top - row_origin:bottom - row_origin,
+            left - column_origin:right - column_origin
+        ] = image[
+            top - y_index * TILE_SIZE:bottom - y_index * TILE_SIZE,
+            left - x_index * TILE_SIZE:right - x_index * TILE_SIZE
+        ]
+    if empty:
+        return None
+    return canvas
+
+
+def canvas_bounds(column_origin, row_origin, size=IMG_SIZE, zoom=ZOOM_LEVEL):
+    """
+        Bounds of a canvas
+
+    Args:
+        column_origin (int): left edge of the canvas in global pixels
+        row_origin (int): top edge of the canvas in global pixels
+        size (int, optional): height and width of the canvas in pixels
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        list: [west, south, east, north] of the canvas
+    """
+    return mercator_bounds(
+        [column_origin / TILE_SIZE],
+        [row_origin / TILE_SIZE],
+        [(column_origin + size) / TILE_SIZE],
+        [(row_origin + size) / TILE_SIZE],
+        zoom
+    )[0].tolist()
+
+
+def detection_tiles(boxes, origins, needed, size=IMG_SIZE, zoom=ZOOM_LEVEL):
+    """
+        Tile each detection of a canvas is filed under, the tile under the
+        centre of its box. Centres outside of the needed tiles the canvas
+        overlaps, eg: in a tile of another scene or in the overlap of the
+        canvas, are clamped to the nearest of them.
+
+    Args:
+        boxes (numpy.ndarray): (N, 4) [west, south, east, north] of the
+            detections
+        origins (list): (column origin, row origin) of the canvas of every
+            detection, in global pixels
+        needed (set): x, y indices of the tiles to be detected
+        size (int, optional): height and width of the canvases in pixels
+        zoom (int, optional): zoom level of the tiles
+
+    Returns:
+        list: x, y index of the tile of every detection
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    centres = lonlat_to_tile_coordinates(
+        (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2, zoom
+    )
+    canvases = dict()
+    tiles = list()
+    for (x, y), origin in zip(centres.tolist(), origins):
+        if origin not in canvases:
+            canvases[origin] = [
+                tile for tile in canvas_tiles(*origin, size) if tile in needed
+            ]
+        tile = (math.floor(x), math.floor(y))
+        if tile in canvases[origin]:
+            tiles.append(tile)
+            continue
+        candidates = np.asarray(canvases[origin], dtype=np.float64)
+        # distance from the centre to every candidate tile, 0 inside it
+        x_distance = np.maximum(
+            np.maximum(candidates[:, 0] - x, x - candidates[:, 0] - 1), 0
+        )
+        y_distance = np.maximum(
+            np.maximum(candidates[:, 1] - y, y - candidates[:, 1] - 1), 0
+        )
+        nearest = candidates[np.argmin(x_distance ** 2 + y_distance ** 2)]
+        tiles.append((int(nearest[0]), int(nearest[1])))
+    return tiles
@@ -1,4 +1,7 @@
+import copy
 import json
+import threading
+import time
 
 import mercantile
 
@@ -6,7 +9,9 @@ import numpy as np
 
 import requests
 
-from config import ZOOM_LEVEL
+from config import SEARCH_CACHE_TTL, ZOOM_LEVEL
+from metrics import METRICS
+from requests.adapters import HTTPAdapter
 
 
 BODY = {
@@ -46,18 +51,28 @@ SEARCH_URL = 'https://api.planet.com/data/v1/quick-search'
 
 class PlanetDownloader:
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_ttl=SEARCH_CACHE_TTL):
         """
             Initializer
 
         Args:
             api_key (str): api key for planet data access
+            cache_ttl (int, optional): seconds search results are reused for
+                the same extent, date window and filters, None disables it
         """
         self.api_key = api_key
+        self.cache_ttl = cache_ttl
+        self.cache = dict()
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.auth = (api_key, '')
+        # keep-alive connections reused by the search and its pages
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=4))
 
-    def search_ids(self, extent, start_date_time, end_date_time):
+    def search_body(self, extent, start_date_time, end_date_time):
         """
-            Search scene ids in planet
+            Request body of a search, a new one on every call so searches can
+            run concurrently
 
         Args:
             extent (list): list of coordinates
@@ -65,43 +80,115 @@ class PlanetDownloader:
             end_date_time (str): end time in the format "yyyymmddThhddssZ"
 
         Returns:
-            list: list of ids and tile sizes
+            dict: quick-search request body
         """
-        body = BODY
+        body = copy.deepcopy(BODY)
         body['filter']['config'][0]['config']['coordinates'] = \
             self.prepare_coordinates(extent)
         body['filter']['config'][1]['config'] = {
             'gt': start_date_time,
             'lte': end_date_time
         }
-        response = requests.post(
-            SEARCH_URL, auth=(self.api_key, ''), json=body
-        )
-        # if not 200 raise error
-        response.raise_for_status()
-        parsed_content = json.loads(response.text)
+        return body
 
-        return self.extract_data(parsed_content['features'])
+    def search_features(self, body):
+        """
+            Run a quick-search, following the pages of the results
+
+        Args:
+            body (dict): quick-search request body
 
-    def extract_data(self, parsed_data):
+        Returns:
+            list: features of every page
+        """
+        features = list()
+        with METRICS.timer('search_seconds'):
+            response = self.session.post(SEARCH_URL, json=body)
+            while True:
+                # if not 200 raise error
+                response.raise_for_status()
+                page = json.loads(response.text)
+                features.extend(page['features'])
+                next_url = page.get('_links', {}).get('_next')
+                if not page['features'] or not next_url:
+                    break
+                response = self.session.get(next_url)
+        return features
+
+    def search_ids(self, extent, start_date_time, end_date_time):
+        """
+            Search scene ids in planet
+
+        Args:
+            extent (list): list of coordinates
+            start_date_time (str): start time in the format "yyyymmddThhddssZ"
+            end_date_time (str): end time in the format "yyyymmddThhddssZ"
+
+        Returns:
+            list: list of ids and tile sizes
+        """
+        body = self.search_body(extent, start_date_time, end_date_time)
+        # extent, date window and filters are all part of the body
+        key = json.dumps(body, sort_keys=True)
+        features = None
+        if self.cache_ttl:
+            with self.lock:
+                cached = self.cache.get(key)
+            if cached is not None and time.monotonic() < cached[0]:
+                features = cached[1]
+        if features is None:
+            features = self.search_features(body)
+            METRICS.inc('scene_searches', source='network')
+            if self.cache_ttl:
+                now = time.monotonic()
+                with self.lock:
+                    # drop expired searches so the cache doesn't grow forever
+                    for expired in [
+                        cached_key
+                        for cached_key, (expiry, _) in self.cache.items()
+                        if expiry <= now
+                    ]:
+                        del self.cache[expired]
+                    self.cache[key] = (now + self.cache_ttl, features)
+        else:
+            METRICS.inc('scene_searches', source='cache')
+        return self.extract_data(features, extent)
+
+    def extract_data(self, parsed_data, extent=None):
         """
             Extract coordinates and tile information from the response
 
         Args:
             parsed_data (list): list of items returned by planet
+            extent (list, optional): [left, down, right, up] of the requested
+                area, tiles of the scenes are clipped to it
 
         Returns:
             list: list of item ids and x, y tiles.
         """
         extracted_data = []
+        extent_tiles = None
+        if extent is not None:
+            extent_tiles = self.extent_tile_indices(extent)
         for feature in parsed_data:
             current_data = {'images': []}
             current_data['id'] = feature['id']
+            properties = feature.get('properties', {})
+            current_data['acquired'] = properties.get('acquired')
+            current_data['cloud_cover'] = properties.get('cloud_cover')
             reverted_coordinates = self.revert_coordinates(
                 feature['geometry']['coordinates']
             )
             current_data['coordinates'] = reverted_coordinates
-            current_data['tiles'] = self.tile_indices(reverted_coordinates)
+            # exterior ring, the tile ranges are only its bounding box
+            current_data['footprint'] = feature['geometry']['coordinates'][0]
+            scene_tiles = self.tile_indices(reverted_coordinates)
+            current_data['scene_tiles'] = scene_tiles
+            current_data['tiles'] = scene_tiles
+            if extent_tiles is not None:
+                current_data['tiles'] = self.clip_tiles(scene_tiles, extent_tiles)
+            current_data['saved_tiles'] = self.count_tiles(scene_tiles) - \
+                self.count_tiles(current_data['tiles'])
             extracted_data.append(current_data)
         return extracted_data
 
@@ -149,6 +236,54 @@ class PlanetDownloader:
         )
         return [[start_x, end_x], [start_y, end_y]]
 
+    def extent_tile_indices(self, extent):
+        """
+            Extract indices of every tile touching the extent, including the
+            tiles on its right and bottom edges
+
+        Args:
+            extent (list): [left, down, right, up]
+
+        Returns:
+            list: [[start_x, end_x], [start_y, end_y]], end excluded
+        """
+        (start_x, end_x), (start_y, end_y) = self.tile_indices(extent)
+        return [[start_x, end_x + 1], [start_y, end_y + 1]]
+
+    def clip_tiles(self, scene_tiles, extent_tiles):
+        """
+            Intersect the tile range of a scene with the tile range of the
+            requested extent
+
+        Args:
+            scene_tiles (list): [[start_x, end_x], [start_y, end_y]]
+            extent_tiles (list): [[start_x, end_x], [start_y, end_y]]
+
+        Returns:
+            list: [[start_x, end_x], [start_y, end_y]] of the overlap, empty
+            ranges if they don't overlap
+        """
+        return [
+            [
+                max(scene_range[0], extent_range[0]),
+                min(scene_range[1], extent_range[1])
+            ]
+            for scene_range, extent_range in zip(scene_tiles, extent_tiles)
+        ]
+
+    def count_tiles(self, tiles):
+        """
+            Number of tiles in a tile range
+
+        Args:
+            tiles (list): [[start_x, end_x], [start_y, end_y]]
+
+        Returns:
+            int: number of tiles, end excluded
+        """
+        (start_x, end_x), (start_y, end_y) = tiles
+        return max(end_x - start_x, 0) * max(end_y - start_y, 0)
+
     def prepare_coordinates(self, extent):
         """
             Revert the coordinates from flat notation to extended coordinate
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+
+from config import PREFETCH_DEPTH
+
+DONE = 'done'
+ERROR = 'error'
+ITEM = 'item'
+
+# how often a blocked producer checks whether the consumer went away
+POLL_INTERVAL = 0.1
+
+
+class Prefetcher:
+
+    def __init__(self, iterable, depth=PREFETCH_DEPTH):
+        """
+            Run an iterable on a background thread, keeping at most `depth`
+            items ready ahead of the consumer.
+
+        Args:
+            iterable (iterable): iterable to be consumed, eg: batches from
+                Infer.prepare_dataset
+            depth (int, optional): size of the prefetch queue
+        """
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+        self.items = 0
+        # time spent producing items
+        self.produce_time = 0.0
+        # time the producer was blocked on a full queue, consumer is slower
+        self.producer_wait = 0.0
+        # time the consumer was blocked on an empty queue, producer is slower
+        self.consumer_wait = 0.0
+        self.thread = threading.Thread(
+            target=self.produce, args=(iterable,), daemon=True
+        )
+        self.thread.start()
+
+    def produce(self, iterable):
+        """
+            Pull items from the iterable and push them into the queue
+
+        Args:
+            iterable (iterable): iterable to be consumed
+        """
+        try:
+            iterator = iter(iterable)
+            while True:
+                start = time.time()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.produce_time += time.time() - start
+                if not self.put(ITEM, item):
+                    return
+        except Exception as error:
+            self.put(ERROR, error)
+            return
+        self.put(DONE, None)
+
+    def put(self, kind, item):
+        """
+            Put an entry into the queue, blocking while it is full
+
+        Args:
+            kind (str): one of ITEM, ERROR, DONE
+            item (object): item to be passed to the consumer
+
+        Returns:
+            bool: False if the consumer stopped before the entry was queued
+        """
+        start = time.time()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put((kind, item), timeout=POLL_INTERVAL)
+            except queue.Full:
+                continue
+            self.producer_wait += time.time() - start
+            return True
+        return False
+
+    def __iter__(self):
+        try:
+            while True:
+                start = time.time()
+                kind, item = self.queue.get()
+                self.consumer_wait += time.time() - start
+                if kind == DONE:
+                    return
+                if kind == ERROR:
+                    raise item
+                self.items += 1
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+            Stop the producer, it exits the next time it touches the queue
+        """
+        self.stopped.set()
+
+    def stats(self):
+        """
+            Per stage timings, in seconds
+
+        Returns:
+            dict: number of items, time spent producing, and time each side
+            spent waiting for the other
+        """
+        return {
+            'items': self.items,
+            'produce_time': round(self.produce_time, 3),
+            'producer_wait': round(self.producer_wait, 3),
+            'consumer_wait': round(self.consumer_wait, 3)
+        }
@@ -0,0 +1,161 @@
+from config import SCENE_PREFERENCE
+from georeference import polygon_intersects_boxes, tile_bounds
+
+# score of a scene for each preference, the highest score is preferred
+PREFERENCES = {
+    'cloud_cover': lambda scene: -(
+        scene['cloud_cover'] if scene.get('cloud_cover') is not None
+        else float('inf')
+    ),
+    'latest': lambda scene: scene.get('acquired') or ''
+}
+
+# fixed cost of a batch, in images, when no profile is available
+BATCH_OVERHEAD = 4
+
+
+class TileScheduler:
+
+    def __init__(self, preference=SCENE_PREFERENCE):
+        """
+            Initializer. Collects the tiles needed by every extent of a run so
+            each unique tile is detected once.
+
+        Args:
+            preference (str, optional): None to detect every scene covering a
+                tile, 'cloud_cover' to keep only the scene with the least
+                cloud cover, 'latest' to keep only the latest acquisition
+        """
+        if preference is not None and preference not in PREFERENCES:
+            raise ValueError(f"unknown scene preference: {preference}")
+        self.preference = preference
+        self.scenes = dict()
+        self.tiles = dict()
+        # (scene_id, x, y) of the tiles overlapping the scene footprint
+        self.covered = set()
+        self.requested = 0
+        self.assignments = None
+
+    def add(self, location, scene, indices):
+        """
+            Add the tiles of a scene needed by a location
+
+        Args:
+            location (str): label of the extent
+            scene (dict): scene as returned by PlanetDownloader.search_ids,
+                tiles of its range outside of its footprint, if given, are
+                only taken from it when no other scene covers them
+            indices (list): list of x, y indices
+        """
+        scene_id = scene['id']
+        self.scenes.setdefault(scene_id, scene)
+        covered = [True] * len(indices)
+        if scene.get('footprint') and indices:
+            covered = polygon_intersects_boxes(
+                scene['footprint'], tile_bounds(indices)
+            ).tolist()
+        for (x_index, y_index), covers in zip(indices, covered):
+            self.requested += 1
+            locations = self.tiles.setdefault((scene_id, x_index, y_index), [])
+            if location not in locations:
+                locations.append(location)
+            if covers:
+                self.covered.add((scene_id, x_index, y_index))
+        self.assignments = None
+
+    def plan(self):
+        """
+            Deduplicate the collected tiles, choosing one scene per tile if a
+            preference is set
+
+        Returns:
+            list: list of (scene_id, indices), one per scene in the order the
+            scenes were added
+        """
+        if self.preference is None:
+            self.assignments = self.tiles
+        else:
+            self.assignments = self.prefer()
+        units = dict()
+        for scene_id, x_index, y_index in self.assignments:
+            units.setdefault(scene_id, []).append((x_index, y_index))
+        return list(units.items())
+
+    def prefer(self):
+        """
+            Pick the preferred scene of every tile, the locations needing the
+            tile from any scene are served by the preferred one. Scenes whose
+            footprint covers the tile come first, corners of the rectangular
+            tile range of a scene may be outside of its footprint.
+
+        Returns:
+            dict: (scene_id, x, y) to list of locations
+        """
+        score = PREFERENCES[self.preference]
+
+        def rank(key):
+            return key in self.covered, score(self.scenes[key[0]])
+
+        preferred = dict()
+        locations = dict()
+        for key in self.tiles:
+            scene_id, x_index, y_index = key
+            tile = (x_index, y_index)
+            current = preferred.get(tile)
+            if current is None or rank(key) > rank((current, *tile)):
+                preferred[tile] = scene_id
+            tile_locations = locations.setdefault(tile, [])
+            for location in self.tiles[key]:
+                if location not in tile_locations:
+                    tile_locations.append(location)
+        return {
+            (scene_id, *tile): locations[tile]
+            for tile, scene_id in preferred.items()
+        }
+
+    def locations(self, scene_id, x_index, y_index):
+        """
+            Locations the detections of a tile should be reported for
+
+        Args:
+            scene_id (str): planetscope scene id
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+
+        Returns:
+            list: list of location labels
+        """
+        return self.assignments.get((scene_id, x_index, y_index), [])
+
+    def unique(self):
+        """
+            Number of tiles left after deduplication
+
+        Returns:
+            int: number of (scene_id, x, y) units to be detected
+        """
+        return len(self.assignments)
+
+
+def choose_batch_size(count, batch_sizes, profile=None):
+    """
+        Batch size detecting a number of images in the least time. With a
+        profile from autotune.py the time of every batch size is known,
+        without one a batch is assumed to cost as much as its slots, padding
+        included, plus BATCH_OVERHEAD.
+
+    Args:
+        count (int): number of images to detect
+        batch_sizes (list): batch sizes to choose from
+        profile (dict, optional): seconds per batch of each batch size
+
+    Returns:
+        int: batch size, the largest one on ties
+    """
+    def cost(batch_size):
+        batches = -(-count // batch_size)
+        if profile and batch_size in profile:
+            return batches * profile[batch_size]
+        return batches * (batch_size + BATCH_OVERHEAD)
+
+    return min(sorted(batch_sizes, reverse=True), key=cost)
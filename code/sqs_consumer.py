@@ -0,0 +1,326 @@
+import boto3
+import threading
+import time
+
+from config import (
+    ACCOUNT_NUMBER,
+    SQS_MAX_MESSAGES,
+    SQS_VISIBILITY_TIMEOUT,
+    SQS_WAIT_SECONDS
+)
+from metrics import METRICS
+
+QUEUE_URL = f"https://queue.amazonaws.com/{ACCOUNT_NUMBER}/{{}}"
+
+REGION = 'us-east-1'
+
+# credentials are renewed this many seconds before they expire
+REFRESH_MARGIN = 300
+
+ROLE_NAME = 'PlanetOrderEc2Role'
+ROLE_ARN = f'arn:aws:iam::{ACCOUNT_NUMBER}:role/{ROLE_NAME}'
+
+# most entries accepted by the sqs batch calls
+SQS_BATCH_LIMIT = 10
+
+
+class AssumedRoleSession:
+
+    def __init__(self, role_arn=ROLE_ARN, role_name=ROLE_NAME, region=REGION):
+        """
+            Initializer. Assumes the role once and reuses its credentials
+            until shortly before they expire.
+
+        Args:
+            role_arn (str, optional): arn of the role to assume
+            role_name (str, optional): session name of the assumed role
+            region (str, optional): region of the session
+        """
+        self.role_arn = role_arn
+        self.role_name = role_name
+        self.region = region
+        self.lock = threading.Lock()
+        self.current = None
+        self.clients = dict()
+        self.expiration = 0
+
+    def session(self):
+        """
+            boto3 session of the role, renewed when its credentials are about
+            to expire
+
+        Returns:
+            boto3.session.Session: session with the assumed role credentials
+        """
+        with self.lock:
+            if time.time() > self.expiration - REFRESH_MARGIN:
+                client = boto3.client('sts')
+                creds = client.assume_role(
+                    RoleArn=self.role_arn, RoleSessionName=self.role_name
+                )['Credentials']
+                self.current = boto3.session.Session(
+                    aws_access_key_id=creds['AccessKeyId'],
+                    aws_secret_access_key=creds['SecretAccessKey'],
+                    aws_session_token=creds['SessionToken'],
+                    region_name=self.region
+                )
+                self.clients = dict()
+                self.expiration = creds['Expiration'].timestamp()
+                METRICS.inc('assume_role')
+            return self.current
+
+    def client(self, service):
+        """
+            Client of a service, reused while the credentials are valid
+
+        Args:
+            service (str): name of the service, eg: 'sqs'
+
+        Returns:
+            botocore.client.BaseClient: client of the service
+        """
+        session = self.session()
+        with self.lock:
+            if service not in self.clients:
+                self.clients[service] = session.client(service)
+            return self.clients[service]
+
+
+class SQSConsumer:
+
+    def __init__(
+        self,
+        queue,
+        credentials=None,
+        client=None,
+        queue_url=None,
+        wait_seconds=SQS_WAIT_SECONDS,
+        max_messages=SQS_MAX_MESSAGES,
+        visibility_timeout=SQS_VISIBILITY_TIMEOUT
+    ):
+        """
+            Initializer. Long polls a queue in batches and handles the
+            messages one by one. The messages being handled, or handled and
+            waiting to be deleted, are kept invisible to other consumers by a
+            heartbeat, and deleted together once the batch is handled.
+
+        Args:
+            queue (str): name of the queue
+            credentials (AssumedRoleSession, optional): source of the sqs
+                client, the default boto3 credentials are used without it
+            client (botocore.client.SQS, optional): sqs client used instead
+                of credentials, eg: one backed by moto
+            queue_url (str, optional): url of the queue, from QUEUE_URL and
+                the name when not given
+            wait_seconds (int, optional): long polling wait, 20 at most
+            max_messages (int, optional): messages received per poll, 10 at
+                most, 1 when a message takes longer than the visibility
+                timeout so others aren't held back
+            visibility_timeout (int, optional): seconds received messages are
+                hidden for, the claimed ones are extended every third of it
+                until they are deleted
+        """
+        self.queue = queue
+        self.credentials = credentials
+        self.client = client
+        self.queue_url = queue_url or QUEUE_URL.format(queue)
+        self.wait_seconds = wait_seconds
+        self.max_messages = max_messages
+        self.visibility_timeout = visibility_timeout
+        # receipt handles of the messages being handled or to be deleted
+        self.in_flight = dict()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = threading.Thread(target=self.beat, daemon=True)
+        self.heartbeat.start()
+
+    def sqs(self):
+        """
+            sqs client, renewed with the credentials
+
+        Returns:
+            botocore.client.SQS: sqs client
+        """
+        if self.client is not None:
+            return self.client
+        if self.credentials is not None:
+            return self.credentials.client('sqs')
+        self.client = boto3.client('sqs', region_name=REGION)
+        return self.client
+
+    def receive(self, attribute_names=('All',)):
+        """
+            Long poll the queue for a batch of messages
+
+        Args:
+            attribute_names (tuple, optional): message attributes to receive
+
+        Returns:
+            list: received messages, empty if none arrived while waiting
+        """
+        with METRICS.timer('sqs_receive_seconds', queue=self.queue):
+            response = self.sqs().receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=self.max_messages,
+                WaitTimeSeconds=self.wait_seconds,
+                VisibilityTimeout=self.visibility_timeout,
+                MessageAttributeNames=list(attribute_names)
+            )
+        messages = response.get('Messages', [])
+        METRICS.inc('sqs_received', len(messages), queue=self.queue)
+        return messages
+
+    def beat(self):
+        """
+            Extend the visibility of the claimed messages until stopped
+        """
+        while not self.stopped.wait(self.visibility_timeout / 3):
+            with self.lock:
+                in_flight = list(self.in_flight.values())
+            try:
+                self.change_visibility(in_flight, self.visibility_timeout)
+            except Exception as error:
+                # the next beat retries, before the messages reappear
+                print(f"visibility heartbeat failed: {error}")
+
+    def change_visibility(self, receipt_handles, timeout):
+        """
+            Set the visibility timeout of messages, in batches
+
+        Args:
+            receipt_handles (list): receipt handles of the messages
+            timeout (int): seconds from now the messages stay hidden for
+
+        Returns:
+            list: receipt handles changed successfully
+        """
+        changed = list()
+        for start in range(0, len(receipt_handles), SQS_BATCH_LIMIT):
+            chunk = receipt_handles[start:start + SQS_BATCH_LIMIT]
+            entries = [
+                {
+                    'Id': str(index),
+                    'ReceiptHandle': receipt_handle,
+                    'VisibilityTimeout': timeout
+                }
+                for index, receipt_handle in enumerate(chunk)
+            ]
+            response = self.sqs().change_message_visibility_batch(
+                QueueUrl=self.queue_url, Entries=entries
+            )
+            successful = response.get('Successful', [])
+            METRICS.inc(
+                'sqs_visibility_changed', len(successful), queue=self.queue
+            )
+            changed.extend(chunk[int(entry['Id'])] for entry in successful)
+        return changed
+
+    def claim(self, message):
+        """
+            Start handling a message, its visibility is extended by the
+            heartbeat from now on
+
+        Args:
+            message (dict): message as returned by receive
+
+        Returns:
+            bool: False if the message reappeared while waiting for the
+            earlier ones of its batch, and may be handled elsewhere
+        """
+        receipt_handle = message['ReceiptHandle']
+        if not self.change_visibility([receipt_handle], self.visibility_timeout):
+            return False
+        with self.lock:
+            self.in_flight[message['MessageId']] = receipt_handle
+        return True
+
+    def delete(self, messages):
+        """
+            Delete handled messages from the queue, in batches
+
+        Args:
+            messages (list): messages as returned by receive
+
+        Returns:
+            list: messages deleted successfully
+        """
+        deleted = list()
+        for start in range(0, len(messages), SQS_BATCH_LIMIT):
+            chunk = messages[start:start + SQS_BATCH_LIMIT]
+            entries = [
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                for index, message in enumerate(chunk)
+            ]
+            with METRICS.timer('sqs_delete_seconds', queue=self.queue):
+                response = self.sqs().delete_message_batch(
+                    QueueUrl=self.queue_url, Entries=entries
+                )
+            for failed in response.get('Failed', []):
+                print(f"delete failed: {failed}")
+            successful = response.get('Successful', [])
+            METRICS.inc('sqs_deleted', len(successful), queue=self.queue)
+            deleted.extend(chunk[int(entry['Id'])] for entry in successful)
+            with self.lock:
+                for message in chunk:
+                    self.in_flight.pop(message['MessageId'], None)
+        return deleted
+
+    def release(self, messages):
+        """
+            Make messages visible again right away, eg: after a failure
+
+        Args:
+            messages (list): messages as returned by receive
+        """
+        with self.lock:
+            for message in messages:
+                self.in_flight.pop(message['MessageId'], None)
+        self.change_visibility(
+            [message['ReceiptHandle'] for message in messages], 0
+        )
+
+    def run(self, handle, deleted=None, polls=None):
+        """
+            Receive messages and pass them to handle one by one. Handled
+            messages are kept hidden by the heartbeat and deleted together,
+            in one batch call, once every message of the receive is handled.
+            When handle raises, the handled messages are deleted, the failed
+            one and the ones waiting after it are released and the error is
+            raised again.
+
+        Args:
+            handle (callable): called with every message
+            deleted (callable, optional): called with every message once it
+                is deleted from the queue
+            polls (int, optional): number of polls, None polls forever
+        """
+        poll = 0
+        while polls is None or poll < polls:
+            poll += 1
+            messages = self.receive()
+            handled = list()
+            try:
+                for position, message in enumerate(messages):
+                    if not self.claim(message):
+                        print(
+                            f"message {message['MessageId']} expired, skipped"
+                        )
+                        continue
+                    try:
+                        handle(message)
+                    except BaseException:
+                        self.release(messages[position:])
+                        raise
+                    handled.append(message)
+            finally:
+                for message in self.delete(handled):
+                    if deleted is not None:
+                        deleted(message)
+            print('Poll completed')
+
+    def close(self):
+        """
+            Stop the heartbeat
+        """
+        self.stopped.set()
+        self.heartbeat.join()
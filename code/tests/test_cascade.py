@@ -0,0 +1,70 @@
+import numpy as np
+
+from batching import TileBatch
+from cascade import Cascade
+from config import SCREEN_INPUT_SCALE
+
+# tiles 0 to 13, ships on the ones divisible by 3 or equal to 13
+TILES = [(2620 + number, 6331) for number in range(14)]
+SHIPS = {number for number in range(14) if number % 3 == 0 or number == 13}
+
+
+class ScreenModel:
+
+    def __init__(self):
+        self.calls = list()
+
+    def predict(self, images, batch_size):
+        self.calls.append(len(images))
+        # the tile number is stored in the pixels, scaled for the U-Net
+        assert images.dtype == np.float32 and images.max() <= 1.0
+        numbers = np.rint(images[:, 0, 0, 0] / SCREEN_INPUT_SCALE).astype(int)
+        probabilities = np.zeros(images.shape[:3] + (1,), dtype=np.float32)
+        for position, number in enumerate(numbers):
+            if number in SHIPS:
+                probabilities[position, 3, 5] = 0.9
+            else:
+                probabilities[position] = 0.2
+        return probabilities
+
+
+def batches(size):
+    batch = TileBatch()
+    for number, tile in enumerate(TILES):
+        batch.add(np.full((8, 8, 3), number, np.uint8), [number] * 4, tile)
+        if len(batch) == size:
+            yield batch
+            yield TileBatch()
+            batch = TileBatch()
+    if len(batch):
+        yield batch
+
+
+def test_passed_tiles_are_repacked_into_full_batches():
+    model = ScreenModel()
+    cascade = Cascade(model, batch_size=3, threshold=0.5)
+    repacked = list(cascade.screen(batches(4)))
+
+    # empty batches are not sent to the U-Net
+    assert model.calls == [4, 4, 4, 2]
+    assert [len(batch) for batch in repacked] == [3, 3]
+    numbers = [number for number in range(14) if number in SHIPS]
+    for batch, expected in zip(repacked, [numbers[:3], numbers[3:]]):
+        assert batch.tiles == [TILES[number] for number in expected]
+        assert batch.bounding_boxes == [[number] * 4 for number in expected]
+        assert [int(image[0, 0, 0]) for image in batch.images] == expected
+    assert cascade.stats() == {
+        'screened': 14,
+        'passed': 6,
+        'screen_batches': 4,
+        'detect_batches': 2,
+        'screen_time': cascade.stats()['screen_time']
+    }
+
+
+def test_last_batch_may_be_partial():
+    cascade = Cascade(ScreenModel(), batch_size=4, threshold=0.5)
+    repacked = list(cascade.screen(batches(5), batch_size=5))
+    assert [len(batch) for batch in repacked] == [5, 1]
+    assert repacked[-1].tiles == [TILES[13]]
+    assert cascade.stats()['detect_batches'] == 2
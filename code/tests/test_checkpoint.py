@@ -0,0 +1,170 @@
+import json
+import numpy as np
+import pytest
+
+from checkpoint import Checkpoint
+from config import MIN_VALID_FRACTION, MOSAIC_OVERLAP, TILE_SIZE
+from infer import Infer
+from io import BytesIO
+from PIL import Image
+
+SCENE_ID = '20200101_180000_0f00'
+
+# 24 tiles, 4 of them missing and 4 of them transparent
+INDICES = [(x_index, y_index) for x_index in range(2620, 2626)
+           for y_index in range(6331, 6335)]
+MISSING = set(INDICES[3::6])
+EMPTY = set(INDICES[5::6])
+
+
+def png(alpha):
+    pixels = np.full((TILE_SIZE, TILE_SIZE, 4), 128, np.uint8)
+    pixels[..., 3] = alpha
+    content = BytesIO()
+    Image.fromarray(pixels, 'RGBA').save(content, format='PNG')
+    return content.getvalue()
+
+
+class StubFetcher:
+
+    def __init__(self):
+        self.fetched = list()
+        self.opaque = png(255)
+        self.transparent = png(0)
+
+    def fetch(self, scene_id, indices):
+        for x_index, y_index in indices:
+            self.fetched.append((x_index, y_index))
+            if (x_index, y_index) in MISSING:
+                yield x_index, y_index, 404, b''
+            elif (x_index, y_index) in EMPTY:
+                yield x_index, y_index, 200, self.transparent
+            else:
+                yield x_index, y_index, 200, self.opaque
+
+
+class Killed(Exception):
+    pass
+
+
+def make_infer(kill_after=None, input_mode='upsample'):
+    infer = Infer.__new__(Infer)
+    infer.input_mode = input_mode
+    infer.mosaic_overlap = MOSAIC_OVERLAP
+    infer.prefetch_depth = 0
+    infer.cascade = None
+    infer.inference_pool = None
+    infer.batch_sizes = [4]
+    infer.batch_profile = None
+    infer.min_valid_fraction = MIN_VALID_FRACTION
+    infer.postprocess = 'boxes'
+    infer.tile_fetcher = StubFetcher()
+    batches = [0]
+
+    def predict(images):
+        batches[0] += 1
+        if kill_after is not None and batches[0] > kill_after:
+            raise Killed()
+        return [
+            {'rois': np.array([[100, 120, 180, 300]]), 'scores': [0.9]}
+            for _ in images
+        ]
+
+    infer.predict = predict
+    return infer
+
+
+def features(detected):
+    return sorted(
+        json.dumps(geojson, sort_keys=True)
+        for _, geojsons in detected for geojson in geojsons
+    )
+
+
+def test_resume_after_kill(tmp_path):
+    expected = features(make_infer().detect_scene(SCENE_ID, INDICES))
+    path = str(tmp_path / 'checkpoints.sqlite')
+
+    checkpoint = Checkpoint(path, 'message/2020-01-01')
+    killed = make_infer(kill_after=3)
+    with pytest.raises(Killed):
+        list(killed.resume_scene(SCENE_ID, INDICES, checkpoint))
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path, 'message/2020-01-01')
+    done = set(checkpoint.tiles(SCENE_ID))
+    # three batches of four decoded tiles end at the 17th tile, the missing
+    # and empty tiles before it are done as well
+    assert done == set(INDICES[:17])
+    assert done & MISSING and done & EMPTY
+    resumed = make_infer()
+    detected = list(resumed.resume_scene(SCENE_ID, INDICES, checkpoint))
+    assert features(detected) == expected
+    assert set(resumed.tile_fetcher.fetched) == set(INDICES) - done
+    assert checkpoint.scene_complete(SCENE_ID)
+
+    again = make_infer()
+    detected = list(again.resume_scene(SCENE_ID, INDICES, checkpoint))
+    assert features(detected) == expected
+    assert again.tile_fetcher.fetched == []
+
+
+def test_mosaic_resume_after_kill(tmp_path):
+    full = dict(make_infer(input_mode='mosaic').detect_scene(SCENE_ID, INDICES))
+    path = str(tmp_path / 'checkpoints.sqlite')
+
+    checkpoint = Checkpoint(path, 'message/2020-01-01')
+    killed = make_infer(kill_after=1, input_mode='mosaic')
+    with pytest.raises(Killed):
+        list(killed.resume_scene(SCENE_ID, INDICES, checkpoint))
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path, 'message/2020-01-01')
+    stored = checkpoint.tiles(SCENE_ID)
+    # the first batch is the top row of three canvases, over the top three
+    # rows of tiles, and the first canvas of the next row, over the two
+    # bottom ones. Only the tiles no later canvas overlaps are done.
+    assert set(stored) == {
+        (x_index, y_index) for x_index, y_index in INDICES
+        if y_index < 6333 or x_index < 2622
+    }
+    for tile, geojsons in stored.items():
+        assert geojsons == full.get(tile, [])
+    resumed = make_infer(input_mode='mosaic')
+    detected = list(resumed.resume_scene(SCENE_ID, INDICES, checkpoint))
+    assert set(resumed.tile_fetcher.fetched) == set(INDICES) - set(stored)
+    assert {tile for tile, _ in detected} <= set(INDICES)
+    assert checkpoint.scene_complete(SCENE_ID)
+
+
+def test_uploads_are_kept_per_run(tmp_path):
+    path = str(tmp_path / 'checkpoints.sqlite')
+    checkpoint = Checkpoint(path, 'message/2020-01-01')
+    other = Checkpoint(path, 'message/2020-01-02')
+    checkpoint.save_upload(SCENE_ID, 'New York', 3)
+    checkpoint.save_upload('20200101_180100_0f00', 'New York', 2)
+    assert checkpoint.uploaded(SCENE_ID, 'New York')
+    assert not other.uploaded(SCENE_ID, 'New York')
+    assert checkpoint.upload_counts() == {'New York': 5}
+    checkpoint.save_forwarded()
+    checkpoint.clear()
+    assert not checkpoint.uploaded(SCENE_ID, 'New York')
+    assert not checkpoint.forwarded()
+
+
+def test_detections_are_spooled_per_run():
+    # a temporary database, as used without checkpoints
+    checkpoint = Checkpoint('', 'message/2020-01-01')
+    first = [{'properties': {'area': 10}}]
+    second = [{'properties': {'area': 20}}, {'properties': {'area': 30}}]
+    checkpoint.save_detections(SCENE_ID, 'New York', first)
+    checkpoint.save_detections('20200101_180100_0f00', 'New York', second)
+    checkpoint.save_detections(SCENE_ID, 'Los Angeles', second)
+    assert checkpoint.detections('New York') == first + second
+    assert checkpoint.detections('San Francisco') == []
+    # a resumed scene replaces its detections
+    checkpoint.save_detections(SCENE_ID, 'Los Angeles', first)
+    assert checkpoint.detections('Los Angeles') == first
+    checkpoint.clear()
+    assert checkpoint.detections('New York') == []
+    checkpoint.close()
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from config import IMG_SIZE
+from georeference import (
+    boxes_to_lonlat,
+    lonlat_to_tiles,
+    polygon_intersects_boxes,
+    tile_bounds
+)
+
+TILES = [(2620, 6331), (2621, 6331), (9000, 3000), (100, 15000)]
+
+BOXES = np.array([
+    [0, 0, IMG_SIZE, IMG_SIZE],
+    [100, 120, 180, 300],
+    [511, 3, 700, 9],
+    [42, 618, 43, 619]
+])
+
+
+def test_boxes_match_the_rasterio_transform():
+    transform = pytest.importorskip('rasterio.transform')
+    bounds = tile_bounds(TILES)
+    corners = boxes_to_lonlat(BOXES, bounds)
+    for box, bound, corner in zip(BOXES, bounds, corners):
+        affine = transform.from_bounds(*bound, IMG_SIZE, IMG_SIZE)
+        # rasterio defaults to the centre of the pixels
+        (left, right), (up, down) = transform.xy(
+            affine, [box[0], box[2]], [box[1], box[3]]
+        )
+        np.testing.assert_allclose(corner, [left, up, right, down], atol=1e-9)
+
+
+def test_tiles_match_mercantile():
+    mercantile = pytest.importorskip('mercantile')
+    bounds = tile_bounds(TILES)
+    for (x_index, y_index), bound in zip(TILES, bounds):
+        expected = mercantile.bounds(x_index, y_index, 14)
+        np.testing.assert_allclose(bound, list(expected), atol=1e-9)
+    # the centre of every tile falls back into it
+    centres = lonlat_to_tiles(
+        (bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2
+    )
+    assert [tuple(tile) for tile in centres.tolist()] == TILES
+
+
+def test_polygon_overlap_with_boxes():
+    diamond = [[0, -1], [1, 0], [0, 1], [-1, 0], [0, -1]]
+    boxes = [
+        [-0.1, -0.1, 0.1, 0.1],  # inside
+        [-5, -5, 5, 5],  # around it
+        [0.45, 0.45, 0.7, 0.7],  # across an edge
+        [0.9, -0.05, 2, 0.05],  # around a vertex
+        [0.8, 0.8, 1.2, 1.2],  # next to an edge
+        [2, 2, 3, 3]  # far away
+    ]
+    assert polygon_intersects_boxes(diamond, boxes).tolist() == [
+        True, True, True, True, False, False
+    ]
+    # rings don't have to be closed
+    assert polygon_intersects_boxes(diamond[:-1], boxes).tolist() == [
+        True, True, True, True, False, False
+    ]
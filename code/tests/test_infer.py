@@ -0,0 +1,28 @@
+import infer as infer_module
+
+from infer import Infer
+
+
+def test_one_model_is_kept_loaded(monkeypatch):
+    loaded = list()
+    closed = list()
+
+    def load_model_rcnn(batch_size, graph_dir, optimization=None):
+        loaded.append(batch_size)
+        return f'model {batch_size}'
+
+    monkeypatch.setattr(infer_module, 'load_model_rcnn', load_model_rcnn)
+    monkeypatch.setattr(infer_module, 'close_model_rcnn', closed.append)
+    infer = Infer.__new__(Infer)
+    infer.graph_cache_dir = None
+    infer.graph_optimization = None
+    infer.model = None
+    infer.model_batch_size = None
+
+    assert infer.model_for(32) == 'model 32'
+    assert infer.model_for(32) == 'model 32'
+    assert infer.model_for(8) == 'model 8'
+    assert infer.model_for(32) == 'model 32'
+    assert loaded == [32, 8, 32]
+    # the previous model is released before the next one is loaded
+    assert closed == ['model 32', 'model 8']
@@ -0,0 +1,105 @@
+from config import IMG_SIZE
+from georeference import feature_boxes, mercator_bounds
+from merge import DetectionMerger
+
+X_INDEX, Y_INDEX = 2620, 6331
+
+
+def feature(min_row, min_col, max_row, max_col, area=100, x_index=X_INDEX,
+            y_index=Y_INDEX):
+    """
+        Feature of a box given in pixels of a tile, rows and columns out of
+        0 to IMG_SIZE fall into the neighbouring tiles
+    """
+    (west, south, east, north), = mercator_bounds(
+        [x_index + min_col / IMG_SIZE],
+        [y_index + min_row / IMG_SIZE],
+        [x_index + max_col / IMG_SIZE],
+        [y_index + max_row / IMG_SIZE]
+    ).tolist()
+    return {
+        'type': 'Feature',
+        'properties': {'area': area},
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[
+                [west, south], [east, south], [east, north], [west, north],
+                [west, south]
+            ]]
+        }
+    }
+
+
+def merge(*features):
+    merger = DetectionMerger()
+    merger.add(list(features))
+    return merger.flush()
+
+
+def test_ship_split_across_x_seam_is_merged():
+    west_part = feature(200, IMG_SIZE - 60, 230, IMG_SIZE, area=1800)
+    east_part = feature(201, IMG_SIZE, 229, IMG_SIZE + 40, area=1120)
+    merged = merge(west_part, east_part)
+    assert len(merged) == 1
+    assert merged[0]['properties']['area'] == 1800 + 1120
+    box = feature_boxes(merged)[0]
+    assert box[0] == feature_boxes([west_part])[0][0]
+    assert box[2] == feature_boxes([east_part])[0][2]
+
+
+def test_ship_split_across_y_seam_is_merged():
+    north_part = feature(IMG_SIZE - 50, 300, IMG_SIZE, 330, area=1500)
+    south_part = feature(IMG_SIZE + 1, 302, IMG_SIZE + 20, 331, area=551)
+    merged = merge(north_part, south_part)
+    assert len(merged) == 1
+    assert merged[0]['properties']['area'] == 1500 + 551
+
+
+def test_adjacent_ships_are_kept_apart():
+    # side by side in the same tile, one pixel apart
+    assert len(merge(
+        feature(100, 100, 140, 200), feature(141, 100, 180, 200)
+    )) == 2
+    # stacked across an x seam, close to each other but one of them doesn't
+    # reach the seam
+    assert len(merge(
+        feature(0, IMG_SIZE - 100, 50, IMG_SIZE + 18),
+        feature(51, IMG_SIZE + 8, 100, IMG_SIZE + 90)
+    )) == 2
+    # on both sides of a y seam, far from it
+    assert len(merge(
+        feature(IMG_SIZE - 40, 300, IMG_SIZE - 30, 330),
+        feature(IMG_SIZE + 30, 300, IMG_SIZE + 40, 330)
+    )) == 2
+
+
+def test_duplicates_in_the_same_tile_are_merged():
+    merged = merge(
+        feature(100, 100, 140, 200, area=4000),
+        feature(102, 101, 141, 199, area=3900)
+    )
+    assert len(merged) == 1
+    assert merged[0]['properties']['area'] == 4000
+
+
+def test_flush_returns_only_new_detections():
+    merger = DetectionMerger()
+    first = feature(100, 100, 140, 200)
+    merger.add([first])
+    assert merger.flush() == [first]
+    assert merger.flush() == []
+    second = feature(400, 100, 440, 200)
+    merger.add([second])
+    assert merger.flush() == [second]
+
+
+def test_flush_releases_the_detections():
+    merger = DetectionMerger()
+    ship = feature(100, 100, 140, 200)
+    merger.add([ship])
+    merger.flush()
+    assert len(merger) == 0
+    assert merger.grid == {}
+    # nothing is kept, the same ship on the next scene is reported again
+    merger.add([ship])
+    assert merger.flush() == [ship]
@@ -0,0 +1,69 @@
+import json
+import pytest
+import requests
+
+from metrics import Metrics
+
+
+def make_metrics():
+    metrics = Metrics(prefix='ships_', buckets=(0.1, 1))
+    metrics.inc('tiles', result='decoded')
+    metrics.inc('tiles', 2, result='missing')
+    metrics.inc('tiles', result='decoded')
+    metrics.inc('uploads', location='Port "A"')
+    metrics.observe('detect_seconds', 0.05)
+    metrics.observe('detect_seconds', 0.5)
+    metrics.observe('detect_seconds', 3.0)
+    return metrics
+
+
+def test_prometheus_text_format():
+    assert make_metrics().to_prometheus() == '\n'.join([
+        '# TYPE ships_tiles_total counter',
+        'ships_tiles_total{result="decoded"} 2',
+        'ships_tiles_total{result="missing"} 2',
+        '# TYPE ships_uploads_total counter',
+        'ships_uploads_total{location="Port \\"A\\""} 1',
+        '# TYPE ships_detect_seconds histogram',
+        'ships_detect_seconds_bucket{le="0.1"} 1',
+        'ships_detect_seconds_bucket{le="1"} 2',
+        'ships_detect_seconds_bucket{le="+Inf"} 3',
+        'ships_detect_seconds_sum 3.55',
+        'ships_detect_seconds_count 3',
+    ]) + '\n'
+
+
+def test_since_reports_only_the_new_values():
+    metrics = make_metrics()
+    snapshot = metrics.snapshot()
+    metrics.inc('tiles', result='missing')
+    metrics.observe('detect_seconds', 0.2)
+    delta = metrics.since(snapshot).to_json()
+    assert delta['histograms'][0].pop('sum') == pytest.approx(0.2)
+    assert delta == {
+        'counters': [
+            {'name': 'tiles', 'labels': {'result': 'missing'}, 'value': 1}
+        ],
+        'histograms': [{
+            'name': 'detect_seconds',
+            'labels': {},
+            'buckets': {'0.1': 0, '1': 1},
+            'count': 1
+        }]
+    }
+
+
+def test_served_over_http():
+    metrics = make_metrics()
+    server = metrics.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        response = requests.get(f"{url}/metrics")
+        assert response.status_code == 200
+        assert response.text == metrics.to_prometheus()
+        assert requests.get(f"{url}/metrics.json").json() == \
+            json.loads(metrics.dump('json'))
+        assert requests.get(f"{url}/other").status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
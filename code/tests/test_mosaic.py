@@ -0,0 +1,34 @@
+from config import TILE_SIZE
+from georeference import boxes_to_features, feature_boxes
+from mosaic import canvas_bounds, canvas_tiles, detection_tiles
+
+# canvas with its top left corner on the top left corner of a tile
+ORIGIN = (2620 * TILE_SIZE, 6331 * TILE_SIZE)
+
+
+def canvas_features(boxes, origin=ORIGIN):
+    return boxes_to_features(boxes, [canvas_bounds(*origin)] * len(boxes))
+
+
+def test_detection_spanning_two_tiles_goes_to_its_centre():
+    # columns 200 to 340 straddle the seam of the first two tile columns,
+    # the centre at column 270 is in the second one
+    features = canvas_features([[100, 200, 140, 340]])
+    needed = set(canvas_tiles(*ORIGIN))
+    assert detection_tiles(feature_boxes(features), [ORIGIN], needed) == [
+        (2621, 6331)
+    ]
+
+
+def test_centres_outside_the_scheduled_tiles_are_clamped():
+    # only the left column of tiles is scheduled, eg: the rest belongs to
+    # another scene
+    needed = {(2620, 6331), (2620, 6332), (2620, 6333)}
+    features = canvas_features([
+        [100, 200, 140, 340],
+        [680, 580, 720, 620],
+        [300, 20, 340, 60]
+    ])
+    tiles = detection_tiles(feature_boxes(features), [ORIGIN] * 3, needed)
+    assert tiles == [(2620, 6331), (2620, 6333), (2620, 6332)]
+
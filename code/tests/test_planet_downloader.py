@@ -0,0 +1,79 @@
+import planet_downloader
+
+from planet_downloader import PlanetDownloader
+
+EXTENT = [-122.42, 37.77, -122.36, 37.82]
+OTHER_EXTENT = [-118.30, 33.70, -118.20, 33.78]
+
+START, END = '2020-03-01T00:00:00Z', '2020-03-01T23:59:59Z'
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_downloader(monkeypatch, cache_ttl=60):
+    clock = Clock()
+    monkeypatch.setattr(planet_downloader.time, 'monotonic', clock.monotonic)
+    downloader = PlanetDownloader('key', cache_ttl=cache_ttl)
+    searches = list()
+
+    def search_features(body):
+        searches.append(body)
+        left, down = body['filter']['config'][0]['config'][
+            'coordinates'][0][0]
+        return [{
+            'id': f'scene_{len(searches)}',
+            'properties': {'acquired': START, 'cloud_cover': 0.1},
+            'geometry': {'coordinates': [[
+                [left, down],
+                [left + 0.05, down],
+                [left + 0.05, down + 0.05],
+                [left, down + 0.05],
+                [left, down]
+            ]]}
+        }]
+
+    downloader.search_features = search_features
+    return downloader, clock, searches
+
+
+def test_searches_are_reused_until_they_expire(monkeypatch):
+    downloader, clock, searches = make_downloader(monkeypatch)
+    first = downloader.search_ids(EXTENT, START, END)
+    clock.now += 59
+    assert downloader.search_ids(EXTENT, START, END) == first
+    assert len(searches) == 1
+    # another date window is another search
+    downloader.search_ids(EXTENT, START, '2020-03-02T23:59:59Z')
+    assert len(searches) == 2
+    clock.now += 1
+    assert downloader.search_ids(EXTENT, START, END)[0]['id'] == 'scene_3'
+    assert len(searches) == 3
+
+
+def test_expired_searches_are_dropped(monkeypatch):
+    downloader, clock, searches = make_downloader(monkeypatch)
+    downloader.search_ids(EXTENT, START, END)
+    clock.now += 30
+    downloader.search_ids(OTHER_EXTENT, START, END)
+    assert len(downloader.cache) == 2
+    clock.now += 40
+    # the first search expired, the second one is still valid
+    downloader.search_ids(EXTENT, START, '2020-03-02T23:59:59Z')
+    assert len(downloader.cache) == 2
+    downloader.search_ids(OTHER_EXTENT, START, END)
+    assert len(searches) == 3
+
+
+def test_cache_can_be_disabled(monkeypatch):
+    downloader, _, searches = make_downloader(monkeypatch, cache_ttl=None)
+    downloader.search_ids(EXTENT, START, END)
+    downloader.search_ids(EXTENT, START, END)
+    assert len(searches) == 2
+    assert downloader.cache == {}
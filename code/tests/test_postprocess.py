@@ -0,0 +1,36 @@
+import numpy as np
+
+from config import IMG_SIZE
+from georeference import tile_bounds
+from infer import Infer
+
+# one ship, rows 100 to 180 and columns 120 to 300 of a tile
+ROI = [100, 120, 180, 300]
+
+SCORE = 0.93
+
+
+def make_infer(postprocess):
+    infer = Infer.__new__(Infer)
+    infer.postprocess = postprocess
+    return infer
+
+
+def test_boxes_match_the_masks():
+    bounding_box = tile_bounds([(2620, 6331)]).tolist()[0]
+    labels = np.zeros((IMG_SIZE, IMG_SIZE), dtype=np.int32)
+    labels[ROI[0]:ROI[2], ROI[1]:ROI[3]] = 1
+    expected = make_infer('masks').xy_to_latlon(labels, bounding_box)
+
+    prediction = {'rois': np.array([ROI]), 'scores': np.array([SCORE])}
+    geojsons = make_infer('boxes').calculate_geojson(
+        [prediction], [bounding_box]
+    )
+
+    assert len(expected) == len(geojsons) == 1
+    assert geojsons[0]['geometry'] == expected[0]['geometry']
+    assert geojsons[0]['properties']['area'] == \
+        expected[0]['properties']['area']
+    assert geojsons[0]['properties']['confidence'] == SCORE
+    assert 'confidence' not in expected[0]['properties']
+
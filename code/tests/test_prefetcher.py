@@ -0,0 +1,78 @@
+import pytest
+import time
+
+from prefetcher import Prefetcher
+
+
+class Produced:
+
+    def __init__(self, count, delay=0.0):
+        self.count = count
+        self.delay = delay
+        self.produced = 0
+
+    def __iter__(self):
+        for item in range(self.count):
+            time.sleep(self.delay)
+            self.produced += 1
+            yield item
+
+
+def test_items_keep_their_order():
+    prefetcher = Prefetcher(Produced(50), depth=3)
+    assert list(prefetcher) == list(range(50))
+    assert prefetcher.stats()['items'] == 50
+
+
+def test_producer_stays_at_most_depth_ahead():
+    produced = Produced(20)
+    prefetcher = Prefetcher(produced, depth=2)
+    items = iter(prefetcher)
+    assert next(items) == 0
+    time.sleep(0.3)
+    # two queued, one held by the blocked producer
+    assert produced.produced == 1 + 2 + 1
+    assert list(items) == list(range(1, 20))
+
+
+def test_slow_consumer_is_reported_as_producer_wait():
+    prefetcher = Prefetcher(Produced(5), depth=1)
+    for _ in prefetcher:
+        time.sleep(0.05)
+    stats = prefetcher.stats()
+    assert stats['producer_wait'] >= 0.1
+    assert stats['consumer_wait'] < stats['producer_wait']
+
+
+def test_slow_producer_is_reported_as_consumer_wait():
+    prefetcher = Prefetcher(Produced(5, delay=0.05), depth=2)
+    assert list(prefetcher) == list(range(5))
+    stats = prefetcher.stats()
+    assert stats['produce_time'] >= 0.2
+    assert stats['consumer_wait'] >= 0.2
+    assert stats['producer_wait'] < stats['consumer_wait']
+
+
+def test_errors_reach_the_consumer_in_order():
+
+    def failing():
+        yield 0
+        yield 1
+        raise ValueError('tile server down')
+
+    items = list()
+    with pytest.raises(ValueError):
+        for item in Prefetcher(failing(), depth=4):
+            items.append(item)
+    assert items == [0, 1]
+
+
+def test_producer_stops_when_the_consumer_leaves():
+    produced = Produced(1000)
+    prefetcher = Prefetcher(produced, depth=2)
+    for item in prefetcher:
+        if item == 3:
+            break
+    prefetcher.thread.join(timeout=1)
+    assert not prefetcher.thread.is_alive()
+    assert produced.produced < 10
@@ -0,0 +1,142 @@
+from georeference import tile_bounds
+from scheduler import TileScheduler, choose_batch_size
+
+BATCH_SIZES = [4, 8, 16, 32]
+
+X_INDICES = range(2620, 2624)
+Y_INDICES = range(6331, 6334)
+
+
+def indices(x_indices=X_INDICES, y_indices=Y_INDICES):
+    return [(x_index, y_index) for x_index in x_indices
+            for y_index in y_indices]
+
+
+def footprint(tiles):
+    """
+        Rectangular footprint covering exactly some tiles
+    """
+    bounds = tile_bounds(tiles)
+    west, south = bounds[:, :2].min(axis=0).tolist()
+    east, north = bounds[:, 2:].max(axis=0).tolist()
+    # shrunk a little so it doesn't touch the neighbouring tiles
+    margin = (east - west) * 1e-4
+    west, south, east, north = (
+        west + margin, south + margin, east - margin, north - margin
+    )
+    return [[west, south], [east, south], [east, north], [west, north],
+            [west, south]]
+
+
+def scene(scene_id, cloud_cover=0.1, acquired='2020-03-01T18:00:00Z',
+          tiles=None):
+    item = {'id': scene_id, 'cloud_cover': cloud_cover, 'acquired': acquired}
+    if tiles is not None:
+        item['footprint'] = footprint(tiles)
+    return item
+
+
+def test_tiles_of_overlapping_extents_are_detected_once():
+    scheduler = TileScheduler(None)
+    first = scene('first')
+    second = scene('second')
+    scheduler.add('New York', first, indices(range(2620, 2623)))
+    scheduler.add('Newark', first, indices(range(2622, 2624)))
+    scheduler.add('Newark', second, indices(range(2622, 2624)))
+    units = dict(scheduler.plan())
+
+    assert scheduler.requested == 9 + 6 + 6
+    assert scheduler.unique() == 12 + 6
+    assert sorted(units['first']) == indices()
+    assert sorted(units['second']) == indices(range(2622, 2624))
+    assert scheduler.locations('first', 2620, 6331) == ['New York']
+    assert scheduler.locations('first', 2622, 6331) == ['New York', 'Newark']
+    assert scheduler.locations('second', 2622, 6331) == ['Newark']
+    assert scheduler.locations('second', 2620, 6331) == []
+
+
+def test_least_cloudy_scene_is_preferred():
+    scheduler = TileScheduler('cloud_cover')
+    scheduler.add('New York', scene('cloudy', 0.4), indices())
+    scheduler.add('Newark', scene('clear', 0.05), indices(range(2622, 2625)))
+    scheduler.add('Newark', scene('unknown', None), indices())
+    units = dict(scheduler.plan())
+
+    assert sorted(units['clear']) == indices(range(2622, 2625))
+    assert sorted(units['cloudy']) == indices(range(2620, 2622))
+    assert 'unknown' not in units
+    # a shared tile serves every location from the preferred scene
+    assert scheduler.locations('clear', 2622, 6331) == ['New York', 'Newark']
+    assert scheduler.unique() == len(indices(range(2620, 2625)))
+
+
+def test_latest_scene_is_preferred():
+    scheduler = TileScheduler('latest')
+    scheduler.add('New York', scene('noon', acquired='2020-03-01T12:00:00Z'),
+                  indices())
+    scheduler.add('New York', scene('evening', acquired='2020-03-01T19:00:00Z'),
+                  indices(range(2621, 2623)))
+    units = dict(scheduler.plan())
+
+    assert sorted(units['evening']) == indices(range(2621, 2623))
+    assert sorted(units['noon']) == indices((2620, 2623))
+
+
+def test_tiles_outside_of_the_footprint_go_to_a_covering_scene():
+    scheduler = TileScheduler('cloud_cover')
+    # the clear scene covers its whole range but the corner tile 2623, 6333
+    covered = [tile for tile in indices() if tile != (2623, 6333)]
+    clear = scene('clear', 0.05)
+    (west, south), _, (east, north) = footprint(indices())[:3]
+    corner_west, _, _, corner_north = tile_bounds([(2623, 6333)])[0]
+    margin = (east - west) * 1e-4
+    clear['footprint'] = [
+        [west, south],
+        [corner_west - margin, south],
+        [corner_west - margin, corner_north + margin],
+        [east, corner_north + margin],
+        [east, north],
+        [west, north],
+        [west, south]
+    ]
+    scheduler.add('New York', clear, indices())
+    scheduler.add('New York', scene('cloudy', 0.4, tiles=indices()), indices())
+    units = dict(scheduler.plan())
+
+    assert sorted(units['clear']) == covered
+    assert units['cloudy'] == [(2623, 6333)]
+    assert scheduler.locations('cloudy', 2623, 6333) == ['New York']
+
+
+def test_uncovered_tiles_are_kept_without_a_covering_scene():
+    scheduler = TileScheduler('cloud_cover')
+    scheduler.add('New York', scene('clear', 0.05, tiles=[(2620, 6331)]),
+                  indices())
+    scheduler.add('New York', scene('cloudy', 0.4, tiles=[(2620, 6331)]),
+                  indices())
+    units = dict(scheduler.plan())
+    assert sorted(units['clear']) == indices()
+    assert 'cloudy' not in units
+
+
+def test_batch_size_without_profile():
+    # 100 images: 7 batches of 16 pad less than 4 batches of 32 and have
+    # fewer batch overheads than 13 batches of 8
+    assert choose_batch_size(100, BATCH_SIZES) == 16
+    assert choose_batch_size(64, BATCH_SIZES) == 32
+    # ties go to the largest batch size
+    assert choose_batch_size(20, BATCH_SIZES) == 32
+
+
+def test_batch_size_with_profile():
+    profile = {4: 1.0, 8: 1.2, 16: 2.0, 32: 3.0}
+    assert choose_batch_size(100, BATCH_SIZES, profile) == 32
+    assert choose_batch_size(9, BATCH_SIZES, profile) == 16
+    # a slow large batch size is avoided even when it wastes no slots
+    assert choose_batch_size(64, BATCH_SIZES, {**profile, 32: 5.0}) == 16
+
+
+def test_batch_size_for_fewer_images_than_every_size():
+    assert choose_batch_size(3, BATCH_SIZES) == 4
+    assert choose_batch_size(3, BATCH_SIZES, {4: 1.0, 8: 1.2}) == 4
+    assert choose_batch_size(3, [8, 16]) == 8
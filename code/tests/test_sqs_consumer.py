@@ -0,0 +1,118 @@
+import boto3
+import pytest
+import time
+
+from sqs_consumer import SQSConsumer
+
+moto = pytest.importorskip('moto')
+# moto 5 mocks every service at once
+mock_aws = getattr(moto, 'mock_aws', None) or moto.mock_sqs
+
+QUEUE = 'ship_detection_sqs'
+
+
+@pytest.fixture
+def sqs():
+    with mock_aws():
+        yield boto3.client(
+            'sqs',
+            region_name='us-east-1',
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing'
+        )
+
+
+def make_queue(sqs, count):
+    queue_url = sqs.create_queue(QueueName=QUEUE)['QueueUrl']
+    for index in range(count):
+        sqs.send_message(QueueUrl=queue_url, MessageBody=str(index))
+    return queue_url
+
+
+def make_consumer(sqs, queue_url, **kwargs):
+    return SQSConsumer(
+        QUEUE, client=sqs, queue_url=queue_url, wait_seconds=0, **kwargs
+    )
+
+
+def bodies(sqs, queue_url):
+    messages = sqs.receive_message(
+        QueueUrl=queue_url, MaxNumberOfMessages=10
+    ).get('Messages', [])
+    return sorted(message['Body'] for message in messages)
+
+
+def test_handled_messages_are_deleted_once_per_receive(sqs, monkeypatch):
+    queue_url = make_queue(sqs, 12)
+    consumer = make_consumer(sqs, queue_url)
+    events = list()
+    delete_message_batch = sqs.delete_message_batch
+
+    def count_deletes(**kwargs):
+        events.append(('delete', len(kwargs['Entries'])))
+        return delete_message_batch(**kwargs)
+
+    monkeypatch.setattr(sqs, 'delete_message_batch', count_deletes)
+    consumer.run(
+        lambda message: events.append(('handled', message['Body'])),
+        lambda message: events.append(('deleted', message['Body'])),
+        polls=2
+    )
+    consumer.close()
+    # ten messages per receive at most, every receive handled then deleted
+    # in one call
+    kinds = [kind for kind, _ in events]
+    assert kinds == (
+        ['handled'] * 10 + ['delete'] + ['deleted'] * 10 +
+        ['handled'] * 2 + ['delete'] + ['deleted'] * 2
+    )
+    assert [size for kind, size in events if kind == 'delete'] == [10, 2]
+    handled = [body for kind, body in events if kind == 'handled']
+    deleted = [body for kind, body in events if kind == 'deleted']
+    assert handled == deleted
+    assert sorted(handled) == sorted(str(index) for index in range(12))
+    assert bodies(sqs, queue_url) == []
+    assert consumer.in_flight == {}
+
+
+def test_failure_releases_the_waiting_messages(sqs):
+    queue_url = make_queue(sqs, 5)
+    consumer = make_consumer(sqs, queue_url)
+    handled = list()
+
+    def handle(message):
+        if len(handled) == 2:
+            raise RuntimeError('handler failed')
+        handled.append(message['Body'])
+
+    deleted = list()
+    with pytest.raises(RuntimeError):
+        consumer.run(
+            handle, lambda message: deleted.append(message['Body']), polls=1
+        )
+    consumer.close()
+    assert deleted == handled
+    # handled messages are gone, the others are visible again right away
+    remaining = bodies(sqs, queue_url)
+    assert len(remaining) == 3
+    assert not set(remaining) & set(handled)
+
+
+def test_only_the_handled_message_is_kept_hidden(sqs):
+    queue_url = make_queue(sqs, 2)
+    consumer = make_consumer(sqs, queue_url, visibility_timeout=1)
+    seen = list()
+    handled = list()
+
+    def handle(message):
+        handled.append(message['Body'])
+        if len(handled) == 1:
+            # outlives the visibility timeout, the heartbeat extends it
+            time.sleep(2.5)
+            seen.extend(bodies(sqs, queue_url))
+
+    consumer.run(handle, polls=1)
+    consumer.close()
+    # the waiting message reappeared for other consumers, the handled one
+    # stayed hidden
+    assert seen == sorted({'0', '1'} - {handled[0]})
@@ -0,0 +1,97 @@
+import os
+import pytest
+import tile_cache
+
+from tile_cache import LOW_WATER_MARK, TEMP_SUFFIX, TileCache
+
+SCENE_ID = '20200101_180000_0f00'
+
+TILE = b'\x89PNG' + b'\x00' * 996
+
+
+def files(directory):
+    return [
+        filename
+        for _, _, filenames in os.walk(directory)
+        for filename in filenames
+    ]
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = TileCache(str(tmp_path), 10 ** 6)
+    key = TileCache.key(SCENE_ID, 2620, 6331)
+    assert cache.get(key) is None
+    cache.put(key, TILE)
+    assert cache.get(key) == TILE
+    assert not any(name.endswith(TEMP_SUFFIX) for name in files(tmp_path))
+    # overwriting a tile doesn't count its size twice
+    cache.put(key, TILE)
+    assert cache.stats()['size'] == len(TILE)
+    # a new instance picks the tiles up from disk
+    assert TileCache(str(tmp_path), 10 ** 6).get(key) == TILE
+
+
+def test_failed_put_leaves_no_partial_tile(tmp_path, monkeypatch):
+    cache = TileCache(str(tmp_path), 10 ** 6)
+    key = TileCache.key(SCENE_ID, 2620, 6331)
+
+    def replace(source, destination):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(tile_cache.os, 'replace', replace)
+    with pytest.raises(OSError):
+        cache.put(key, TILE)
+    assert files(tmp_path) == []
+    assert cache.get(key) is None
+
+
+def test_least_recently_used_tiles_are_evicted(tmp_path):
+    cache = TileCache(str(tmp_path), 10 * len(TILE))
+    keys = [TileCache.key(SCENE_ID, 2620, y_index)
+            for y_index in range(6331, 6341)]
+    for age, key in enumerate(keys):
+        cache.put(key, TILE)
+        # written a second apart, the first one is the oldest
+        os.utime(cache.path(key), (1000 + age, 1000 + age))
+    # reading the oldest tile makes it the most recently used
+    assert cache.get(keys[0]) == TILE
+    cache.put(TileCache.key(SCENE_ID, 2621, 6331), TILE)
+
+    size = cache.stats()['size']
+    assert size <= cache.max_size * LOW_WATER_MARK
+    assert size == len(TILE) * len(files(tmp_path))
+    # 11 tiles down to 9, the two oldest after the one read are gone
+    assert cache.stats()['evictions'] == 2
+    assert cache.get(keys[0]) == TILE
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is None
+    assert cache.get(keys[3]) == TILE
+
+
+def test_counters(tmp_path):
+    cache = TileCache(str(tmp_path), 10 ** 6)
+    key = TileCache.key(SCENE_ID, 2620, 6331)
+    cache.get(key)
+    cache.put(key, TILE)
+    cache.get(key)
+    cache.get(key)
+    assert cache.stats() == {
+        'hits': 2, 'misses': 1, 'evictions': 0, 'size': len(TILE)
+    }
+
+
+def test_missing_tiles_expire(tmp_path):
+    cache = TileCache(str(tmp_path), 10 ** 6, missing_ttl=60)
+    key = TileCache.key(SCENE_ID, 2620, 6331)
+    assert cache.get_missing(key) is None
+    cache.put_missing(key, 404)
+    assert cache.get_missing(key) == 404
+    # the tile itself is still not cached
+    assert cache.get(key) is None
+    path = [os.path.join(folder, filename)
+            for folder, _, filenames in os.walk(tmp_path)
+            for filename in filenames][0]
+    os.utime(path, (0, 0))
+    assert cache.get_missing(key) is None
+    assert files(tmp_path) == []
+    assert cache.stats()['size'] == 0
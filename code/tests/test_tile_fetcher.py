@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+import requests
+import threading
+import time
+
+from config import MIN_VALID_FRACTION, TILE_SIZE
+from georeference import tile_bounds
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from infer import Infer
+from io import BytesIO
+from PIL import Image
+from tile_cache import TileCache
+from tile_fetcher import TileFetcher
+
+SCENE_ID = '20200101_180000_0f00'
+
+WORKERS = 3
+
+# 30 tiles, every seventh one missing
+INDICES = [(x_index, y_index) for x_index in range(2620, 2626)
+           for y_index in range(6331, 6336)]
+MISSING = set(INDICES[2::7])
+
+
+def png(x_index, y_index):
+    pixels = np.zeros((TILE_SIZE, TILE_SIZE, 3), np.uint8)
+    pixels[..., 0] = x_index % 256
+    pixels[..., 1] = y_index % 256
+    pixels[..., 2] = 255
+    content = BytesIO()
+    Image.fromarray(pixels, 'RGB').save(content, format='PNG')
+    return content.getvalue()
+
+
+class TileServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), TileHandler)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+
+    def url(self):
+        return (f"http://127.0.0.1:{self.server_port}"
+                f"/{{}}/{{}}/{{}}.png?api_key={{}}")
+
+
+class TileHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.requests += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            _, _, x_index, name = self.path.split('?')[0].split('/')
+            x_index, y_index = int(x_index), int(name.split('.')[0])
+            # delays vary between tiles, so responses arrive out of order
+            time.sleep(0.002 * (y_index % 5 + (x_index % 2) * 5))
+            if (x_index, y_index) in MISSING:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            content = png(x_index, y_index)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = TileServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fetcher(server):
+    fetcher = TileFetcher('key', workers=WORKERS, url=server.url())
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch_keeps_the_order_of_the_indices(server, fetcher):
+    fetched = list(fetcher.fetch(SCENE_ID, INDICES))
+    assert [(x_index, y_index) for x_index, y_index, _, _ in fetched] == \
+        INDICES
+    for x_index, y_index, status_code, content in fetched:
+        if (x_index, y_index) in MISSING:
+            assert status_code == 404
+        else:
+            assert status_code == 200
+            assert content == png(x_index, y_index)
+    assert server.requests == len(INDICES)
+
+
+def test_fetch_bounds_the_requests_in_flight(server, fetcher):
+    fetched = fetcher.fetch(SCENE_ID, INDICES)
+    # the window is filled as soon as the first result is asked for, and
+    # not refilled while the caller holds on to it
+    next(fetched)
+    time.sleep(0.2)
+    assert server.requests == WORKERS * 2
+    assert len(list(fetched)) == len(INDICES) - 1
+    assert server.max_in_flight <= WORKERS * 2
+
+
+def test_cached_tiles_need_no_network(server, tmp_path):
+    cache = TileCache(str(tmp_path), 10 ** 8)
+    fetcher = TileFetcher('key', workers=WORKERS, url=server.url(), cache=cache)
+    try:
+        first = list(fetcher.fetch(SCENE_ID, INDICES))
+        assert server.requests == len(INDICES)
+        # missing tiles are cached as well, as negative entries
+        assert list(fetcher.fetch(SCENE_ID, INDICES)) == first
+        assert server.requests == len(INDICES)
+    finally:
+        fetcher.close()
+
+
+def test_prepare_dataset_matches_serial_download(server, fetcher):
+    infer = Infer.__new__(Infer)
+    infer.batch_sizes = [4]
+    infer.min_valid_fraction = MIN_VALID_FRACTION
+    infer.tile_fetcher = fetcher
+    images, bounding_boxes = list(), list()
+    for batch in infer.prepare_dataset(INDICES, SCENE_ID):
+        assert len(batch) <= 4
+        images.extend(batch.images)
+        bounding_boxes.extend(batch.bounding_boxes)
+
+    # one request after the other, as before the fetcher
+    serial_images, serial_boxes = list(), list()
+    for (x_index, y_index), bounding_box in zip(
+        INDICES, tile_bounds(INDICES).tolist()
+    ):
+        response = requests.get(
+            fetcher.tile_url(SCENE_ID, x_index, y_index)
+        )
+        if response.status_code != 200:
+            continue
+        serial_images.append(infer.decode_tile(response.content))
+        serial_boxes.append(bounding_box)
+
+    assert len(images) == len(INDICES) - len(MISSING)
+    assert bounding_boxes == serial_boxes
+    for image, serial_image in zip(images, serial_images):
+        np.testing.assert_array_equal(image, serial_image)
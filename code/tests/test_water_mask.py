@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from config import ZOOM_LEVEL
+from water_mask import WaterIndex
+
+LAND = (2620, 6331)
+COAST = (2621, 6331)
+SEA = (2622, 6331)
+# not in the index, eg: outside of the land/water raster
+UNKNOWN = (2623, 6331)
+
+
+def write_index(path, zoom=ZOOM_LEVEL):
+    tiles = np.array([SEA, LAND, COAST])
+    np.savez_compressed(
+        path,
+        zoom=zoom,
+        x=tiles[:, 0],
+        y=tiles[:, 1],
+        fraction=np.array([1.0, 0.0, 0.05], dtype=np.float32)
+    )
+    return path
+
+
+def test_land_tiles_are_skipped(tmp_path):
+    index = WaterIndex(write_index(str(tmp_path / 'water.npz')), 0.05)
+    indices = [LAND, COAST, SEA, UNKNOWN]
+    np.testing.assert_allclose(
+        index.water_fractions(indices), [0.0, 0.05, 1.0, np.nan]
+    )
+    # tiles at the minimum and tiles the index doesn't know are kept
+    assert index.filter(indices) == [COAST, SEA, UNKNOWN]
+    assert index.filter([]) == []
+
+
+def test_without_index_nothing_is_skipped(tmp_path):
+    indices = [LAND, COAST, SEA, UNKNOWN]
+    for path in (None, str(tmp_path / 'missing.npz')):
+        index = WaterIndex(path, 0.05)
+        assert index.filter(indices) == indices
+        assert np.isnan(index.water_fractions(indices)).all()
+
+
+def test_index_of_another_zoom_is_rejected(tmp_path):
+    path = write_index(str(tmp_path / 'water.npz'), zoom=ZOOM_LEVEL + 2)
+    with pytest.raises(ValueError):
+        WaterIndex(path, 0.05)
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+from config import (
+    TILE_CACHE_DIR,
+    TILE_CACHE_MISSING_TTL,
+    TILE_CACHE_SIZE,
+    ZOOM_LEVEL
+)
+
+# evict down to this fraction of the cap so every put doesn't trigger a scan
+LOW_WATER_MARK = 0.9
+
+# negative entries, tiles the server had no content for
+MISSING_SUFFIX = '.missing'
+
+TEMP_SUFFIX = '.tmp'
+
+
+class TileCache:
+
+    def __init__(
+        self,
+        directory=TILE_CACHE_DIR,
+        max_size=TILE_CACHE_SIZE,
+        missing_ttl=TILE_CACHE_MISSING_TTL
+    ):
+        """
+            Initializer
+
+        Args:
+            directory (str, optional): folder where tiles are stored
+            max_size (int, optional): size cap of the cache in bytes
+            missing_ttl (int, optional): seconds a negative entry is valid
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.missing_ttl = missing_ttl
+        self.lock = threading.Lock()
+        self.evict_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    @staticmethod
+    def key(scene_id, x_index, y_index, zoom=ZOOM_LEVEL):
+        """
+            Prepare the cache key for a tile
+
+        Args:
+            scene_id (str): planetscope scene id
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+            zoom (int, optional): zoom level of the tile
+
+        Returns:
+            str: cache key
+        """
+        return f"{scene_id}/{zoom}/{x_index}/{y_index}"
+
+    def path(self, key):
+        """
+            Location of a cached tile. Files are addressed by the hash of the
+            key and spread over 256 sub folders.
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            str: path of the cached file
+        """
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """
+            Read a tile from the cache
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            bytes: content of the tile, None if it is not cached
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as cached_file:
+                content = cached_file.read()
+            # modification time is used as the recency for LRU eviction
+            os.utime(path)
+        except OSError:
+            # missing, or evicted by another worker while being read
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return content
+
+    def get_missing(self, key):
+        """
+            Read the negative entry of a tile, left by put_missing
+
+        Args:
+            key (str): cache key
+
+        Returns:
+            int: status code the tile was answered with, None if there is no
+            entry or it expired
+        """
+        path = self.path(key) + MISSING_SUFFIX
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.missing_ttl:
+                os.remove(path)
+                with self.lock:
+                    self.size -= stat.st_size
+                return None
+            with open(path, 'r') as cached_file:
+                status_code = int(cached_file.read())
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.hits += 1
+        return status_code
+
+    def put(self, key, content):
+        """
+            Write a tile into the cache. The file is written to a temporary
+            file first and renamed, so readers never see partial tiles.
+
+        Args:
+            key (str): cache key
+            content (bytes): content of the tile
+        """
+        self.write(self.path(key), content)
+
+    def put_missing(self, key, status_code):
+        """
+            Write a negative entry for a tile the server had no content for,
+            so it isn't requested again until the entry expires. Its age is
+            read from the modification time, which get_missing doesn't touch.
+
+        Args:
+            key (str): cache key
+            status_code (int): status code the tile was answered with
+        """
+        self.write(
+            self.path(key) + MISSING_SUFFIX, str(status_code).encode('utf-8')
+        )
+
+    def write(self, path, content):
+        """
+            Atomically write a cache file, evicting if the cache gets full
+
+        Args:
+            path (str): path of the cached file
+            content (bytes): content of the file
+        """
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        try:
+            # overwritten files only add the difference in size
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=folder, suffix=TEMP_SUFFIX
+        )
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temp_file:
+                temp_file.write(content)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self.lock:
+            self.size += len(content) - replaced
+            full = self.size > self.max_size
+        if full:
+            self.evict()
+
+    def entries(self):
+        """
+            List the cached files
+
+        Returns:
+            list: list of (modification time, size, path)
+        """
+        entries = list()
+        for folder, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith(TEMP_SUFFIX):
+                    continue
+                path = os.path.join(folder, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+            Remove least recently used tiles until the cache is below the low
+            water mark. The folder is rescanned, so tiles written by other
+            workers are accounted for as well. The scan doesn't hold the lock
+            of the counters, and only one thread evicts at a time.
+        """
+        if not self.evict_lock.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                before = self.size
+            entries = sorted(self.entries())
+            size = sum(size for _, size, _ in entries)
+            limit = self.max_size * LOW_WATER_MARK
+            evictions = 0
+            for _, file_size, path in entries:
+                if size <= limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # already removed by another worker
+                    pass
+                size -= file_size
+                evictions += 1
+            with self.lock:
+                self.evictions += evictions
+                # keep what was put while scanning
+                self.size = size + self.size - before
+        finally:
+            self.evict_lock.release()
+
+    def stats(self):
+        """
+            Cache counters
+
+        Returns:
+            dict: hits, misses, evictions and current size in bytes
+        """
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': self.size
+            }
@@ -0,0 +1,135 @@
+import requests
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import FETCH_WORKERS, WMTS_URL
+
+from metrics import METRICS
+from requests.adapters import HTTPAdapter
+from tile_cache import TileCache
+
+# answers for tiles without content, cached as negative entries
+MISSING_STATUS_CODES = (204, 404)
+
+
+class TileFetcher:
+
+    def __init__(
+        self,
+        credential,
+        workers=FETCH_WORKERS,
+        url=WMTS_URL,
+        cache=None
+    ):
+        """
+            Initializer
+
+        Args:
+            credential (str): API credential to Planet
+            workers (int, optional): number of tiles requested concurrently
+            url (str, optional): tile url template taking scene_id, x, y and
+                credential, point it to a local server for testing
+            cache (TileCache, optional): on-disk cache checked before the
+                network, successful downloads are written into it, and tiles
+                without content as negative entries
+        """
+        self.credential = credential
+        self.cache = cache
+        self.workers = workers
+        self.url = url
+        self.session = requests.Session()
+        # one keep-alive pool shared by all the worker threads
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def tile_url(self, scene_id, x_index, y_index):
+        """
+            Prepare the WMTS url for a single tile
+
+        Args:
+            scene_id (str): planetscope scene id
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+
+        Returns:
+            str: url of the tile
+        """
+        return self.url.format(scene_id, x_index, y_index, self.credential)
+
+    def fetch_one(self, scene_id, x_index, y_index):
+        """
+            Download a single tile
+
+        Args:
+            scene_id (str): planetscope scene id
+            x_index (int): x index of the tile
+            y_index (int): y index of the tile
+
+        Returns:
+            tuple: status code, content of the response
+        """
+        if self.cache is not None:
+            key = TileCache.key(scene_id, x_index, y_index)
+            status_code = self.cache.get_missing(key)
+            if status_code is not None:
+                METRICS.inc('tile_fetches', source='cache', status=status_code)
+                return status_code, b''
+            content = self.cache.get(key)
+            if content is not None:
+                METRICS.inc('tile_fetches', source='cache')
+                return 200, content
+        with METRICS.timer('tile_fetch_seconds'):
+            response = self.session.get(
+                self.tile_url(scene_id, x_index, y_index)
+            )
+        METRICS.inc(
+            'tile_fetches',
+            source='network',
+            status=response.status_code
+        )
+        if self.cache is not None and response.status_code == 200:
+            self.cache.put(key, response.content)
+        elif self.cache is not None and \
+                response.status_code in MISSING_STATUS_CODES:
+            self.cache.put_missing(key, response.status_code)
+        return response.status_code, response.content
+
+    def fetch(self, scene_id, indices):
+        """
+            Download tiles concurrently. Results are yielded in the same order
+            as the indices, and at most twice the number of workers are kept
+            in flight so memory stays bounded.
+
+        Args:
+            scene_id (str): planetscope scene id
+            indices (list): list of x, y indices
+
+        Yields:
+            tuple: x index, y index, status code, content of the response
+        """
+        indices = iter(indices)
+        pending = deque()
+        while True:
+            while len(pending) < self.workers * 2:
+                index = next(indices, None)
+                if index is None:
+                    break
+                pending.append((
+                    index,
+                    self.executor.submit(self.fetch_one, scene_id, *index)
+                ))
+            if not pending:
+                break
+            (x_index, y_index), future = pending.popleft()
+            status_code, content = future.result()
+            yield x_index, y_index, status_code, content
+
+    def close(self):
+        """
+            Shut down the worker threads and the connection pool
+        """
+        self.executor.shutdown(wait=True)
+        self.session.close()
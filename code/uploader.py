@@ -6,6 +6,7 @@ import requests
 import subprocess
 
 from glob import glob
+from metrics import METRICS
 from rasterio.io import MemoryFile
 from rasterio.warp import reproject, calculate_default_transform, Resampling
 from zipfile import ZipFile
@@ -53,12 +54,16 @@ class Uploader:
             password (str): ImageLabeler Password
         """
         self.csrf_token = self.login(username, password)
+        # shapes uploaded per location and date, so streamed detections of
+        # the same date don't reuse file names
+        self.uploaded = dict()
         Uploader.mkdir('updated')
 
 
     def upload_detections(self, detections):
         """
-        Upload shapes to imagelabeler
+        Upload shapes to imagelabeler, can be called several times per date
+        with parts of its detections
 
         Args:
             detections (dict): Dict of detections
@@ -76,9 +81,25 @@ class Uploader:
             location_name = detection['location'].replace(' ', '')
             polygons = detection['geojson']['features']
             filename_format = f"{location_name}_{date}T000000_{{}}"
-            for index, polygon in enumerate(polygons):
+            offset = self.uploaded.get((location_name, date), 0)
+            for index, polygon in enumerate(polygons, offset):
                 filename = filename_format.format(index)
                 self.upload_one_shapefile(polygon, filename)
+            self.uploaded[(location_name, date)] = offset + len(polygons)
+
+
+    def resume(self, location, date, count):
+        """
+        Continue numbering shapes after the ones uploaded by an earlier
+        attempt, so their files aren't overwritten
+
+        Args:
+            location (str): label of the location, eg: 'New York'
+            date (str): date in 'yyyy-mm-dd' format
+            count (int): number of shapes uploaded before
+        """
+        key = (location.replace(' ', ''), date.replace('-', ''))
+        self.uploaded[key] = count
 
 
     def upload_geotiffs(self, file_name):
@@ -246,10 +267,14 @@ class Uploader:
             files = {
                 'file': (file_name, upload_file_name),
             }
-            response = self.client.post(
-                IL_URL[file_type],
-                data=self.login_data,
-                files=files, headers=file_headers
+            with METRICS.timer('upload_seconds', file_type=file_type):
+                response = self.client.post(
+                    IL_URL[file_type],
+                    data=self.login_data,
+                    files=files, headers=file_headers
+                )
+            METRICS.inc(
+                'uploads', file_type=file_type, status=response.status_code
             )
             return response.text, response.status_code
 
@@ -0,0 +1,185 @@
+import argparse
+import mercantile
+import numpy as np
+import os
+import rasterio
+
+from config import (
+    CACHE_SITES,
+    MIN_WATER_FRACTION,
+    WATER_INDEX_FILE,
+    ZOOM_LEVEL
+)
+
+from georeference import tile_bounds
+from rasterio.warp import transform_bounds
+from rasterio.windows import from_bounds
+
+# pixels sampled per tile side when building the index
+SAMPLES = 64
+
+
+def tile_keys(indices, zoom):
+    """
+        Encode x, y tile indices into single integers
+
+    Args:
+        indices (list): list of x, y indices
+        zoom (int): zoom level of the tiles
+
+    Returns:
+        numpy.ndarray: int64 keys
+    """
+    indices = np.asarray(indices, dtype=np.int64).reshape(-1, 2)
+    return indices[:, 0] * (2 ** zoom) + indices[:, 1]
+
+
+class WaterIndex:
+
+    def __init__(self, path=WATER_INDEX_FILE, min_fraction=MIN_WATER_FRACTION):
+        """
+            Initializer. Loads the per tile water fraction index built by
+            build_index. Without an index nothing is filtered.
+
+        Args:
+            path (str, optional): location of the index file
+            min_fraction (float, optional): tiles with less water are skipped
+        """
+        self.min_fraction = min_fraction
+        self.keys = None
+        self.fractions = None
+        if not path or not os.path.exists(path):
+            print(f"water index not found: {path}, land tiles are not skipped")
+            return
+        index = np.load(path)
+        if int(index['zoom']) != ZOOM_LEVEL:
+            raise ValueError(
+                f"water index is built for zoom {int(index['zoom'])}, "
+                f"tiles are at zoom {ZOOM_LEVEL}"
+            )
+        keys = tile_keys(np.stack([index['x'], index['y']], axis=1), ZOOM_LEVEL)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.fractions = index['fraction'][order]
+
+    def water_fractions(self, indices):
+        """
+            Look up the water fraction of tiles
+
+        Args:
+            indices (list): list of x, y indices
+
+        Returns:
+            numpy.ndarray: water fraction of every tile, nan if the tile is not
+            in the index
+        """
+        result = np.full(len(indices), np.nan)
+        if self.keys is None or not len(indices) or not len(self.keys):
+            return result
+        keys = tile_keys(indices, ZOOM_LEVEL)
+        positions = np.minimum(
+            np.searchsorted(self.keys, keys), len(self.keys) - 1
+        )
+        found = self.keys[positions] == keys
+        result[found] = self.fractions[positions[found]]
+        return result
+
+    def filter(self, indices):
+        """
+            Drop tiles with less water than the minimum fraction. Tiles
+            missing from the index are kept.
+
+        Args:
+            indices (list): list of x, y indices
+
+        Returns:
+            list: list of x, y indices to be processed
+        """
+        if self.keys is None:
+            return indices
+        fractions = self.water_fractions(indices)
+        return [
+            index for index, fraction in zip(indices, fractions)
+            if not fraction < self.min_fraction
+        ]
+
+
+def build_index(
+    raster_path,
+    extents,
+    output_path=WATER_INDEX_FILE,
+    water_value=1
+):
+    """
+        Build the water fraction index of every tile covering the extents from
+        a land/water raster, eg: a rasterized coastline dataset
+
+    Args:
+        raster_path (str): land/water raster, water pixels set to water_value
+        extents (list): list of [left, down, right, up] extents
+        output_path (str, optional): location of the index file
+        water_value (int, optional): pixel value of water in the raster
+
+    Returns:
+        int: number of tiles in the index
+    """
+    tiles = set()
+    for extent in extents:
+        for tile in mercantile.tiles(*extent, [ZOOM_LEVEL]):
+            tiles.add((tile.x, tile.y))
+    tiles = sorted(tiles)
+
+    fractions = list()
+    indexed = list()
+    with rasterio.open(raster_path) as raster:
+        for tile, bounds in zip(tiles, tile_bounds(tiles)):
+            west, south, east, north = transform_bounds(
+                'EPSG:4326', raster.crs, *bounds
+            )
+            if (
+                east <= raster.bounds.left or west >= raster.bounds.right or
+                north <= raster.bounds.bottom or south >= raster.bounds.top
+            ):
+                # not covered by the raster, left out so it is never skipped
+                continue
+            window = from_bounds(
+                west, south, east, north, transform=raster.transform
+            )
+            # parts outside of the raster count as water
+            data = raster.read(
+                1,
+                window=window,
+                out_shape=(SAMPLES, SAMPLES),
+                boundless=True,
+                fill_value=water_value
+            )
+            indexed.append(tile)
+            fractions.append(np.mean(data == water_value))
+
+    indexed = np.asarray(indexed, dtype=np.int64).reshape(-1, 2)
+    np.savez_compressed(
+        output_path,
+        zoom=ZOOM_LEVEL,
+        x=indexed[:, 0],
+        y=indexed[:, 1],
+        fraction=np.asarray(fractions, dtype=np.float32)
+    )
+    return len(indexed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the per tile water fraction index'
+    )
+    parser.add_argument('raster', help='land/water raster')
+    parser.add_argument('--output', default=WATER_INDEX_FILE)
+    parser.add_argument('--water-value', type=int, default=1)
+    args = parser.parse_args()
+
+    count = build_index(
+        args.raster,
+        [site['bounding_box'] for site in CACHE_SITES],
+        args.output,
+        args.water_value
+    )
+    print(f"{count} tiles written to {args.output}")